@@ -1,12 +1,20 @@
 import os
 import json
-from typing import List, Dict, Optional, Generator
+import math
+import hashlib
+from collections import Counter
+from typing import List, Dict, Optional, Generator, Callable
 from pathlib import Path
+from concurrent.futures import as_completed
 import re
-from openai import OpenAI
-from tenacity import retry, stop_after_attempt, wait_exponential
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_exponential
 from dotenv import load_dotenv
-from constants import DEFAULT_MODEL, OPENAI_BASE_URL
+from constants import (
+    DEFAULT_MODEL, OPENAI_BASE_URL, EXTRACTION_CONCURRENCY,
+    EXTRACTION_TOKEN_BUDGET, EXTRACTION_CHUNK_TOKENS, EXTRACTION_MAP_CONCURRENCY,
+    EXTRACTION_RETRIEVAL_CHUNK_TOKENS, EXTRACTION_TOP_K
+)
+from services.llm_gateway import chat_completion, get_client, ContextThreadPoolExecutor, estimate_tokens
 
 load_dotenv(override=True)
 
@@ -34,6 +42,46 @@ def extract_json(content: str):
             continue
     return ""
 
+# 按此策略丢弃的章节：参考文献、致谢及其后的附录
+DROPPED_SECTIONS = ("references", "bibliography", "acknowledgment", "acknowledgement",
+                    "appendix", "appendices", "supplementary", "参考文献", "致谢", "附录")
+
+_STOPWORDS = {
+    "a", "an", "and", "are", "by", "does", "for", "from", "in", "introduced", "is", "of", "on",
+    "paper", "the", "this", "to", "was", "were", "what", "which", "with"
+}
+
+def tokenize(text: str) -> List[str]:
+    """英文按单词、中文按相邻字对切分"""
+    words = [w for w in re.findall(r"[a-z][a-z0-9\-]+|\d+", text.lower()) if w not in _STOPWORDS]
+    cjk = re.findall(r"[\u4e00-\u9fff]+", text)
+    words += [run[i:i + 2] for run in cjk for i in range(max(1, len(run) - 1))]
+    return words
+
+class BM25Index:
+    """论文块的轻量级内存 BM25 索引"""
+
+    def __init__(self, documents: List[str], k1: float = 1.5, b: float = 0.75):
+        self.k1, self.b = k1, b
+        self.term_freqs = [Counter(tokenize(doc)) for doc in documents]
+        self.lengths = [sum(tf.values()) for tf in self.term_freqs]
+        self.avg_length = (sum(self.lengths) / len(self.lengths)) if self.lengths else 0
+        doc_freqs = Counter(term for tf in self.term_freqs for term in tf)
+        n = len(documents)
+        self.idf = {term: math.log(1 + (n - df + 0.5) / (df + 0.5)) for term, df in doc_freqs.items()}
+
+    def scores(self, query: str) -> List[float]:
+        terms = tokenize(query)
+        results = []
+        for tf, length in zip(self.term_freqs, self.lengths):
+            score = 0.0
+            norm = self.k1 * (1 - self.b + self.b * length / (self.avg_length or 1))
+            for term in terms:
+                if term in tf:
+                    score += self.idf[term] * tf[term] * (self.k1 + 1) / (tf[term] + norm)
+            results.append(score)
+        return results
+
 class PaperProcessor:
     def __init__(self, root_dir: str = "./mds"):
         self.root_dir = Path(root_dir)
@@ -60,49 +108,146 @@ class PaperProcessor:
             print(f"读取文件失败 {md_path}: {str(e)}")
             return ""
 
+    @staticmethod
+    def split_sections(content: str, drop_policy: tuple = DROPPED_SECTIONS) -> List[Dict]:
+        """
+        按Markdown标题切分章节，返回 [{"title", "text", "tokens"}]
+        遇到参考文献/附录等标题后，该章节及其后所有内容按策略丢弃
+        """
+        sections = []
+        title, lines = "", []
+
+        def flush():
+            text = "\n".join(lines).strip()
+            if text:
+                sections.append({"title": title, "text": text, "tokens": estimate_tokens(text)})
+
+        for line in content.splitlines():
+            heading = re.match(r"^#{1,6}\s+(.*)$", line)
+            if heading:
+                flush()
+                title, lines = heading.group(1).strip(), [line]
+                # 去掉 "7"、"A.1"、"IV." 等编号后再匹配
+                normalized = re.sub(r"^(?:\d+(?:\.\d+)*|[A-Z](?:\.\d+)*|[IVX]+)\.?\s+", "", title).lower()
+                if any(normalized.startswith(name) for name in drop_policy):
+                    return sections
+            else:
+                lines.append(line)
+        flush()
+        return sections
+
+    @staticmethod
+    def chunk_sections(sections: List[Dict], chunk_tokens: int) -> List[Dict]:
+        """
+        将章节打包为不超过 chunk_tokens 的块，超长章节按段落拆分
+        返回 [{"titles", "text", "tokens"}]
+        """
+        pieces = []
+        for section in sections:
+            if section["tokens"] <= chunk_tokens:
+                pieces.append(section)
+                continue
+            paragraphs, current = section["text"].split("\n\n"), []
+            for paragraph in paragraphs:
+                # 单个段落超过 chunk_tokens 时才按字符硬切，切片长度按该段的字符/token 比例换算
+                tokens = estimate_tokens(paragraph)
+                step = max(1, len(paragraph) if tokens <= chunk_tokens else len(paragraph) * (chunk_tokens - 1) // tokens)
+                for start in range(0, len(paragraph), step):
+                    part = paragraph[start:start + step]
+                    if current and estimate_tokens("\n\n".join(current + [part])) > chunk_tokens:
+                        text = "\n\n".join(current)
+                        pieces.append({"title": section["title"], "text": text, "tokens": estimate_tokens(text)})
+                        current = []
+                    current.append(part)
+            if current:
+                text = "\n\n".join(current)
+                pieces.append({"title": section["title"], "text": text, "tokens": estimate_tokens(text)})
+
+        chunks = []
+        for piece in pieces:
+            if chunks and chunks[-1]["tokens"] + piece["tokens"] <= chunk_tokens:
+                chunks[-1]["titles"].append(piece["title"])
+                chunks[-1]["text"] += "\n\n" + piece["text"]
+                chunks[-1]["tokens"] += piece["tokens"]
+            else:
+                chunks.append({"titles": [piece["title"]], "text": piece["text"], "tokens": piece["tokens"]})
+        return chunks
+
 
 
 class KeyElementExtractor:
-    def __init__(self, api_key: str, model: str = DEFAULT_MODEL):
-        self.client = OpenAI(
-            api_key=api_key,
-            base_url=os.getenv("OPENAI_BASE_URL", OPENAI_BASE_URL)
-            )
+    # 提示词或提取流程变更时递增，使已缓存的提取结果失效
+    PROMPT_VERSION = 2
+
+    def __init__(self, api_key: str, model: str = DEFAULT_MODEL,
+                 token_budget: int = EXTRACTION_TOKEN_BUDGET, chunk_tokens: int = EXTRACTION_CHUNK_TOKENS,
+                 retrieval_chunk_tokens: int = EXTRACTION_RETRIEVAL_CHUNK_TOKENS, top_k: int = EXTRACTION_TOP_K):
+        self.client = get_client(os.getenv("OPENAI_BASE_URL", OPENAI_BASE_URL), api_key)
         self.model = model
+        self.token_budget = token_budget
+        self.chunk_tokens = chunk_tokens
+        self.retrieval_chunk_tokens = retrieval_chunk_tokens
+        self.top_k = top_k
         self.questions = [
             {
                 "en": "What research questions does the paper attempt to address?",
-                "key": "research_questions"
+                "key": "research_questions",
+                "sections": ["abstract", "introduction", "motivation", "摘要", "引言"]
             },
             {
                 "en": "What method does the paper employ to address this issue?",
-                "key": "methodology"
+                "key": "methodology",
+                "sections": ["method", "approach", "model", "framework", "architecture", "algorithm", "方法", "模型"]
             },
             {
                 "en": "What were the obtained experimental results in the paper?",
-                "key": "results"
+                "key": "results",
+                "sections": ["experiment", "result", "evaluation", "benchmark", "analysis", "实验", "结果"]
             },
             {
                 "en": "What conclusions were drawn from the experiments?",
-                "key": "conclusions"
+                "key": "conclusions",
+                "sections": ["conclusion", "discussion", "summary", "结论", "讨论"]
             },
             {
                 "en": "What contributions does this paper make?",
-                "key": "contributions"
+                "key": "contributions",
+                "sections": ["abstract", "introduction", "contribution", "conclusion", "摘要", "引言", "贡献"]
             },
             {
                 "en": "What are the innovations introduced in the paper?",
-                "key": "innovations"
+                "key": "innovations",
+                "sections": ["abstract", "introduction", "method", "approach", "摘要", "引言", "方法"]
             },
             {
                 "en": "What limitations are identified in the paper?",
-                "key": "limitations"
+                "key": "limitations",
+                "sections": ["limitation", "discussion", "conclusion", "future", "局限", "讨论", "结论"]
             }
         ]
 
     
-    def _build_prompt(self, content: str) -> str:
-        """提示词模板"""
+    def cache_key(self, content: str) -> str:
+        """提取结果的缓存键：清洗后正文、模型、问题集及提取参数共同决定"""
+        signature = json.dumps({
+            "model": self.model,
+            "prompt_version": self.PROMPT_VERSION,
+            "questions": self.questions,
+            "token_budget": self.token_budget,
+            "chunk_tokens": self.chunk_tokens,
+            "retrieval_chunk_tokens": self.retrieval_chunk_tokens,
+            "top_k": self.top_k
+        }, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(f"{signature}\n{content}".encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def is_complete(result: Dict) -> bool:
+        """结果中没有提取失败的字段（失败结果不应被缓存）"""
+        return all(value != "提取失败" for value in result.values())
+
+    def _build_prompt(self, content: str, questions: Optional[List[Dict]] = None, excerpt: bool = False) -> str:
+        """提示词模板；excerpt 为 True 时 content 是论文的部分章节"""
+        questions = questions or self.questions
         system_prompt = """您是一位经验丰富的学术研究员，需要从科研论文中提取结构化信息。请仔细阅读以下内容并按顺序回答每个问题：
 
 要求：
@@ -112,45 +257,106 @@ class KeyElementExtractor:
 4. 使用规范的学术表达方式"""
 
         question_items = "\n".join(
-            [f"{idx+1}. [{q['en']}]" for idx, q in enumerate(self.questions)]
+            [f"{idx+1}. [{q['en']}]" for idx, q in enumerate(questions)]
         )
+        content_label = "论文节选内容（仅依据节选作答）" if excerpt else "论文全文内容"
 
         prompt = f"""{system_prompt}
 
 需要回答的问题列表：
 {question_items}
 
-论文全文内容：
+{content_label}：
 {content}
 
 请严格按照以下JSON格式输出：
-{json.dumps({q['key']: "..." for q in self.questions}, indent=2, ensure_ascii=False)}"""
+{json.dumps({q['key']: "..." for q in questions}, indent=2, ensure_ascii=False)}"""
         
         return prompt
 
     
-    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
+    # 只重试输出解析失败（JSONDecodeError 属于 ValueError，内容为空时为 TypeError）；
+    # 连接错误和 429/5xx 已由共享客户端重试，此处不再叠加；重试耗尽后由 process_paper 兜底
+    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10),
+           retry=retry_if_exception_type((ValueError, TypeError)), reraise=True)
     def _call_llm(self, prompt: str) -> Optional[Dict]:
-        try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                response_format={"type": "json_object"},
-                messages=[
-                    {"role": "system", "content": "你是一个专业的学术研究助理，擅长从论文中提取结构化信息"},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.2,
-                max_tokens=1024
-            )
-            return json.loads(response.choices[0].message.content)
-        except Exception as e:
-            print(f"API调用失败: {str(e)}")
+        response = chat_completion(
+            self.client,
+            "review.extract",
+            model=self.model,
+            response_format={"type": "json_object"},
+            messages=[
+                {"role": "system", "content": "你是一个专业的学术研究助理，擅长从论文中提取结构化信息"},
+                {"role": "user", "content": prompt}
+            ],
+            temperature=0.2,
+            max_tokens=1024
+        )
+        return json.loads(response.choices[0].message.content)
+
+    def _retrieve(self, index: BM25Index, chunks: List[Dict], question: Dict, budget: int) -> List[Dict]:
+        """为问题检索最相关的 top_k 个块（标题匹配加权），总量不超过 budget，按原文顺序返回"""
+        scores = index.scores(f"{question['en']} {' '.join(question['sections'])}")
+        for idx, chunk in enumerate(chunks):
+            titles = " ".join(chunk["titles"]).lower()
+            if any(word in titles for word in question["sections"]):
+                scores[idx] = (scores[idx] + 1) * 1.5
+
+        ranked = sorted(range(len(chunks)), key=lambda idx: scores[idx], reverse=True)
+        selected, used = [], 0
+        for idx in ranked[:self.top_k]:
+            if selected and used + chunks[idx]["tokens"] > budget:
+                break
+            selected.append(idx)
+            used += chunks[idx]["tokens"]
+        return [chunks[idx] for idx in sorted(selected)]
+
+    def _extract_by_question(self, sections: List[Dict]) -> Optional[Dict]:
+        """为每个问题检索相关块并并行提取，每个问题只发送自己的 top_k 块"""
+        chunks = PaperProcessor.chunk_sections(sections, self.retrieval_chunk_tokens)
+        index = BM25Index([" ".join(chunk["titles"]) + "\n" + chunk["text"] for chunk in chunks])
+        budget = self.token_budget // len(self.questions)
+
+        def answer(question):
+            selected = self._retrieve(index, chunks, question, budget)
+            content = "\n\n".join(chunk["text"] for chunk in selected)
+            try:
+                return self._call_llm(self._build_prompt(content, [question], excerpt=True)) or {}
+            except Exception as e:
+                print(f"问题提取失败 {question['key']}: {str(e)}")
+                return {}
+
+        with ContextThreadPoolExecutor(max_workers=min(EXTRACTION_MAP_CONCURRENCY, len(self.questions))) as executor:
+            answers = list(executor.map(answer, self.questions))
+
+        if not any(answers):
             return None
+        result = {}
+        for question, partial in zip(self.questions, answers):
+            if question["key"] in partial:
+                result[question["key"]] = partial[question["key"]]
+            elif not partial:
+                # 调用失败的问题单独标记，避免结果被当作完整结果缓存
+                result[question["key"]] = "提取失败"
+        return result
 
     def process_paper(self, paper_content: str) -> Dict:
-        """处理单篇论文"""
-        prompt = self._build_prompt(paper_content)
-        result = self._call_llm(prompt)
+        """
+        处理单篇论文
+        按标题切分章节并按策略丢弃参考文献/附录；在单块预算内直接整篇提取，
+        否则建立块索引，每个问题检索相关块后并行提取，总输入量受 token_budget 约束
+        """
+        sections = PaperProcessor.split_sections(paper_content)
+        total_tokens = sum(section["tokens"] for section in sections)
+        try:
+            if total_tokens <= self.chunk_tokens:
+                content = "\n\n".join(section["text"] for section in sections) or paper_content
+                result = self._call_llm(self._build_prompt(content))
+            else:
+                result = self._extract_by_question(sections)
+        except Exception as e:
+            print(f"API调用失败: {str(e)}")
+            result = None
         
         # 结果后处理
         if result:
@@ -160,9 +366,20 @@ class KeyElementExtractor:
             return result
         return {q['key']: "提取失败" for q in self.questions}
 
-    def batch_process(self, papers: List[str]) -> List[Dict]:
-        """批量处理论文集"""
-        return [self.process_paper(paper) for paper in papers]
+    def batch_process(self, papers: List[str], max_workers: int = EXTRACTION_CONCURRENCY,
+                      on_progress: Optional[Callable[[int, int], None]] = None) -> List[Dict]:
+        """批量并发处理论文集，结果顺序与输入一致；on_progress(已完成数, 总数) 每完成一篇调用一次"""
+        if not papers:
+            return []
+
+        results = [None] * len(papers)
+        with ContextThreadPoolExecutor(max_workers=min(max_workers, len(papers))) as executor:
+            futures = {executor.submit(self.process_paper, paper): idx for idx, paper in enumerate(papers)}
+            for done, future in enumerate(as_completed(futures), 1):
+                results[futures[future]] = future.result()
+                if on_progress:
+                    on_progress(done, len(papers))
+        return results
 
 
 
@@ -1,11 +1,16 @@
 import re
 import json
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Callable
 from openai import OpenAI
 from tenacity import retry, stop_after_attempt, wait_exponential
 import os
 from dotenv import load_dotenv
-from constants import DEFAULT_MODEL, REVIEW_MODEL, OPENAI_BASE_URL
+from constants import (
+    DEFAULT_MODEL, REVIEW_MODEL, OPENAI_BASE_URL,
+    ROLLING_CONTEXT_PARAGRAPHS, ROLLING_SUMMARY_MAX_TOKENS
+)
+from ComparativeReviewer.ReviewSynthesizer import sample_completions, score_candidates
+from services.llm_gateway import chat_completion, usage_meter, estimate_tokens
 
 load_dotenv(override=True)
 
@@ -34,6 +39,88 @@ def extract_json(content: str):
             continue
     return ""
 
+class RollingContext:
+    def __init__(self, client: OpenAI, model: str = DEFAULT_MODEL,
+                 recent_paragraphs: int = ROLLING_CONTEXT_PARAGRAPHS,
+                 summary_max_tokens: int = ROLLING_SUMMARY_MAX_TOKENS):
+        """
+        逐篇生成综述时的滚动上下文：压缩后的前文概要 + 最近 recent_paragraphs 个原文段落
+        超出窗口的段落被合并进概要，每步提示词长度有上限，总成本随论文数线性增长
+        recent_paragraphs 为 0 时退化为发送完整的已有综述
+        """
+        self.client = client
+        self.model = model
+        self.recent_paragraphs = recent_paragraphs
+        self.summary_max_tokens = summary_max_tokens
+        self.paragraphs: List[str] = []
+        self.summary = ""
+        self._summarized = 0  # 已合并进概要的段落数
+
+    def text(self) -> str:
+        """完整的综述（所有段落）"""
+        return "\n\n".join(self.paragraphs)
+
+    def context(self) -> str:
+        """生成下一段时发送给模型的上下文"""
+        if self.recent_paragraphs <= 0:
+            return self.text()
+        recent = "\n\n".join(self.paragraphs[self._summarized:])
+        if not self.summary:
+            return recent
+        return f"【前文概要】\n{self.summary}\n\n【最近段落】\n{recent}"
+
+    def add(self, paragraph: str) -> Dict[str, int]:
+        """
+        追加一个段落，必要时将滑出窗口的段落压缩进概要
+        返回压缩调用的 token 用量
+        """
+        self.paragraphs.append(paragraph)
+        usage = {"prompt_tokens": 0, "completion_tokens": 0}
+        if self.recent_paragraphs <= 0 or len(self.paragraphs) - self._summarized <= self.recent_paragraphs:
+            return usage
+
+        end = len(self.paragraphs) - self.recent_paragraphs
+        outgoing = "\n\n".join(self.paragraphs[self._summarized:end])
+        prompt = f"""以下是一篇相关工作综述的已有概要和新滑出窗口的段落。
+请将二者合并为一份更新后的概要，要求：
+1. 保留每篇已讨论论文的名称/方法及其与其他工作的关系
+2. 保留综述已形成的组织脉络，便于后续段落衔接
+3. 不超过{self.summary_max_tokens}个token，只输出概要本身
+
+已有概要：
+{self.summary if self.summary else '（无）'}
+
+新段落：
+{outgoing}"""
+        try:
+            response = chat_completion(
+                self.client,
+                "review.compress_context",
+                model=self.model,
+                messages=[
+                    {"role": "system", "content": "你是一位擅长压缩学术文本的研究助理"},
+                    {"role": "user", "content": prompt}
+                ],
+                temperature=0.3,
+                max_tokens=self.summary_max_tokens
+            )
+            self.summary = response.choices[0].message.content or self.summary
+            usage = token_usage(response, prompt)
+        except Exception as e:
+            # 压缩失败时保留原文段落，下一步再尝试
+            print(f"上下文压缩失败: {str(e)}")
+            return usage
+        self._summarized = end
+        return usage
+
+def token_usage(response, prompt: str = "") -> Dict[str, int]:
+    """读取接口返回的 token 用量，缺失时按提示词估算"""
+    usage = getattr(response, "usage", None)
+    if usage is not None:
+        return {"prompt_tokens": usage.prompt_tokens or 0, "completion_tokens": usage.completion_tokens or 0}
+    content = response.choices[0].message.content or ""
+    return {"prompt_tokens": estimate_tokens(prompt), "completion_tokens": estimate_tokens(content)}
+
 class ComparativeSummarizer:
     def __init__(self, client: OpenAI, model: str = DEFAULT_MODEL):
         self.client = client
@@ -71,25 +158,20 @@ class ComparativeSummarizer:
 
     @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
     def generate(self, ref_i: Dict, prev_summary: str, n_samples: int) -> List[str]:
-        """生成多个候选综述段落"""
+        """生成多个候选综述段落（n 参数或并发采样）"""
         system_prompt, prompt = self._build_prompt(ref_i, prev_summary)
-        summaries = []
-        
-        for _ in range(n_samples):
-            try:
-                response = self.client.chat.completions.create(
-                    model=self.model,
-                    messages=[
-                        {"role": "system", "content": system_prompt},
-                        {"role": "user", "content": prompt}
-                    ],
-                    temperature=0.7,
-                    max_tokens=512  # 减小token数以控制生成长度
-                )
-                summaries.append(response.choices[0].message.content)
-            except Exception as e:
-                print(f"生成失败: {str(e)}")
-                summaries.append("")
+        summaries = sample_completions(
+            self.client,
+            n_samples,
+            call_site="review.summarize",
+            model=self.model,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": prompt}
+            ],
+            temperature=0.7,
+            max_tokens=512  # 减小token数以控制生成长度
+        )
                 
         print(f"生成的候选综述：{summaries}")
         return [s for s in summaries if s]  # 过滤空结果
@@ -116,72 +198,91 @@ class ReflectiveEvaluator:
 
     @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
     def evaluate(self, summaries: List[str], n_votes: int) -> List[float]:
-        """对每个候选综述进行多次评估"""
-        all_scores = []
-        
-        for summary in summaries:
-            scores = []
-            for _ in range(n_votes):
-                try:
-                    response = self.client.chat.completions.create(
-                        model=self.model,
-                        response_format={"type": "json_object"},
-                        messages=[
-                            {"role": "system", "content": "你是一个严格的学术写作评估专家"},
-                            {"role": "user", "content": self._build_eval_prompt(summary)}
-                        ],
-                        temperature=0.3
-                    )
-                    result = json.loads(extract_json(response.choices[0].message.content))
-                    scores.append(float(result["score"]))
-                except Exception as e:
-                    print(f"评估失败: {str(e)}")
-                    scores.append(0)
-                    
-            all_scores.append(sum(scores) / len(scores))  # 取平均分
-            
-        return all_scores
+        """对每个候选综述并行进行多次评估，投票一致时提前停止"""
+        return score_candidates(
+            self.client,
+            summaries,
+            n_votes,
+            lambda summary: [
+                {"role": "system", "content": "你是一个严格的学术写作评估专家"},
+                {"role": "user", "content": self._build_eval_prompt(summary)}
+            ],
+            model=self.model
+        )
 
 def generate_literature_review(refs_list: List[Dict], 
                              client: OpenAI,
-                             model: str = DEFAULT_MODEL) -> str:
-    """生成完整的文献综述 - 简化版本，直接生成单一结果"""
+                             model: str = DEFAULT_MODEL,
+                             n_samples: int = 1,
+                             n_votes: int = 2,
+                             context_paragraphs: int = ROLLING_CONTEXT_PARAGRAPHS,
+                             on_step: Optional[Callable[[Dict], None]] = None) -> str:
+    """
+    逐篇滚动生成完整的文献综述（库接口；服务端的综述任务使用 ReviewSynthesizer.generate_literature_review）
+    n_samples 为 1 时直接生成单一结果；大于 1 时每段生成多个候选，经 ReflectiveEvaluator 投票选出最佳段落
+    context_paragraphs 为滚动上下文保留的原文段落数（0 表示每步发送完整的已有综述）
+    on_step 在每篇论文处理完成后收到该步的用量：生成、投票与上下文压缩的全部调用，取自网关记录的实际用量
+    """
     summarizer = ComparativeSummarizer(client, model)
-    
-    # 初始化为空字符串
-    current_summary = ""
+    evaluator = ReflectiveEvaluator(client, model) if n_samples > 1 else None
+    rolling = RollingContext(client, model, recent_paragraphs=context_paragraphs)
     
     # 逐篇处理论文
     for i, ref_i in enumerate(refs_list):
         print(f"处理第 {i+1}/{len(refs_list)} 篇参考文献：{ref_i['paper_id']}")
+        context = rolling.context()
+        system_prompt, prompt = summarizer._build_prompt(ref_i, context)
+        new_paragraph = ""
         
-        # 生成综述段落
-        system_prompt, prompt = summarizer._build_prompt(ref_i, current_summary)
-        
-        try:
-            response = client.chat.completions.create(
-                model=model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.7,
-                max_tokens=512
-            )
-            
-            # 获取生成的段落并添加到当前综述
-            new_paragraph = response.choices[0].message.content
-            if current_summary:
-                current_summary += "\n\n" + new_paragraph
+        with usage_meter() as usage:
+            if evaluator:
+                # 多候选模式：并行采样与投票，选出得分最高的段落
+                try:
+                    candidates = summarizer.generate(ref_i, context, n_samples)
+                    scores = evaluator.evaluate(candidates, n_votes) if len(candidates) > 1 else [0.0] * len(candidates)
+                except Exception as e:
+                    print(f"生成失败: {str(e)}")
+                    candidates = []
+                if candidates:
+                    new_paragraph = candidates[max(range(len(candidates)), key=lambda idx: scores[idx])]
             else:
-                current_summary = new_paragraph
-                
-            print(f"已添加第 {i+1} 篇论文的综述段落")
+                # 生成综述段落
+                try:
+                    response = chat_completion(
+                        client,
+                        "review.summarize",
+                        model=model,
+                        messages=[
+                            {"role": "system", "content": system_prompt},
+                            {"role": "user", "content": prompt}
+                        ],
+                        temperature=0.7,
+                        max_tokens=512
+                    )
+                    new_paragraph = response.choices[0].message.content
+                except Exception as e:
+                    print(f"生成失败: {str(e)}")
             
-        except Exception as e:
-            print(f"生成失败: {str(e)}")
+            if new_paragraph:
+                # 获取生成的段落并添加到当前综述
+                rolling.add(new_paragraph)
+                print(f"已添加第 {i+1} 篇论文的综述段落")
+        
+        step = {
+            "step": i + 1,
+            "paper_id": ref_i["paper_id"],
+            "context_tokens": estimate_tokens(context) if context else 0,
+            "calls": usage["calls"],
+            "prompt_tokens": usage["prompt_tokens"],
+            "completion_tokens": usage["completion_tokens"],
+            "cost": usage["cost"]
+        }
+        print(f"第 {i+1} 步 token 用量：上下文 {step['context_tokens']}，调用 {step['calls']} 次，"
+              f"输入 {step['prompt_tokens']}，输出 {step['completion_tokens']}")
+        if on_step:
+            on_step(step)
     
-    return current_summary
+    return rolling.text()
 
 # 使用示例
 if __name__ == "__main__":
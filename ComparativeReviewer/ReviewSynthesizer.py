@@ -1,10 +1,20 @@
 import re
 import json
+import math
 import os
-from typing import List, Dict, Optional
-from openai import OpenAI
+import threading
+from typing import List, Dict, Optional, Callable
+from collections import Counter
+from concurrent.futures import as_completed
+from openai import OpenAI, BadRequestError
 from tenacity import retry, stop_after_attempt, wait_exponential
-from constants import DEFAULT_MODEL, REVIEW_MODEL, OPENAI_BASE_URL
+from constants import (
+    DEFAULT_MODEL, REVIEW_MODEL, OPENAI_BASE_URL, DESCRIPTION_CONCURRENCY, SYNTHESIS_CLUSTER_SIZE,
+    SAMPLING_CONCURRENCY, VOTE_AGREEMENT
+)
+from ComparativeReviewer.KeyElementExtractor import tokenize
+from services.llm_gateway import chat_completion, ContextThreadPoolExecutor
+from services.task_queue import TaskCancelled
 
 def extract_json(content: str):
     try:
@@ -30,6 +40,101 @@ def extract_json(content: str):
             continue
     return ""
 
+def stream_completion(client: OpenAI, on_token: Optional[Callable[[str], None]] = None,
+                      call_site: str = "review.synthesize", **kwargs) -> str:
+    """以流式方式调用补全接口，每收到一段文本即调用 on_token，返回完整文本"""
+    stream = chat_completion(client, call_site, stream=True, **kwargs)
+    parts = []
+    try:
+        for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                parts.append(delta)
+                if on_token:
+                    on_token(delta)
+    finally:
+        # on_token 抛出异常（如任务被取消）时及时释放连接
+        close = getattr(stream, "close", None)
+        if callable(close):
+            close()
+    return "".join(parts)
+
+# 不支持 n 参数的 (接口地址, 模型)，确认后不再尝试
+_n_unsupported = set()
+_n_unsupported_lock = threading.Lock()
+
+def sample_completions(client: OpenAI, n: int, max_workers: int = SAMPLING_CONCURRENCY,
+                       call_site: str = "review.sample", **kwargs) -> List[str]:
+    """
+    为同一提示词采样 n 个结果，失败的采样返回空字符串
+    优先使用接口的 n 参数一次请求完成；接口不支持（报错或返回不足 n 个）或该请求临时失败时改为并发请求
+    """
+    key = (str(getattr(client, "base_url", "")), kwargs.get("model"))
+    contents = []
+    if n > 1 and key not in _n_unsupported:
+        try:
+            response = chat_completion(client, call_site, n=n, **kwargs)
+            contents = [choice.message.content or "" for choice in response.choices][:n]
+            if len(contents) < n:
+                with _n_unsupported_lock:
+                    _n_unsupported.add(key)
+        except BadRequestError:
+            with _n_unsupported_lock:
+                _n_unsupported.add(key)
+        except Exception as e:
+            # 超时、5xx 等临时错误不说明接口不支持 n 参数，改为逐个采样
+            print(f"生成失败: {str(e)}")
+
+    def sample_one(_):
+        try:
+            response = chat_completion(client, call_site, **kwargs)
+            return response.choices[0].message.content or ""
+        except Exception as e:
+            print(f"生成失败: {str(e)}")
+            return ""
+
+    remaining = n - len(contents)
+    if remaining > 0:
+        with ContextThreadPoolExecutor(max_workers=min(max_workers, remaining)) as executor:
+            contents += list(executor.map(sample_one, range(remaining)))
+    return contents
+
+def score_candidates(client: OpenAI, candidates: List[str], n_votes: int, build_messages: Callable[[str], List[Dict]],
+                     model: str, agreement: float = VOTE_AGREEMENT, max_workers: int = SAMPLING_CONCURRENCY,
+                     call_site: str = "review.evaluate") -> List[float]:
+    """
+    对每个候选进行 n_votes 次打分并取平均，各候选并行评估
+    先为每个候选投 2 票，两票分差不超过 agreement 时提前停止，否则补足剩余票数；解析失败的投票不计入平均
+    """
+    def vote(candidate, k):
+        scores = []
+        for content in sample_completions(client, k, max_workers=max_workers, call_site=call_site, model=model,
+                                          response_format={"type": "json_object"},
+                                          messages=build_messages(candidate), temperature=0.3):
+            try:
+                scores.append(float(json.loads(extract_json(content))["score"]))
+            except Exception as e:
+                print(f"评估失败: {str(e)}")
+        return scores
+
+    if not candidates or n_votes <= 0:
+        return [0.0] * len(candidates)
+
+    first = min(2, n_votes)
+    with ContextThreadPoolExecutor(max_workers=min(max_workers, len(candidates))) as executor:
+        votes = list(executor.map(lambda candidate: vote(candidate, first), candidates))
+        undecided = [
+            i for i, scores in enumerate(votes)
+            if n_votes > first and (len(scores) < first or max(scores) - min(scores) > agreement)
+        ]
+        extra = executor.map(lambda i: vote(candidates[i], n_votes - first), undecided)
+        for i, scores in zip(undecided, extra):
+            votes[i] += scores
+
+    return [sum(scores) / len(scores) if scores else 0.0 for scores in votes]
+
 class PaperDescriptionGenerator:
     def __init__(self, client: OpenAI, model: str = DEFAULT_MODEL):
         self.client = client
@@ -58,25 +163,20 @@ class PaperDescriptionGenerator:
     
     @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
     def generate(self, paper_info: Dict, n_samples: int) -> List[str]:
-        """为单篇论文生成多个候选描述"""
+        """为单篇论文生成多个候选描述（n 参数或并发采样）"""
         system_prompt, prompt = self._build_prompt(paper_info)
-        descriptions = []
-        
-        for _ in range(n_samples):
-            try:
-                response = self.client.chat.completions.create(
-                    model=self.model,
-                    messages=[
-                        {"role": "system", "content": system_prompt},
-                        {"role": "user", "content": prompt}
-                    ],
-                    temperature=0.7,
-                    max_tokens=512
-                )
-                descriptions.append(response.choices[0].message.content)
-            except Exception as e:
-                print(f"生成失败: {str(e)}")
-                descriptions.append("")
+        descriptions = sample_completions(
+            self.client,
+            n_samples,
+            call_site="review.describe",
+            model=self.model,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": prompt}
+            ],
+            temperature=0.7,
+            max_tokens=512
+        )
                 
         return [d for d in descriptions if d]
 
@@ -100,31 +200,18 @@ class DescriptionEvaluator:
     
     @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
     def evaluate(self, descriptions: List[str], n_votes: int) -> List[float]:
-        """评估多个候选描述"""
-        all_scores = []
-        
-        for description in descriptions:
-            scores = []
-            for _ in range(n_votes):
-                try:
-                    response = self.client.chat.completions.create(
-                        model=self.model,
-                        response_format={"type": "json_object"},
-                        messages=[
-                            {"role": "system", "content": "你是一个严格的学术写作评估专家"},
-                            {"role": "user", "content": self._build_eval_prompt(description)}
-                        ],
-                        temperature=0.3
-                    )
-                    result = json.loads(extract_json(response.choices[0].message.content))
-                    scores.append(float(result["score"]))
-                except Exception as e:
-                    print(f"评估失败: {str(e)}")
-                    scores.append(0)
-                    
-            all_scores.append(sum(scores) / len(scores))
-            
-        return all_scores
+        """对每个候选描述并行进行多次评估，投票一致时提前停止；失败的投票不计入平均"""
+        return score_candidates(
+            self.client,
+            descriptions,
+            n_votes,
+            lambda description: [
+                {"role": "system", "content": "你是一个严格的学术写作评估专家"},
+                {"role": "user", "content": self._build_eval_prompt(description)}
+            ],
+            model=self.model,
+            call_site="review.evaluate_description"
+        )
 
 class ReviewSynthesizer:
     def __init__(self, client: OpenAI, model: str = DEFAULT_MODEL):
@@ -155,6 +242,28 @@ class ReviewSynthesizer:
         
         return system_prompt, prompt
     
+    def _build_merge_prompt(self, summaries: List[str]) -> str:
+        """构建分主题综述合并的提示词"""
+        system_prompt = """您是一位专业的学术写作专家，需要将同一领域内若干分主题综述整合为一篇结构完整的文献综述。请注意：
+1. 按主题组织章节，每个主题保留其代表性工作和关键结论
+2. 梳理不同主题之间的联系、演进关系与差异
+3. 合并重复的内容，避免逐段拼接
+4. 使用规范的学术语言"""
+        
+        summaries_text = "\n\n".join([f"分主题综述{i+1}：\n{summary}" for i, summary in enumerate(summaries)])
+        
+        prompt = f"""请将以下分主题综述整合为一篇完整的文献综述：
+
+{summaries_text}
+
+要求：
+1. 开篇用一段话概述该领域的整体研究脉络
+2. 每个主题作为一个部分，保留具体的方法和结果信息
+3. 指出主题之间的关联与差异
+4. 结尾总结现有研究的共性问题与未来方向"""
+        
+        return system_prompt, prompt
+    
     @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
     def synthesize(self, descriptions: List[str], n_samples: int) -> List[str]:
         """生成多个候选综述"""
@@ -163,7 +272,9 @@ class ReviewSynthesizer:
         
         for _ in range(n_samples):
             try:
-                response = self.client.chat.completions.create(
+                response = chat_completion(
+                    self.client,
+                    "review.synthesize",
                     model=self.model,
                     messages=[
                         {"role": "system", "content": system_prompt},
@@ -179,56 +290,208 @@ class ReviewSynthesizer:
                 
         return [r for r in reviews if r]
 
-def generate_literature_review_simple(refs_list: List[Dict],
-                                    client: OpenAI,
-                                    model: str = DEFAULT_MODEL) -> str:
-    """简化版文献综述生成函数 - 直接生成单一结果"""
-    # 初始化组件
-    desc_generator = PaperDescriptionGenerator(client, model)
-    synthesizer = ReviewSynthesizer(client, model)
+def cluster_by_topic(texts: List[str], cluster_size: int) -> List[List[int]]:
+    """
+    按主题将文本聚类为若干组，每组不超过 cluster_size 篇，返回各组的下标列表
+    使用 TF-IDF 余弦相似度，以最远点法选取初始中心，再做带容量约束的分配
+    """
+    n = len(texts)
+    k = math.ceil(n / cluster_size)
+    if k <= 1:
+        return [list(range(n))]
+    
+    term_counts = [Counter(tokenize(text)) for text in texts]
+    doc_freqs = Counter(term for counts in term_counts for term in counts)
+    vectors = []
+    for counts in term_counts:
+        vector = {term: count * math.log(1 + n / doc_freqs[term]) for term, count in counts.items()}
+        norm = math.sqrt(sum(value * value for value in vector.values())) or 1.0
+        vectors.append({term: value / norm for term, value in vector.items()})
+    
+    def similarity(a, b):
+        if len(a) > len(b):
+            a, b = b, a
+        return sum(value * b.get(term, 0.0) for term, value in a.items())
     
-    # 第一阶段：为每篇论文生成描述
-    descriptions = []
+    # 最远点初始化：每次选与已有中心最不相似的文本
+    seeds = [0]
+    closest = [similarity(vectors[0], vector) for vector in vectors]
+    while len(seeds) < k:
+        seed = min((i for i in range(n) if i not in seeds), key=lambda i: closest[i])
+        seeds.append(seed)
+        closest = [max(closest[i], similarity(vectors[seed], vectors[i])) for i in range(n)]
+    centroids = [vectors[seed] for seed in seeds]
     
-    for i, paper_info in enumerate(refs_list):
-        print(f"正在处理第 {i+1}/{len(refs_list)} 篇论文：{paper_info['paper_id']}")
+    clusters = []
+    for _ in range(3):
+        # 按相似度从高到低分配，已满的组不再接收
+        pairs = sorted(
+            ((similarity(vectors[i], centroid), i, c) for i in range(n) for c, centroid in enumerate(centroids)),
+            reverse=True
+        )
+        assignment, sizes = {}, [0] * k
+        for _, i, c in pairs:
+            if i not in assignment and sizes[c] < cluster_size:
+                assignment[i] = c
+                sizes[c] += 1
+        clusters = [[i for i in range(n) if assignment[i] == c] for c in range(k)]
         
-        # 生成描述
-        system_prompt, prompt = desc_generator._build_prompt(paper_info)
+        centroids = []
+        for members in clusters:
+            centroid = Counter()
+            for i in members:
+                centroid.update(vectors[i])
+            centroids.append(dict(centroid))
+    
+    return [members for members in clusters if members]
+
+def _complete(client: OpenAI, model: str, system_prompt: str, prompt: str, max_tokens: int = 1024,
+              on_token: Optional[Callable[[str], None]] = None, call_site: str = "review.synthesize") -> str:
+    return stream_completion(
+        client,
+        on_token=on_token,
+        call_site=call_site,
+        model=model,
+        messages=[
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": prompt}
+        ],
+        temperature=0.7,
+        max_tokens=max_tokens
+    )
+
+def synthesize_hierarchically(descriptions: List[str],
+                              client: OpenAI,
+                              model: str = DEFAULT_MODEL,
+                              cluster_size: int = SYNTHESIS_CLUSTER_SIZE,
+                              max_workers: int = DESCRIPTION_CONCURRENCY,
+                              on_progress: Optional[Callable[[str, int, int], None]] = None,
+                              on_token: Optional[Callable[[str], None]] = None) -> str:
+    """
+    分层合成综述：描述数不超过 cluster_size 时直接合成；
+    否则按主题聚类、并行合成各组的分主题综述，再逐层合并，直至可一次合成
+    提示词长度受 cluster_size 约束，合成层数随论文数对数增长；仅最后一次合成以流式输出
+    """
+    synthesizer = ReviewSynthesizer(client, model)
+    level, depth = descriptions, 0
+    
+    while len(level) > cluster_size:
+        clusters = cluster_by_topic(level, cluster_size)
+        build_prompt = synthesizer._build_synthesis_prompt if depth == 0 else synthesizer._build_merge_prompt
+        print(f"第 {depth+1} 层分主题合成：{len(level)} 篇 -> {len(clusters)} 组")
         
+        summaries = [""] * len(clusters)
+        with ContextThreadPoolExecutor(max_workers=min(max_workers, len(clusters))) as executor:
+            futures = {
+                executor.submit(_complete, client, model, *build_prompt([level[i] for i in members]),
+                                call_site="review.synthesize_cluster"): idx
+                for idx, members in enumerate(clusters)
+            }
+            for done, future in enumerate(as_completed(futures), 1):
+                try:
+                    summaries[futures[future]] = future.result()
+                except Exception as e:
+                    print(f"分主题合成失败: {str(e)}")
+                if on_progress:
+                    on_progress("synthesis", done, len(clusters))
+        
+        level = [summary for summary in summaries if summary]
+        if not level:
+            raise RuntimeError("所有分主题合成均失败")
+        depth += 1
+    
+    if depth == 0:
+        return _complete(client, model, *synthesizer._build_synthesis_prompt(level), on_token=on_token)
+    # 合并后的综述覆盖更多论文，需要更长的篇幅
+    return _complete(client, model, *synthesizer._build_merge_prompt(level), max_tokens=2048, on_token=on_token)
+
+def _describe_paper(client: OpenAI, model: str, desc_generator: PaperDescriptionGenerator, paper_info: Dict,
+                    evaluator: Optional[DescriptionEvaluator] = None, n_samples: int = 1, n_votes: int = 2) -> str:
+    """
+    为单篇论文生成描述，失败时返回空字符串
+    n_samples 大于 1 时采样多个候选描述，由 evaluator 投票选出得分最高的一个
+    """
+    if evaluator and n_samples > 1:
         try:
-            response = client.chat.completions.create(
-                model=model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.7,
-                max_tokens=512
-            )
-            description = response.choices[0].message.content
-            descriptions.append(description)
-            print(f"已生成第 {i+1} 篇论文的描述")
+            candidates = desc_generator.generate(paper_info, n_samples)
+            if len(candidates) <= 1:
+                return candidates[0] if candidates else ""
+            scores = evaluator.evaluate(candidates, n_votes)
+            return candidates[max(range(len(candidates)), key=lambda idx: scores[idx])]
         except Exception as e:
-            print(f"生成失败: {str(e)}")
-    
-    print("所有论文的描述生成完成，开始合成综述...")
-    
-    # 第二阶段：合成综述
-    system_prompt, prompt = synthesizer._build_synthesis_prompt(descriptions)
+            print(f"生成失败 {paper_info.get('paper_id')}: {str(e)}")
+            return ""
     
+    system_prompt, prompt = desc_generator._build_prompt(paper_info)
     try:
-        response = client.chat.completions.create(
+        response = chat_completion(
+            client,
+            "review.describe",
             model=model,
             messages=[
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": prompt}
             ],
             temperature=0.7,
-            max_tokens=1024
+            max_tokens=512
+        )
+        return response.choices[0].message.content
+    except Exception as e:
+        print(f"生成失败 {paper_info.get('paper_id')}: {str(e)}")
+        return ""
+
+def generate_literature_review_simple(refs_list: List[Dict],
+                                    client: OpenAI,
+                                    model: str = DEFAULT_MODEL,
+                                    max_workers: int = DESCRIPTION_CONCURRENCY,
+                                    cluster_size: int = SYNTHESIS_CLUSTER_SIZE,
+                                    on_progress: Optional[Callable[[str, int, int], None]] = None,
+                                    on_token: Optional[Callable[[str], None]] = None,
+                                    n_samples: int = 1,
+                                    n_votes: int = 2) -> str:
+    """
+    简化版文献综述生成函数 - 直接生成单一结果
+    各篇论文的描述相互独立，并发生成；全部完成后立即开始合成
+    n_samples 大于 1 时每篇论文采样多个候选描述，经 n_votes 次投票（一致时提前停止）选出最佳描述
+    on_progress(stage, 已完成数, 总数) 在每篇描述完成（stage="description"）和开始合成（stage="synthesis"）时调用
+    合成阶段以流式方式输出，每收到一段文本调用 on_token(text)
+    描述数超过 cluster_size 时按主题分层合成（见 synthesize_hierarchically）
+    """
+    # 初始化组件
+    desc_generator = PaperDescriptionGenerator(client, model)
+    evaluator = DescriptionEvaluator(client, model) if n_samples > 1 else None
+    
+    # 第一阶段：并发为每篇论文生成描述，保持原有顺序
+    results = [""] * len(refs_list)
+    if refs_list:
+        with ContextThreadPoolExecutor(max_workers=min(max_workers, len(refs_list))) as executor:
+            futures = {
+                executor.submit(_describe_paper, client, model, desc_generator, paper_info,
+                                evaluator, n_samples, n_votes): i
+                for i, paper_info in enumerate(refs_list)
+            }
+            for done, future in enumerate(as_completed(futures), 1):
+                i = futures[future]
+                results[i] = future.result()
+                print(f"已生成第 {i+1}/{len(refs_list)} 篇论文的描述：{refs_list[i]['paper_id']}")
+                if on_progress:
+                    on_progress("description", done, len(refs_list))
+    descriptions = [description for description in results if description]
+    
+    print("所有论文的描述生成完成，开始合成综述...")
+    
+    # 第二阶段：合成综述，论文较多时按主题分层合成
+    if on_progress:
+        on_progress("synthesis", 0, 1)
+    
+    try:
+        return synthesize_hierarchically(
+            descriptions, client, model, cluster_size,
+            max_workers=max_workers, on_progress=on_progress, on_token=on_token
         )
-        review = response.choices[0].message.content
-        return review
+    except TaskCancelled:
+        # 任务已取消，交由任务队列处理，不返回失败文本
+        raise
     except Exception as e:
         print(f"综述生成失败: {str(e)}")
         return "综述生成失败"
@@ -238,9 +501,12 @@ def generate_literature_review(refs_list: List[Dict],
                              client: OpenAI,
                              model: str = DEFAULT_MODEL,
                              n_samples: int = 2,
-                             n_votes: int = 2) -> str:
-    """使用简化版函数替代原多候选版本"""
-    return generate_literature_review_simple(refs_list, client, model)
+                             n_votes: int = 2,
+                             on_progress: Optional[Callable[[str, int, int], None]] = None,
+                             on_token: Optional[Callable[[str], None]] = None) -> str:
+    """使用简化版函数生成综述，n_samples 与 n_votes 用于每篇论文的候选描述采样与投票"""
+    return generate_literature_review_simple(refs_list, client, model, on_progress=on_progress, on_token=on_token,
+                                             n_samples=n_samples, n_votes=n_votes)
 
 if __name__ == "__main__":
     # 读取API密钥
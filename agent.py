@@ -2,7 +2,7 @@ import os
 import math
 from abc import ABC, abstractmethod
 from dotenv import load_dotenv
-from openai import OpenAI
+from services.llm_gateway import EndpointBalancer
 # from transformers import AutoModelForCausalLM, AutoTokenizer
 from constants import DEFAULT_MODEL
 
@@ -14,7 +14,7 @@ class BaseAgent(ABC):
         pass
     
     @abstractmethod
-    def infer_score(self, prompts):
+    def infer_score(self, prompts, affinity_key=None):
         pass
     
     @abstractmethod
@@ -23,40 +23,48 @@ class BaseAgent(ABC):
 
 class APIAgent(BaseAgent):
     def __init__(self, model_name, _type: str):
-        from constants import USE_SGLANG, SGLANG_CRAWLER_URL, SGLANG_SELECTOR_URL, OPENAI_BASE_URL
+        from constants import USE_SGLANG, SGLANG_CRAWLER_URLS, SGLANG_SELECTOR_URLS, OPENAI_BASE_URL
         
+        # Clients are shared per base URL through the gateway, which closes them on shutdown
         if USE_SGLANG:
-            # Use SGLang deployment
+            # Use SGLang deployment, balanced across replicas (comma-separated URLs in the environment)
             if _type == "crawler":
-                self.client = OpenAI(
-                    api_key=os.getenv("OPENAI_API_KEY"),
-                    base_url=SGLANG_CRAWLER_URL
-                )
+                base_urls = os.getenv("SGLANG_CRAWLER_URLS", ",".join(SGLANG_CRAWLER_URLS)).split(",")
             else:  # selector
-                self.client = OpenAI(
-                    api_key=os.getenv("OPENAI_API_KEY"),
-                    base_url=SGLANG_SELECTOR_URL
-                )
+                base_urls = os.getenv("SGLANG_SELECTOR_URLS", ",".join(SGLANG_SELECTOR_URLS)).split(",")
         else:
             # Use DeepSeek API
-            self.client = OpenAI(
-                api_key=os.getenv("OPENAI_API_KEY"),
-                base_url=os.getenv("OPENAI_BASE_URL", OPENAI_BASE_URL)
-            )
+            base_urls = [os.getenv("OPENAI_BASE_URL", OPENAI_BASE_URL)]
         
+        self.balancer = EndpointBalancer([url.strip() for url in base_urls if url.strip()], os.getenv("OPENAI_API_KEY"))
         self.model_name = model_name
+        self._type = _type or "agent"
+
+    def close(self):
+        self.balancer.close()
+
+    def _complete(self, call_site, prompt, affinity_key=None, **kwargs):
+        # Prompts sharing a long prefix (e.g. one query's selection prompts) go to the same replica
+        return self.balancer.chat_completion(
+            f"{self._type}.{call_site}",
+            affinity_key=affinity_key or self.balancer.affinity_key(prompt),
+            model=self.model_name,
+            messages=[
+                {"role": "user", "content": prompt},
+            ],
+            **kwargs
+        )
 
-    def infer_score(self, prompts):
+    def infer_score(self, prompts, affinity_key=None):
         if len(prompts) == 0:
             return []
         
         token_probabilities = []
         for prompt in prompts:
-            response = self.client.chat.completions.create(
-                model=self.model_name,
-                messages=[
-                    {"role": "user", "content": prompt},
-                ],
+            response = self._complete(
+                "infer_score",
+                prompt,
+                affinity_key=affinity_key,
                 temperature=0,
                 max_tokens=1,
                 n=1,
@@ -82,11 +90,9 @@ class APIAgent(BaseAgent):
         return token_probabilities
     
     def infer(self, prompt, sample=False):
-        response = self.client.chat.completions.create(
-            model=self.model_name,
-            messages=[
-                {"role": "user", "content": prompt.strip()},
-            ],
+        response = self._complete(
+            "infer",
+            prompt.strip(),
             temperature=0.7 if sample else 0,
             max_tokens=512,
         )
@@ -102,11 +108,9 @@ class APIAgent(BaseAgent):
             batch_responses = []
             
             for prompt in batch_prompts:
-                response = self.client.chat.completions.create(
-                    model=self.model_name,
-                    messages=[
-                        {"role": "user", "content": prompt.strip()}
-                    ],
+                response = self._complete(
+                    "batch_infer",
+                    prompt.strip(),
                     temperature=0.7 if sample else 0,
                     max_tokens=512
                 )
@@ -1,4 +1,5 @@
 import os
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
@@ -8,15 +9,28 @@ from dotenv import load_dotenv
 
 # Import routers
 from routers import search, review, utils
+from services.task_queue import task_queue
+from services.registry import registry
+from services.llm_gateway import llm_clients
 
 # Load environment variables
 load_dotenv()
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Shared agents and services are created lazily through the registry on first use
+    task_queue.start()
+    yield
+    task_queue.shutdown()
+    registry.close()
+    llm_clients.close()
+
 # Create FastAPI app
 app = FastAPI(
     title="智能文献处理系统",
     description="基于大语言模型的智能文献处理平台，集检索与综述分析于一体",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Add CORS middleware
@@ -0,0 +1,225 @@
+"""
+对比选择器提示词布局对前缀缓存命中率、延迟和评分的影响
+
+默认启动一个进程内的 SGLang 替身（按 RadixAttention 方式缓存已见过的 token 前缀，
+按未命中的 token 数模拟预填充耗时）；指定 --base_url 时改为请求真实的 SGLang 服务，
+每种布局开始前清空其前缀缓存，并从 usage.prompt_tokens_details 读取缓存命中数
+（需以 --enable-cache-report 启动）。
+
+替身的评分只取决于提示词中的查询与论文字段，与布局无关，因此替身模式下的评分一致性
+只用于检验流程；评估模型在两种布局下的评分一致性需要使用真实服务。
+
+示例:
+    python bench_selector_prompt.py --queries 5 --candidates 20
+    python bench_selector_prompt.py --base_url http://localhost:8001/v1 --model selector
+"""
+import os
+import re
+import json
+import math
+import time
+import random
+import argparse
+import threading
+import statistics
+from types import SimpleNamespace
+
+import requests
+from dotenv import load_dotenv
+
+load_dotenv()
+os.environ.setdefault("OPENAI_API_KEY", "EMPTY")
+
+from agent import APIAgent
+from paper_agent import PaperAgent
+from expand_paper import get_papers_metadata_by_ids
+from services.llm_gateway import EndpointBalancer, ContextThreadPoolExecutor, llm_usage
+
+LAYOUTS = ["get_selected", "get_selected_prefix"]
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--input_file',    type=str,   default="data/RealScholarQuery/test.jsonl")
+parser.add_argument('--queries',       type=int,   default=5)
+parser.add_argument('--candidates',    type=int,   default=20, help="每个查询评估的论文数（至多一半为正例，其余取自其他查询的答案）")
+parser.add_argument('--concurrency',   type=int,   default=8)
+parser.add_argument('--base_url',      type=str,   default=None, help="真实 SGLang 服务地址，不指定时使用进程内替身")
+parser.add_argument('--model',         type=str,   default=os.getenv("SELECTOR_MODEL", "selector"))
+parser.add_argument('--no_abstracts',  action="store_true", help="不从 arXiv 获取摘要（离线运行）")
+parser.add_argument('--prefill_ms',    type=float, default=0.05, help="替身每个未命中 token 的预填充耗时（毫秒）")
+parser.add_argument('--decode_ms',     type=float, default=15.0, help="替身生成决策 token 的耗时（毫秒）")
+parser.add_argument('--seed',          type=int,   default=0)
+parser.add_argument('--output',        type=str,   default=None, help="将结果写入 JSON 文件")
+
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+class RadixCacheStandIn:
+    def __init__(self, prefill_ms: float, decode_ms: float):
+        """
+        SGLang 替身：以字典树缓存所有请求的 token 前缀，按未命中的 token 数模拟预填充耗时
+        评分为查询与论文标题、摘要的词重叠度，只取决于字段内容
+        """
+        self.prefill_ms = prefill_ms
+        self.decode_ms = decode_ms
+        self.base_url = "http://stand-in/v1"
+        self.chat = SimpleNamespace(completions=self)
+        self._root = {}
+        self._lock = threading.Lock()
+
+    def _match_and_insert(self, tokens):
+        with self._lock:
+            node, matched = self._root, 0
+            for token in tokens:
+                if token in node:
+                    matched += 1
+                else:
+                    node[token] = {}
+                node = node[token]
+            return matched
+
+    @staticmethod
+    def _field(prompt: str, pattern: str) -> str:
+        match = re.search(pattern, prompt, re.DOTALL)
+        return match.group(1) if match else ""
+
+    def create(self, model, messages, **kwargs):
+        prompt = messages[-1]["content"]
+        tokens = TOKEN_PATTERN.findall(prompt)
+        cached = self._match_and_insert(tokens)
+        time.sleep(((len(tokens) - cached) * self.prefill_ms + self.decode_ms) / 1000)
+
+        query = set(TOKEN_PATTERN.findall(self._field(prompt, r"User Query: (.*?)\n").lower()))
+        paper = set(TOKEN_PATTERN.findall(
+            (self._field(prompt, r"Title: (.*?)\n") + " " + self._field(prompt, r"Abstract: (.*?)\n")).lower()
+        ))
+        overlap = len(query & paper) / max(1, len(query))
+        logprob = math.log(min(0.99, max(0.01, overlap)))
+        top = SimpleNamespace(token="True", logprob=logprob)
+        return SimpleNamespace(
+            choices=[SimpleNamespace(
+                message=SimpleNamespace(content="True"),
+                logprobs=SimpleNamespace(content=[SimpleNamespace(top_logprobs=[top])])
+            )],
+            usage=SimpleNamespace(
+                prompt_tokens=len(tokens),
+                completion_tokens=1,
+                prompt_tokens_details=SimpleNamespace(cached_tokens=cached)
+            )
+        )
+
+def load_cases(args):
+    """读取查询及候选论文（正例为查询的标准答案，至多占一半；负例取自其他查询的答案）"""
+    with open(args.input_file, encoding="utf-8") as f:
+        rows = [json.loads(line) for line in f if line.strip()]
+    rng = random.Random(args.seed)
+    rows = rows[:args.queries]
+
+    pool = [(arxiv_id, title) for row in rows for arxiv_id, title in zip(row["answer_arxiv_id"], row["answer"])]
+    cases = []
+    for row in rows:
+        positives = list(zip(row["answer_arxiv_id"], row["answer"]))[:args.candidates // 2]
+        negatives = [paper for paper in pool if paper not in positives]
+        rng.shuffle(negatives)
+        papers = [(arxiv_id, title, True) for arxiv_id, title in positives]
+        papers += [(arxiv_id, title, False) for arxiv_id, title in negatives[:args.candidates - len(papers)]]
+        rng.shuffle(papers)
+        cases.append({"query": row["question"].strip(), "papers": papers})
+
+    abstracts = {}
+    if not args.no_abstracts:
+        ids = sorted({arxiv_id for case in cases for arxiv_id, _, _ in case["papers"]})
+        try:
+            metadata = get_papers_metadata_by_ids(ids)
+            abstracts = {arxiv_id: meta["abstract"] for arxiv_id, meta in metadata.items() if meta}
+        except Exception as e:
+            print(f"获取摘要失败，使用空摘要: {e}")
+    for case in cases:
+        case["papers"] = [
+            {"title": " ".join(title.split()), "abstract": abstracts.get(arxiv_id, ""), "relevant": relevant}
+            for arxiv_id, title, relevant in case["papers"]
+        ]
+    return cases
+
+def flush_cache(base_url: str):
+    # SGLang 原生接口位于服务根路径
+    root = re.sub(r"/v1/?$", "", base_url)
+    try:
+        requests.post(f"{root}/flush_cache", timeout=10)
+    except Exception as e:
+        print(f"清空前缀缓存失败: {e}")
+
+def run_layout(args, layout, cases):
+    agent = APIAgent(args.model, "selector")
+    if args.base_url:
+        agent.balancer = EndpointBalancer([args.base_url], os.getenv("OPENAI_API_KEY"))
+        flush_cache(args.base_url)
+    else:
+        stand_in = RadixCacheStandIn(args.prefill_ms, args.decode_ms)
+        agent.balancer = EndpointBalancer([stand_in.base_url], os.getenv("OPENAI_API_KEY"))
+        agent.balancer.clients[stand_in.base_url] = stand_in
+
+    latencies, scores = [], []
+
+    def score(paper_agent, paper):
+        prompt = paper_agent.selection_prompt(paper["title"], paper["abstract"])
+        start = time.monotonic()
+        probability = agent.infer_score([prompt], affinity_key=paper_agent.selection_prefix())[0]["probability"]
+        latencies.append(time.monotonic() - start)
+        return probability
+
+    def run():
+        with ContextThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            for case in cases:
+                # 与检索流程一致：同一查询的候选论文连续评估
+                paper_agent = PaperAgent(user_query=case["query"], crawler=None, selector=agent)
+                paper_agent.selector_prompt = layout
+                scores.extend(executor.map(lambda paper: score(paper_agent, paper), case["papers"]))
+
+    task_id = f"bench-{layout}"
+    start = time.monotonic()
+    llm_usage.scoped(task_id, run)()
+    wall = time.monotonic() - start
+    agent.close()
+
+    totals = llm_usage.task_summary(task_id)["totals"]
+    latencies.sort()
+    return {
+        "layout": layout,
+        "requests": totals["calls"],
+        "prompt_tokens": totals["prompt_tokens"],
+        "cached_tokens": totals["cached_tokens"],
+        "cache_hit_rate": totals["cached_tokens"] / totals["prompt_tokens"] if totals["prompt_tokens"] else 0.0,
+        "latency_mean_ms": statistics.mean(latencies) * 1000,
+        "latency_p50_ms": latencies[len(latencies) // 2] * 1000,
+        "latency_p95_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000,
+        "wall_s": wall,
+        "scores": scores
+    }
+
+def main():
+    args = parser.parse_args()
+    cases = load_cases(args)
+    labels = [paper["relevant"] for case in cases for paper in case["papers"]]
+    print(f"{len(cases)} 个查询，共 {len(labels)} 个候选论文，{'SGLang: ' + args.base_url if args.base_url else '进程内替身'}")
+
+    results = [run_layout(args, layout, cases) for layout in LAYOUTS]
+
+    print(f"\n{'布局':<22}{'请求':>6}{'输入token':>10}{'缓存token':>10}{'命中率':>8}{'平均ms':>9}{'P50ms':>9}{'P95ms':>9}{'总耗时s':>9}{'准确率':>8}")
+    for result in results:
+        accuracy = sum((s > 0.5) == label for s, label in zip(result["scores"], labels)) / len(labels)
+        result["accuracy"] = accuracy
+        print(f"{result['layout']:<22}{result['requests']:>6}{result['prompt_tokens']:>10}{result['cached_tokens']:>10}"
+              f"{result['cache_hit_rate']:>8.1%}{result['latency_mean_ms']:>9.1f}{result['latency_p50_ms']:>9.1f}"
+              f"{result['latency_p95_ms']:>9.1f}{result['wall_s']:>9.2f}{accuracy:>8.1%}")
+
+    base, prefix = results[0]["scores"], results[1]["scores"]
+    diffs = [abs(a - b) for a, b in zip(base, prefix)]
+    agreement = sum((a > 0.5) == (b > 0.5) for a, b in zip(base, prefix)) / len(diffs)
+    parity = {"mean_abs_diff": statistics.mean(diffs), "max_abs_diff": max(diffs), "decision_agreement": agreement}
+    print(f"\n评分一致性: 平均差 {parity['mean_abs_diff']:.4f}，最大差 {parity['max_abs_diff']:.4f}，决策一致率 {agreement:.1%}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"results": results, "parity": parity}, f, indent=2, ensure_ascii=False)
+
+if __name__ == "__main__":
+    main()
@@ -7,6 +7,8 @@ This file centralizes configuration values to make them easier to change.
 USE_SGLANG = False  # Set to True to use SGLang, False to use DeepSeek API
 SGLANG_CRAWLER_URL = "http://localhost:8000/v1"
 SGLANG_SELECTOR_URL = "http://localhost:8001/v1"
+SGLANG_CRAWLER_URLS = [SGLANG_CRAWLER_URL]    # Crawler replicas, requests are balanced across them
+SGLANG_SELECTOR_URLS = [SGLANG_SELECTOR_URL]  # Selector replicas, requests are balanced across them
 
 # Model names
 DEFAULT_MODEL = "deepseek-chat"  # Default model for all operations
@@ -21,11 +23,73 @@ OPENAI_BASE_URL = "https://api.deepseek.com/v1"  # Base URL for API calls
 MAX_SEARCH_QUERIES = 5  # Maximum number of search queries to generate
 MAX_SEARCH_PAPERS = 10  # Maximum number of papers to search per query
 MAX_EXPAND_PAPERS = 10  # Maximum number of papers to expand per layer
+SELECTOR_PROMPT = "get_selected"  # Selector prompt in prompts.json; "get_selected_prefix" puts the per-query text first for prefix caching
 
 # Review configuration
-MAX_REVIEW_PAPERS = 5  # Maximum number of papers for review
+MAX_REVIEW_PAPERS = 200  # Maximum number of papers for review
+DOWNLOAD_CONCURRENCY = 8  # Maximum number of concurrent arXiv PDF downloads
+EXTRACTION_CONCURRENCY = 4  # Maximum number of concurrent key-element extractions
+EXTRACTION_TOKEN_BUDGET = 24000  # Maximum paper tokens sent per paper for key-element extraction, split across the questions
+EXTRACTION_CHUNK_TOKENS = 6000   # Papers up to this size are extracted in one call; longer ones are indexed per question
+EXTRACTION_RETRIEVAL_CHUNK_TOKENS = 800  # Size of the chunks indexed for per-question retrieval
+EXTRACTION_TOP_K = 4             # Chunks retrieved for each key-element question
+EXTRACTION_MAP_CONCURRENCY = 4   # Maximum number of concurrent question calls per paper
+DESCRIPTION_CONCURRENCY = 8      # Maximum number of per-paper descriptions generated concurrently
+DESCRIPTION_SAMPLES = 1          # Default candidate descriptions per paper; above 1 the best-voted one is kept (opt in per request)
+DESCRIPTION_VOTES = 1            # Default votes per candidate description; extra votes only when the first two disagree
+MAX_DESCRIPTION_SAMPLES = 8      # Upper bound of the per-request description_samples and description_votes
+SYNTHESIS_CLUSTER_SIZE = 8       # Reviews over more papers are synthesized per topic cluster of this size, then merged
+SAMPLING_CONCURRENCY = 8         # Maximum number of concurrent candidate samples or votes when the API lacks n=
+VOTE_AGREEMENT = 5               # Stop voting on a candidate once its first two scores (0-100) differ by at most this
+ROLLING_CONTEXT_PARAGRAPHS = 3   # Paragraphs kept verbatim in the rolling review context, older ones are compressed (0 = full context)
+ROLLING_SUMMARY_MAX_TOKENS = 400  # Size limit of the compressed running summary
+
+# MinerU configuration
+MINERU_UPLOAD_CONCURRENCY = 4    # Maximum number of concurrent PDF uploads
+MINERU_DOWNLOAD_CONCURRENCY = 4  # Maximum number of concurrent result downloads
+MINERU_POLL_MIN_INTERVAL = 2     # Seconds between polls while files are finishing
+MINERU_POLL_MAX_INTERVAL = 30    # Upper bound for the poll interval backoff
+MINERU_TIMEOUT = 1800            # Seconds to wait for a batch before giving up on unfinished files
+MINERU_ZIP_SPOOL_BYTES = 32 * 1024 ** 2  # Result archives up to this size are extracted in memory
+MINERU_EXTRACT_IMAGES = True     # Set to False to skip figures, the review only reads the Markdown text
+
+# PDF backend configuration
+PDF_BACKEND = "mineru"  # Default PDF-to-Markdown backend: "mineru" (remote API) or "local" (PyMuPDF/pdfminer)
+LOCAL_PDF_WORKERS = 4   # Worker processes of the local PDF backend
+
+# LLM gateway configuration
+LLM_TIMEOUT = 120              # Seconds to wait for each read from an LLM endpoint
+LLM_CONNECT_TIMEOUT = 10       # Seconds to wait for a connection to an LLM endpoint
+LLM_MAX_RETRIES = 3            # Retries with exponential backoff on connection errors, 408/409/429 and 5xx
+LLM_MAX_CONNECTIONS = 64       # HTTP connections per base URL, shared by every subsystem
+LLM_DEFAULT_CONCURRENCY = 16   # In-flight requests allowed per model unless listed below
+LLM_MODEL_CONCURRENCY = {}     # Per-model overrides of LLM_DEFAULT_CONCURRENCY, e.g. {"deepseek-chat": 32}
+LLM_AIMD_INITIAL_LIMIT = 8     # Starting in-flight limit of each endpoint's adaptive concurrency controller
+LLM_AIMD_MAX_LIMIT = 64        # Upper bound the adaptive limit can grow to
+LLM_AIMD_BACKOFF = 0.5         # Factor the limit is multiplied by on 429/5xx/timeouts or a latency blowup
+LLM_AIMD_LATENCY_TOLERANCE = 2.0  # Latency per output token above this multiple of the call site's baseline counts as overload
+LLM_AIMD_MIN_LATENCY_TOKENS = 32  # Completions shorter than this are not used as latency samples
+LLM_ENDPOINT_COOLDOWN = 5      # Seconds a failed replica is skipped, doubling on repeated failures up to 60
+LLM_HEALTH_CHECK_INTERVAL = 10  # Seconds between probes of failed replicas
+LLM_AFFINITY_PREFIX_CHARS = 512  # Prompts sharing this many leading characters prefer the same replica
+LLM_AFFINITY_SLACK = 4         # Extra outstanding requests tolerated on the preferred replica before spilling over
+LLM_PRICES = {  # USD per million tokens, models not listed are counted at zero cost
+    "deepseek-chat": {"prompt": 0.27, "completion": 1.10},
+    "deepseek-reasoner": {"prompt": 0.55, "completion": 2.19},
+}
+
+# Task queue configuration
+SEARCH_WORKERS = 4             # Worker threads for search and citation expansion tasks
+REVIEW_WORKERS = 2             # Worker threads for review tasks
+MAX_QUEUED_SEARCH_TASKS = 50   # Search tasks allowed to wait before new ones get HTTP 429
+MAX_QUEUED_REVIEW_TASKS = 20   # Review tasks allowed to wait before new ones get HTTP 429
+TASK_EVENT_HISTORY_TTL = 600   # Seconds a finished task's event history is kept for reconnecting SSE clients
 
 # File paths
 TEMP_DIR = "temp"       # Directory for temporary files
 UPLOAD_DIR = "uploads"  # Directory for uploaded files
 RESULTS_DIR = "results" # Directory for results
+ARTIFACT_CACHE_DIR = "cache/artifacts"  # Content-addressed cache of PDFs and MinerU output
+
+# Artifact cache configuration
+ARTIFACT_CACHE_MAX_BYTES = 5 * 1024 ** 3  # Least recently used entries are evicted beyond this size
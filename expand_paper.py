@@ -106,21 +106,66 @@ def get_paper_metadata_by_id(arxiv_id):
     try:
         results = list(client.results(search))
         if results:
-            paper = results[0]
-            metadata = {
-                'title': paper.title,
-                'authors': [author.name for author in paper.authors],
-                'published': paper.published.strftime('%Y-%m-%d'),
-                'updated': paper.updated.strftime('%Y-%m-%d') if hasattr(paper, 'updated') else None,
-                'abstract': paper.summary,
-                'arxiv_id': arxiv_id
-            }
-            return metadata
+            return _build_metadata(results[0], arxiv_id)
     except Exception as e:
         print(f"  通过ID检索时出错: {e}")
     
     return None
 
+def get_papers_metadata_by_ids(arxiv_ids, num_retries=3):
+    """
+    使用一次arXiv API请求批量获取多篇论文的元数据
+    
+    一个格式错误或已撤回的ID可能使整批请求失败；此时将未获取的ID拆成两半分别重试，
+    出错的ID只影响其自身
+    
+    Args:
+        arxiv_ids: arXiv ID列表，例如 ['2101.12345', '2102.12345v2']
+        num_retries: 每次请求失败后的重试次数
+    
+    Returns:
+        arXiv ID到元数据字典的映射，未找到的ID不包含在内
+    """
+    arxiv_ids = list(dict.fromkeys(arxiv_ids))
+    if not arxiv_ids:
+        return {}
+    
+    client = arxiv.Client(page_size=len(arxiv_ids), num_retries=num_retries)
+    search = arxiv.Search(id_list=arxiv_ids, max_results=len(arxiv_ids))
+    
+    # 返回结果的entry_id带版本号，按不带版本号的ID对应回请求的ID
+    requested = {re.sub(r'v\d+$', '', arxiv_id): arxiv_id for arxiv_id in arxiv_ids}
+    
+    metadata = {}
+    try:
+        for paper in client.results(search):
+            short_id = paper.get_short_id()
+            arxiv_id = requested.get(short_id) or requested.get(re.sub(r'v\d+$', '', short_id))
+            if arxiv_id:
+                metadata[arxiv_id] = _build_metadata(paper, arxiv_id)
+    except Exception as e:
+        missing = [arxiv_id for arxiv_id in arxiv_ids if arxiv_id not in metadata]
+        if len(missing) <= 1:
+            print(f"  通过ID检索时出错 {', '.join(missing)}: {e}")
+            return metadata
+        print(f"  批量检索元数据时出错，拆分为两批重试: {e}")
+        # 拆分后的请求已不是首次尝试，减少重试以免坏ID拖慢整体
+        half = len(missing) // 2
+        for part in (missing[:half], missing[half:]):
+            metadata.update(get_papers_metadata_by_ids(part, num_retries=min(num_retries, 1)))
+    
+    return metadata
+
+def _build_metadata(paper, arxiv_id):
+    return {
+        'title': paper.title,
+        'authors': [author.name for author in paper.authors],
+        'published': paper.published.strftime('%Y-%m-%d'),
+        'updated': paper.updated.strftime('%Y-%m-%d') if hasattr(paper, 'updated') else None,
+        'abstract': paper.summary,
+        'arxiv_id': arxiv_id
+    }
+
 def get_paper_metadata_by_title(title):
     """
     使用标题搜索论文元数据，返回最匹配的结果
@@ -6,8 +6,11 @@ from agent import Agent
 from datetime import datetime
 
 from search_from_google import parse_rewrites, google_search_arxiv_id
+from services.llm_gateway import usage_stage
+from constants import SELECTOR_PROMPT
 from expand_paper import (
     get_paper_metadata_by_id, 
+    get_papers_metadata_by_ids,
     get_paper_metadata_by_title,
     get_paper_structure, 
     get_section_citations
@@ -32,6 +35,7 @@ class PaperAgent:
         self.selector   = selector
         self.end_date   = end_date
         self.prompts    = json.load(open(prompts_path))
+        self.selector_prompt = os.getenv("SELECTOR_PROMPT", SELECTOR_PROMPT)
         self.google_key = google_key or os.getenv("GOOGLE_KEY")
         self.root       = PaperNode({
             "title": user_query,
@@ -53,8 +57,8 @@ class PaperAgent:
             "expand_template": r"Expand\](.*?)\["
         }
     
-    def search_paper(self, queries):
-        """搜索相关论文"""
+    def iter_search_paper(self, queries):
+        """搜索相关论文，每评估完一篇论文即产出 (query, PaperNode)"""
         processed_queries = []
         for query in queries:
             if not query in self.root.child:
@@ -74,67 +78,71 @@ class PaperAgent:
             
             print(f"找到 {len(arxiv_ids)} 个arXiv ID")
             
-            searched_papers = []
+            new_ids = []
             for arxiv_id in arxiv_ids:
                 arxiv_id = arxiv_id.split('v')[0]  # 移除版本号
-                
                 if arxiv_id not in self.root.extra["touch_ids"]:
                     self.root.extra["touch_ids"].append(arxiv_id)
-                    
-                    # 使用您的函数获取论文元数据
-                    paper_data = get_paper_metadata_by_id(arxiv_id)
-                    if paper_data:
-                        searched_papers.append({
-                            "title": paper_data["title"],
-                            "arxiv_id": arxiv_id,
-                            "abstract": paper_data["abstract"],
-                            "sections": "",  # 初始为空，按需获取
-                            "source": "arxiv"
-                        })
+                    new_ids.append(arxiv_id)
             
-            # 评估论文相关性
-            select_prompts = []
-            for paper in searched_papers:
-                prompt = self.prompts["get_selected"].format(
-                    title=paper["title"], 
-                    abstract=paper["abstract"], 
-                    user_query=self.user_query
-                )
-                select_prompts.append(prompt)
+            # 一次请求批量获取论文元数据
+            metadata_by_id = get_papers_metadata_by_ids(new_ids)
             
-            if select_prompts:
-                scores = self.selector.infer_score(select_prompts)
+            for i, arxiv_id in enumerate(new_ids):
+                paper_data = metadata_by_id.get(arxiv_id)
+                if not paper_data:
+                    continue
                 
-                for i, (paper, score) in enumerate(zip(searched_papers, scores)):
-                    score = score['probability']
-                    print(f"评估论文 [{i+1}/{len(searched_papers)}]: {paper['title']} (分数: {score})")
-                    
-                    self.root.extra["crawler_recall_papers"].append(paper["title"])
-                    if score > 0.5:
-                        self.root.extra["recall_papers"].append(paper["title"])
-                    
-                    # 创建论文节点
-                    paper_node = PaperNode({
-                        "title":        paper["title"],
-                        "arxiv_id":     paper["arxiv_id"],
-                        "depth":        0,
-                        "abstract":     paper["abstract"],
-                        "sections":     paper["sections"],
-                        "source":       "Search " + paper["source"],
-                        "select_score": score,
-                        "extra":        {}
-                    })
-                    
-                    self.root.child[query].append(paper_node)
-                    self.papers_queue.append(paper_node)
+                # 评估论文相关性，逐篇评估以便尽早返回结果
+                prompt = self.selection_prompt(paper_data["title"], paper_data["abstract"])
+                with usage_stage("selection"):
+                    score = self.selector.infer_score([prompt], affinity_key=self.selection_prefix())[0]['probability']
+                print(f"评估论文 [{i+1}/{len(new_ids)}]: {paper_data['title']} (分数: {score})")
+                
+                self.root.extra["crawler_recall_papers"].append(paper_data["title"])
+                if score > 0.5:
+                    self.root.extra["recall_papers"].append(paper_data["title"])
+                
+                # 创建论文节点
+                paper_node = PaperNode({
+                    "title":        paper_data["title"],
+                    "arxiv_id":     arxiv_id,
+                    "depth":        0,
+                    "abstract":     paper_data["abstract"],
+                    "sections":     "",  # 初始为空，按需获取
+                    "source":       "Search arxiv",
+                    "select_score": score,
+                    "extra":        {}
+                })
+                
+                self.root.child[query].append(paper_node)
+                self.papers_queue.append(paper_node)
+                yield query, paper_node
 
-    def search(self):
-        """执行搜索过程"""
+    def selection_prompt(self, title, abstract):
+        """构建论文相关性评估提示词"""
+        return self.prompts[self.selector_prompt].format(
+            title=title,
+            abstract=abstract,
+            user_query=self.user_query
+        )
+
+    def selection_prefix(self):
+        """评估提示词中论文信息之前、同一查询下所有论文共享的部分，用于将请求路由到缓存了该前缀的副本"""
+        return self.prompts[self.selector_prompt].split("{title}")[0].format(user_query=self.user_query)
+
+    def search_paper(self, queries):
+        """搜索相关论文"""
+        for _ in self.iter_search_paper(queries):
+            pass
+
+    def generate_queries(self):
+        """使用LLM生成搜索查询"""
         print(f"为查询生成搜索关键词: '{self.user_query}'")
         
-        # 使用LLM生成搜索查询
         prompt = self.prompts["generate_query"].format(user_query=self.user_query).strip()
-        queries_text = self.crawler.infer(prompt)
+        with usage_stage("query_generation"):
+            queries_text = self.crawler.infer(prompt)
         print("生成的搜索查询:", queries_text)
 
         # 解析生成的查询
@@ -146,9 +154,19 @@ class PaperAgent:
             queries = parse_rewrites(queries_text)[:self.search_queries]
         
         print(f"生成的搜索关键词: {queries}")
+        return queries
+
+    def iter_search(self):
+        """执行搜索过程，每评估完一篇论文即产出 (query, PaperNode)"""
+        queries = self.generate_queries()
         
         # 搜索每个查询
-        self.search_paper(queries)
+        yield from self.iter_search_paper(queries)
+
+    def search(self):
+        """执行搜索过程"""
+        for _ in self.iter_search():
+            pass
 
     def get_paper_content(self, paper):
         """获取论文的完整内容和章节"""
@@ -264,13 +282,9 @@ class PaperAgent:
             self.root.extra["touch_ids"].append(arxiv_id)
             
             # 评估论文相关性
-            prompt = self.prompts["get_selected"].format(
-                title=metadata['title'], 
-                abstract=metadata['abstract'], 
-                user_query=self.user_query
-            )
+            prompt = self.selection_prompt(metadata['title'], metadata['abstract'])
             
-            score = self.selector.infer_score([prompt])[0]['probability']
+            score = self.selector.infer_score([prompt], affinity_key=self.selection_prefix())[0]['probability']
             
             print(f"评估论文: {metadata['title']} (分数: {score})")
             
@@ -322,11 +336,12 @@ class PaperAgent:
             # 获取论文内容
             crawl_prompt = self.get_paper_content(paper)
             if crawl_prompt:
-                # 使用LLM选择要扩展的章节
-                crawl_result = self.crawler.infer(crawl_prompt)
-                
-                # 扩展引用
-                self.do_expand(depth, paper, crawl_result)
+                with usage_stage("expansion"):
+                    # 使用LLM选择要扩展的章节
+                    crawl_result = self.crawler.infer(crawl_prompt)
+                    
+                    # 扩展引用
+                    self.do_expand(depth, paper, crawl_result)
 
     def run(self):
         """运行完整的检索流程"""
@@ -1,16 +1,24 @@
-from fastapi import APIRouter, HTTPException, BackgroundTasks, Depends, UploadFile, File, Form
-from fastapi.responses import FileResponse
-from pydantic import BaseModel
+from fastapi import APIRouter, HTTPException, Depends, Header, UploadFile, File, Form
+from fastapi.responses import FileResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from pydantic import BaseModel, Field
 from typing import List, Dict, Optional, Any
 import os
 import json
+import time
 import uuid
 import shutil
 from pathlib import Path
 
 # Import services
-from services.review_service import ReviewService, PaperDownloader
-from services.pdf_service import PDFProcessor
+from services.review_service import ReviewService, PaperDownloader, KeyElementPrefetcher
+from services.pdf_service import PDFBackend, process_pdfs_with_cache
+from services.artifact_store import artifact_store
+from services.task_queue import task_queue, QueueFullError, TaskCancelled
+from services.task_events import task_events
+from services.llm_gateway import llm_usage
+from services.registry import registry
+from constants import PDF_BACKEND, MAX_REVIEW_PAPERS, DESCRIPTION_SAMPLES, DESCRIPTION_VOTES, MAX_DESCRIPTION_SAMPLES
 
 # Create router
 router = APIRouter(
@@ -23,6 +31,10 @@ router = APIRouter(
 class ReviewRequest(BaseModel):
     arxiv_ids: List[str]
     options: Dict[str, bool] = {"includeMethodology": True, "includeResults": True, "includeGaps": False}
+    priority: int = 0
+    pdf_backend: Optional[str] = None
+    description_samples: int = Field(DESCRIPTION_SAMPLES, ge=1, le=MAX_DESCRIPTION_SAMPLES)
+    description_votes: int = Field(DESCRIPTION_VOTES, ge=1, le=MAX_DESCRIPTION_SAMPLES)
 
 class TaskResponse(BaseModel):
     task_id: str
@@ -36,7 +48,26 @@ active_tasks = {}
 def generate_task_id():
     return str(uuid.uuid4())
 
+def enqueue_task(task_id: str, func, *args, priority: int = 0):
+    active_tasks[task_id] = {
+        "status": "queued",
+        "progress": 0,
+        "result": None,
+        "message": "任务已加入队列"
+    }
+    task_events.publish(task_id, "status", {"status": "queued", "progress": 0, "message": "任务已加入队列", "result": None})
+
+    try:
+        # LLM calls made by the task are accounted to it
+        task_queue.submit("review", task_id, llm_usage.scoped(task_id, func), task_id, *args, priority=priority)
+    except QueueFullError:
+        del active_tasks[task_id]
+        task_events.discard(task_id)
+        raise HTTPException(status_code=429, detail="Too many review tasks queued, please retry later", headers={"Retry-After": "30"})
+
 def update_task_status(task_id: str, status: str, progress: float, result=None, message=None):
+    # Cancelled tasks stop at their next status update instead of overwriting the cancelled state
+    task_queue.check_cancelled(task_id)
     if task_id in active_tasks:
         active_tasks[task_id].update({
             "status": status,
@@ -44,29 +75,103 @@ def update_task_status(task_id: str, status: str, progress: float, result=None,
             "result": result,
             "message": message
         })
+        task_events.publish(task_id, "status", {
+            "status": status,
+            "progress": progress,
+            "message": message,
+            "result": result if status == "completed" else None
+        })
+
+# Review stages as (start, end) shares of the remaining progress and a status message
+REVIEW_STAGES = {
+    "extraction": (0.0, 0.4, "已提取 {done}/{total} 篇论文的关键要素"),
+    "description": (0.4, 0.8, "已生成 {done}/{total} 篇论文的描述"),
+    "synthesis": (0.8, 1.0, "正在合成综述...")
+}
+
+def review_progress(task_id: str, start: float):
+    """Build the on_progress callback of a review task, mapping stage progress onto [start, 0.95]"""
+    def on_progress(stage: str, done: int, total: int):
+        low, high, message = REVIEW_STAGES[stage]
+        progress = start + (0.95 - start) * (low + (high - low) * done / max(total, 1))
+        update_task_status(task_id, "processing", round(progress, 3), message=message.format(done=done, total=total))
+    return on_progress
+
+class ReviewStreamWriter:
+    def __init__(self, task_id: str, path: str, publish_interval: float = 0.1):
+        """
+        Append streamed review text to the result file and publish it as "token" events
+        
+        Tokens are coalesced for publish_interval seconds so a review does not
+        turn into thousands of single-token events.
+        """
+        self.task_id = task_id
+        self.path = path
+        self.publish_interval = publish_interval
+        self.file = None
+        self.buffer = []
+        self.last_publish = time.monotonic()
+    
+    def write(self, text: str):
+        # Stops the stream (and the LLM request) once the task is cancelled
+        task_queue.check_cancelled(self.task_id)
+        if self.file is None:
+            self.file = open(self.path, "w", encoding="utf-8")
+        self.file.write(text)
+        self.file.flush()
+        
+        self.buffer.append(text)
+        if time.monotonic() - self.last_publish >= self.publish_interval:
+            self.flush()
+    
+    def flush(self):
+        if self.buffer:
+            task_events.publish(self.task_id, "token", {"text": "".join(self.buffer)})
+            self.buffer = []
+        self.last_publish = time.monotonic()
+    
+    def close(self):
+        # A cancelled task must not publish tokens after its cancelled status
+        if not task_queue.is_cancelled(self.task_id):
+            self.flush()
+        if self.file is not None:
+            self.file.close()
 
-# Dependency to get ReviewService
+def save_upload(file: UploadFile, file_path: str):
+    with open(file_path, "wb") as f:
+        shutil.copyfileobj(file.file, f)
+
+# Dependency to get the shared ReviewService
 def get_review_service():
     try:
-        api_key = os.getenv("OPENAI_API_KEY")
-        model = os.getenv("REVIEW_MODEL", "deepseek-chat")
-        base_url = os.getenv("OPENAI_BASE_URL")
-        return ReviewService(api_key=api_key, model=model, base_url=base_url)
+        return registry.get("review_service")
     except Exception as e:
         print(f"Failed to initialize review service: {e}")
         return None
 
-# Dependency to get PDFProcessor
-def get_pdf_processor():
+# Registry names of the PDF-to-Markdown backends
+PDF_BACKENDS = {
+    "mineru": "pdf_processor",
+    "local": "local_pdf_processor"
+}
+
+# Get the shared processor of a PDF backend
+def get_pdf_processor(backend: Optional[str] = None):
+    backend = backend or os.getenv("PDF_BACKEND", PDF_BACKEND)
+    if backend not in PDF_BACKENDS:
+        raise HTTPException(status_code=400, detail=f"Unknown PDF backend: {backend}")
+    
     try:
-        api_key = os.getenv("MINERU_API_KEY")
-        return PDFProcessor(api_key=api_key)
+        return registry.get(PDF_BACKENDS[backend])
     except Exception as e:
         print(f"Failed to initialize PDF processor: {e}")
         return None
 
 # Background task functions
-def process_pdfs_task(task_id: str, file_paths: List[str], options: Dict[str, bool], pdf_processor: PDFProcessor, review_service: ReviewService):
+def process_pdfs_task(task_id: str, file_paths: List[str], options: Dict[str, bool], sampling: Dict[str, int],
+                      pdf_processor: PDFBackend, review_service: ReviewService):
+    # Key-element extraction starts as soon as each paper's markdown is ready
+    prefetcher = KeyElementPrefetcher(review_service)
     try:
         update_task_status(task_id, "processing", 0.1, message="处理PDF文件中...")
         
@@ -74,20 +179,10 @@ def process_pdfs_task(task_id: str, file_paths: List[str], options: Dict[str, bo
         temp_dir = os.path.join("temp", task_id)
         os.makedirs(temp_dir, exist_ok=True)
         
-        # Create PDF_FOLDER and OUTPUT_FOLDER for processing
-        pdf_folder = os.path.join(temp_dir, "pdfs")
-        output_folder = os.path.join(temp_dir, "mdss")
-        os.makedirs(pdf_folder, exist_ok=True)
-        os.makedirs(output_folder, exist_ok=True)
-        
-        # Copy PDFs to the temporary directory
-        for file_path in file_paths:
-            shutil.copy(file_path, os.path.join(pdf_folder, os.path.basename(file_path)))
-        
         update_task_status(task_id, "processing", 0.2, message="提取PDF内容...")
         
-        # Process PDFs to get markdown files
-        md_files = pdf_processor.process_pdfs(pdf_folder, output_folder)
+        # Process PDFs to get markdown files, reusing cached results
+        md_files = process_pdfs_with_cache(pdf_processor, file_paths, temp_dir, artifact_store, on_markdown=prefetcher.submit)
         
         if not md_files:
             update_task_status(task_id, "failed", 0, message="PDF处理失败，未能提取内容")
@@ -95,11 +190,18 @@ def process_pdfs_task(task_id: str, file_paths: List[str], options: Dict[str, bo
         
         update_task_status(task_id, "processing", 0.5, message=f"提取了 {len(md_files)} 个文件的内容，开始生成综述...")
         
-        # Generate review
-        result = review_service.process_papers_and_generate_review(md_files, options)
-        
-        # Save the review
+        # Generate review, streaming the synthesis into the result file
+        on_progress = review_progress(task_id, 0.5)
         review_path = os.path.join("results", f"review_{task_id}.txt")
+        review_writer = ReviewStreamWriter(task_id, review_path)
+        try:
+            result = review_service.process_papers_and_generate_review(
+                md_files, options, prefetcher.futures, on_progress, review_writer.write, **sampling
+            )
+        finally:
+            review_writer.close()
+        
+        # Save the final review, replacing any partial streamed text
         with open(review_path, "w", encoding="utf-8") as f:
             f.write(result["review"])
         
@@ -116,13 +218,22 @@ def process_pdfs_task(task_id: str, file_paths: List[str], options: Dict[str, bo
                 "review": result["review"],
                 "review_file": review_path,
                 "papers_processed": result["papers_processed"],
+                "extraction_cache": result["extraction_cache"],
+                "llm_usage": llm_usage.task_summary(task_id),
                 "papers_data_file": papers_data_path
             }
         )
+    except TaskCancelled:
+        raise
     except Exception as e:
         update_task_status(task_id, "failed", 0, message=f"综述生成失败: {str(e)}")
+    finally:
+        prefetcher.close()
 
-def download_arxiv_papers_task(task_id: str, arxiv_ids: List[str], options: Dict[str, bool], pdf_processor: PDFProcessor, review_service: ReviewService):
+def download_arxiv_papers_task(task_id: str, arxiv_ids: List[str], options: Dict[str, bool], sampling: Dict[str, int],
+                               pdf_processor: PDFBackend, review_service: ReviewService):
+    # Key-element extraction starts as soon as each paper's markdown is ready
+    prefetcher = KeyElementPrefetcher(review_service)
     try:
         update_task_status(task_id, "processing", 0.1, message="下载arXiv论文...")
         
@@ -130,8 +241,8 @@ def download_arxiv_papers_task(task_id: str, arxiv_ids: List[str], options: Dict
         temp_dir = os.path.join("temp", task_id)
         os.makedirs(temp_dir, exist_ok=True)
         
-        # Download papers
-        downloaded_papers = PaperDownloader.download_multiple_arxiv_papers(arxiv_ids, temp_dir)
+        # Download papers, reusing PDFs already in the artifact store
+        downloaded_papers = PaperDownloader.download_multiple_arxiv_papers(arxiv_ids, temp_dir, store=artifact_store)
         
         if not downloaded_papers:
             update_task_status(task_id, "failed", 0, message="论文下载失败，未能获取任何论文")
@@ -147,18 +258,8 @@ def download_arxiv_papers_task(task_id: str, arxiv_ids: List[str], options: Dict
         # Process the downloaded PDFs
         pdf_paths = [paper["path"] for paper in downloaded_papers]
         
-        # Create PDF_FOLDER and OUTPUT_FOLDER for processing
-        pdf_folder = os.path.join(temp_dir, "pdfs")
-        output_folder = os.path.join(temp_dir, "mdss")
-        os.makedirs(pdf_folder, exist_ok=True)
-        os.makedirs(output_folder, exist_ok=True)
-        
-        # Copy PDFs to the processing directory
-        for pdf_path in pdf_paths:
-            shutil.copy(pdf_path, os.path.join(pdf_folder, os.path.basename(pdf_path)))
-        
-        # Process PDFs to get markdown files
-        md_files = pdf_processor.process_pdfs(pdf_folder, output_folder)
+        # Process PDFs to get markdown files, reusing cached results
+        md_files = process_pdfs_with_cache(pdf_processor, pdf_paths, temp_dir, artifact_store, on_markdown=prefetcher.submit)
         
         if not md_files:
             update_task_status(task_id, "failed", 0, message="PDF处理失败，未能提取内容")
@@ -166,11 +267,18 @@ def download_arxiv_papers_task(task_id: str, arxiv_ids: List[str], options: Dict
         
         update_task_status(task_id, "processing", 0.6, message=f"提取了 {len(md_files)} 个文件的内容，开始生成综述...")
         
-        # Generate review
-        result = review_service.process_papers_and_generate_review(md_files, options)
-        
-        # Save the review
+        # Generate review, streaming the synthesis into the result file
+        on_progress = review_progress(task_id, 0.6)
         review_path = os.path.join("results", f"review_{task_id}.txt")
+        review_writer = ReviewStreamWriter(task_id, review_path)
+        try:
+            result = review_service.process_papers_and_generate_review(
+                md_files, options, prefetcher.futures, on_progress, review_writer.write, **sampling
+            )
+        finally:
+            review_writer.close()
+        
+        # Save the final review, replacing any partial streamed text
         with open(review_path, "w", encoding="utf-8") as f:
             f.write(result["review"])
         
@@ -187,21 +295,29 @@ def download_arxiv_papers_task(task_id: str, arxiv_ids: List[str], options: Dict
                 "review": result["review"],
                 "review_file": review_path,
                 "papers_processed": result["papers_processed"],
+                "extraction_cache": result["extraction_cache"],
+                "llm_usage": llm_usage.task_summary(task_id),
                 "papers_data_file": papers_data_path,
                 "downloaded_papers": [{"arxiv_id": p["arxiv_id"], "title": p["title"]} for p in downloaded_papers]
             }
         )
+    except TaskCancelled:
+        raise
     except Exception as e:
         update_task_status(task_id, "failed", 0, message=f"综述生成失败: {str(e)}")
+    finally:
+        prefetcher.close()
 
 # API endpoints
 @router.post("/arxiv", response_model=TaskResponse)
 async def generate_review_from_arxiv(
     review_request: ReviewRequest, 
-    background_tasks: BackgroundTasks, 
-    pdf_processor: Optional[PDFProcessor] = Depends(get_pdf_processor),
     review_service: Optional[ReviewService] = Depends(get_review_service)
 ):
+    if len(review_request.arxiv_ids) > MAX_REVIEW_PAPERS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_REVIEW_PAPERS} papers can be reviewed at once")
+    
+    pdf_processor = get_pdf_processor(review_request.pdf_backend)
     if not pdf_processor:
         raise HTTPException(status_code=503, detail="PDF processor not available")
     
@@ -209,32 +325,36 @@ async def generate_review_from_arxiv(
         raise HTTPException(status_code=503, detail="Review service not available")
     
     task_id = generate_task_id()
-    active_tasks[task_id] = {
-        "status": "queued",
-        "progress": 0,
-        "result": None,
-        "message": "任务已加入队列"
-    }
-    
-    background_tasks.add_task(
-        download_arxiv_papers_task,
+    enqueue_task(
         task_id,
+        download_arxiv_papers_task,
         review_request.arxiv_ids,
         review_request.options,
+        {
+            "description_samples": review_request.description_samples,
+            "description_votes": review_request.description_votes
+        },
         pdf_processor,
-        review_service
+        review_service,
+        priority=review_request.priority
     )
     
     return {"task_id": task_id, "status": "queued", "message": "综述生成任务已启动"}
 
 @router.post("/files", response_model=TaskResponse)
 async def generate_review_from_files(
-    background_tasks: BackgroundTasks,
     files: List[UploadFile] = File(...),
     options: str = Form("{}"),
-    pdf_processor: Optional[PDFProcessor] = Depends(get_pdf_processor),
+    priority: int = Form(0),
+    pdf_backend: Optional[str] = Form(None),
+    description_samples: int = Form(DESCRIPTION_SAMPLES, ge=1, le=MAX_DESCRIPTION_SAMPLES),
+    description_votes: int = Form(DESCRIPTION_VOTES, ge=1, le=MAX_DESCRIPTION_SAMPLES),
     review_service: Optional[ReviewService] = Depends(get_review_service)
 ):
+    if len(files) > MAX_REVIEW_PAPERS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_REVIEW_PAPERS} papers can be reviewed at once")
+    
+    pdf_processor = get_pdf_processor(pdf_backend)
     if not pdf_processor:
         raise HTTPException(status_code=503, detail="PDF processor not available")
     
@@ -248,12 +368,6 @@ async def generate_review_from_files(
         options_dict = {}
     
     task_id = generate_task_id()
-    active_tasks[task_id] = {
-        "status": "queued",
-        "progress": 0,
-        "result": None,
-        "message": "任务已加入队列"
-    }
     
     # Create upload directory
     upload_dir = os.path.join("uploads", task_id)
@@ -266,21 +380,28 @@ async def generate_review_from_files(
             continue
         
         file_path = os.path.join(upload_dir, file.filename)
-        with open(file_path, "wb") as f:
-            shutil.copyfileobj(file.file, f)
+        await run_in_threadpool(save_upload, file, file_path)
         file_paths.append(file_path)
     
     if not file_paths:
-        return HTTPException(status_code=400, detail="No valid PDF files uploaded")
+        shutil.rmtree(upload_dir, ignore_errors=True)
+        raise HTTPException(status_code=400, detail="No valid PDF files uploaded")
     
-    background_tasks.add_task(
-        process_pdfs_task,
-        task_id,
-        file_paths,
-        options_dict,
-        pdf_processor,
-        review_service
-    )
+    try:
+        enqueue_task(
+            task_id,
+            process_pdfs_task,
+            file_paths,
+            options_dict,
+            {"description_samples": description_samples, "description_votes": description_votes},
+            pdf_processor,
+            review_service,
+            priority=priority
+        )
+    except HTTPException:
+        # The queue is full: nothing will process the uploaded files
+        shutil.rmtree(upload_dir, ignore_errors=True)
+        raise
     
     return {"task_id": task_id, "status": "queued", "message": "文件上传成功，开始处理"}
 
@@ -298,6 +419,38 @@ async def get_task_status(task_id: str):
         "message": task["message"]
     }
 
+@router.get("/task/{task_id}/events")
+async def stream_task_events(task_id: str, last_event_id: Optional[int] = Header(None)):
+    if task_id not in active_tasks:
+        raise HTTPException(status_code=404, detail="Task not found")
+    
+    return StreamingResponse(
+        task_events.subscribe(task_id, last_event_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.delete("/task/{task_id}")
+async def cancel_task(task_id: str):
+    if task_id not in active_tasks:
+        raise HTTPException(status_code=404, detail="Task not found")
+    
+    if active_tasks[task_id]["status"] in ("completed", "failed", "cancelled"):
+        raise HTTPException(status_code=409, detail="Task already finished")
+    
+    task_queue.cancel(task_id)
+    active_tasks[task_id].update({
+        "status": "cancelled",
+        "message": "任务已取消"
+    })
+    task_events.publish(task_id, "status", {
+        "status": "cancelled",
+        "progress": active_tasks[task_id]["progress"],
+        "message": "任务已取消",
+        "result": None
+    })
+    return {"task_id": task_id, "status": "cancelled", "message": "任务已取消"}
+
 @router.get("/download/{file_path:path}")
 async def download_file(file_path: str):
     full_path = os.path.join("results", file_path)
@@ -1,4 +1,6 @@
-from fastapi import APIRouter, HTTPException, BackgroundTasks, Depends
+from fastapi import APIRouter, HTTPException, Depends, Header
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from typing import List, Dict, Optional, Any
 import os
@@ -8,6 +10,10 @@ from pathlib import Path
 
 # Import services
 from services.search_service import SearchService, DirectSearchService
+from services.task_queue import task_queue, QueueFullError, TaskCancelled
+from services.task_events import task_events
+from services.llm_gateway import llm_usage
+from services.registry import registry
 
 # Create router
 router = APIRouter(
@@ -22,10 +28,12 @@ class SearchQuery(BaseModel):
     search_queries: int = 5
     search_papers: int = 10
     expand_papers: int = 10
+    priority: int = 0
 
 class ExpandRequest(BaseModel):
     arxiv_id: str
     depth: int = 1
+    priority: int = 0
 
 class TaskResponse(BaseModel):
     task_id: str
@@ -39,7 +47,26 @@ active_tasks = {}
 def generate_task_id():
     return str(uuid.uuid4())
 
+def enqueue_task(task_id: str, func, *args, priority: int = 0):
+    active_tasks[task_id] = {
+        "status": "queued",
+        "progress": 0,
+        "result": None,
+        "message": "任务已加入队列"
+    }
+    task_events.publish(task_id, "status", {"status": "queued", "progress": 0, "message": "任务已加入队列", "result": None})
+
+    try:
+        # LLM calls made by the task are accounted to it
+        task_queue.submit("search", task_id, llm_usage.scoped(task_id, func), task_id, *args, priority=priority)
+    except QueueFullError:
+        del active_tasks[task_id]
+        task_events.discard(task_id)
+        raise HTTPException(status_code=429, detail="Too many search tasks queued, please retry later", headers={"Retry-After": "10"})
+
 def update_task_status(task_id: str, status: str, progress: float, result=None, message=None):
+    # Cancelled tasks stop at their next status update instead of overwriting the cancelled state
+    task_queue.check_cancelled(task_id)
     if task_id in active_tasks:
         active_tasks[task_id].update({
             "status": status,
@@ -47,24 +74,25 @@ def update_task_status(task_id: str, status: str, progress: float, result=None,
             "result": result,
             "message": message
         })
+        task_events.publish(task_id, "status", {
+            "status": status,
+            "progress": progress,
+            "message": message,
+            "result": result if status == "completed" else None
+        })
 
-# Dependency to get SearchService
+# Dependency to get the shared SearchService
 def get_search_service():
-    from agent import Agent
-    from constants import CRAWLER_MODEL, SELECTOR_MODEL
-    
     try:
-        crawler = Agent(os.getenv("CRAWLER_MODEL", CRAWLER_MODEL), "crawler")
-        selector = Agent(os.getenv("SELECTOR_MODEL", SELECTOR_MODEL), "selector")
-        return SearchService(crawler=crawler, selector=selector)
+        return registry.get("search_service")
     except Exception as e:
         print(f"Failed to initialize agents: {e}")
         return None
 
-# Dependency to get DirectSearchService
+# Dependency to get the shared DirectSearchService
 def get_direct_search_service():
     try:
-        return DirectSearchService()
+        return registry.get("direct_search_service")
     except Exception as e:
         print(f"Failed to initialize direct search service: {e}")
         return None
@@ -74,12 +102,30 @@ def search_papers_task(task_id: str, query: str, search_queries: int, search_pap
     try:
         update_task_status(task_id, "processing", 0.1, message="初始化搜索...")
         
+        # Publish each paper to the task record as soon as it has been scored
+        partial_papers = []
+        expected_papers = max(search_queries * search_papers, 1)
+        
+        def on_paper(paper):
+            # Cancelled tasks must not publish papers after their cancelled status
+            task_queue.check_cancelled(task_id)
+            partial_papers.append(paper)
+            task_events.publish(task_id, "paper", paper)
+            update_task_status(
+                task_id,
+                "processing",
+                min(0.9, 0.1 + 0.8 * len(partial_papers) / expected_papers),
+                result={"papers": list(partial_papers), "total_found": len(partial_papers), "partial": True},
+                message=f"已评估 {len(partial_papers)} 篇论文..."
+            )
+        
         # Search for papers
         results = search_service.search_papers(
             query=query,
             search_queries=search_queries,
             search_papers=search_papers,
-            expand_papers=expand_papers
+            expand_papers=expand_papers,
+            on_paper=on_paper
         )
         
         # Save results
@@ -99,9 +145,12 @@ def search_papers_task(task_id: str, query: str, search_queries: int, search_pap
                 "total_found": len(papers),
                 "relevant_papers": results["relevant_papers"],
                 "search_queries": results["search_queries"],
-                "result_file": result_path
+                "result_file": result_path,
+                "llm_usage": llm_usage.task_summary(task_id)
             }
         )
+    except TaskCancelled:
+        raise
     except Exception as e:
         update_task_status(task_id, "failed", 0, message=f"搜索失败: {str(e)}")
 
@@ -130,57 +179,48 @@ def expand_citations_task(task_id: str, arxiv_id: str, depth: int, search_servic
                 "total_cited": results["total_cited"],
                 "relevant_cited": results["relevant_cited"],
                 "sections": results["sections"],
-                "result_file": result_path
+                "result_file": result_path,
+                "llm_usage": llm_usage.task_summary(task_id)
             }
         )
+    except TaskCancelled:
+        raise
     except Exception as e:
         update_task_status(task_id, "failed", 0, message=f"引文扩展失败: {str(e)}")
 
 # API endpoints
 @router.post("", response_model=TaskResponse)
-async def search_papers(search_query: SearchQuery, background_tasks: BackgroundTasks, search_service: Optional[SearchService] = Depends(get_search_service)):
+async def search_papers(search_query: SearchQuery, search_service: Optional[SearchService] = Depends(get_search_service)):
     if not search_service:
         raise HTTPException(status_code=503, detail="Search service not available")
     
     task_id = generate_task_id()
-    active_tasks[task_id] = {
-        "status": "queued",
-        "progress": 0,
-        "result": None,
-        "message": "任务已加入队列"
-    }
-    
-    background_tasks.add_task(
-        search_papers_task,
+    enqueue_task(
         task_id,
+        search_papers_task,
         search_query.query,
         search_query.search_queries,
         search_query.search_papers,
         search_query.expand_papers,
-        search_service
+        search_service,
+        priority=search_query.priority
     )
     
     return {"task_id": task_id, "status": "queued", "message": "搜索任务已启动"}
 
 @router.post("/expand", response_model=TaskResponse)
-async def expand_citations(expand_request: ExpandRequest, background_tasks: BackgroundTasks, search_service: Optional[SearchService] = Depends(get_search_service)):
+async def expand_citations(expand_request: ExpandRequest, search_service: Optional[SearchService] = Depends(get_search_service)):
     if not search_service:
         raise HTTPException(status_code=503, detail="Search service not available")
     
     task_id = generate_task_id()
-    active_tasks[task_id] = {
-        "status": "queued",
-        "progress": 0,
-        "result": None,
-        "message": "任务已加入队列"
-    }
-    
-    background_tasks.add_task(
-        expand_citations_task,
+    enqueue_task(
         task_id,
+        expand_citations_task,
         expand_request.arxiv_id,
         expand_request.depth,
-        search_service
+        search_service,
+        priority=expand_request.priority
     )
     
     return {"task_id": task_id, "status": "queued", "message": "引文扩展任务已启动"}
@@ -191,18 +231,16 @@ async def direct_search(query: str, limit: int = 10, direct_search_service: Opti
         raise HTTPException(status_code=503, detail="Direct search service not available")
     
     try:
-        papers = direct_search_service.search_papers(query, num_results=limit)
+        # Search and metadata lookups are blocking HTTP calls; keep them off the event loop
+        papers = await run_in_threadpool(direct_search_service.search_papers, query, num_results=limit)
         return {"papers": papers, "total": len(papers)}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/paper/{arxiv_id}")
-async def get_paper_info(arxiv_id: str, search_service: Optional[SearchService] = Depends(get_search_service)):
-    if not search_service:
-        raise HTTPException(status_code=503, detail="Search service not available")
-    
+async def get_paper_info(arxiv_id: str):
     try:
-        paper_info = search_service.get_paper_info(arxiv_id)
+        paper_info = await run_in_threadpool(SearchService.get_paper_info, arxiv_id)
         return paper_info
     except ValueError as e:
         raise HTTPException(status_code=404, detail=str(e))
@@ -222,3 +260,35 @@ async def get_task_status(task_id: str):
         "result": task["result"],
         "message": task["message"]
     }
+
+@router.get("/task/{task_id}/events")
+async def stream_task_events(task_id: str, last_event_id: Optional[int] = Header(None)):
+    if task_id not in active_tasks:
+        raise HTTPException(status_code=404, detail="Task not found")
+    
+    return StreamingResponse(
+        task_events.subscribe(task_id, last_event_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.delete("/task/{task_id}")
+async def cancel_task(task_id: str):
+    if task_id not in active_tasks:
+        raise HTTPException(status_code=404, detail="Task not found")
+    
+    if active_tasks[task_id]["status"] in ("completed", "failed", "cancelled"):
+        raise HTTPException(status_code=409, detail="Task already finished")
+    
+    task_queue.cancel(task_id)
+    active_tasks[task_id].update({
+        "status": "cancelled",
+        "message": "任务已取消"
+    })
+    task_events.publish(task_id, "status", {
+        "status": "cancelled",
+        "progress": active_tasks[task_id]["progress"],
+        "message": "任务已取消",
+        "result": None
+    })
+    return {"task_id": task_id, "status": "cancelled", "message": "任务已取消"}
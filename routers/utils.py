@@ -113,6 +113,27 @@ async def get_active_tasks():
     
     return {"tasks": list(all_tasks.values())}
 
+@router.get("/queue")
+async def get_queue_stats():
+    """
+    Get worker and queue-depth information per task type
+    """
+    from services.task_queue import task_queue
+    
+    return {"queues": task_queue.stats()}
+
+@router.get("/metrics")
+async def get_metrics():
+    """
+    Get in-process counters, e.g. how often shared services were created vs. reused,
+    LLM token, latency and cost totals per model and call site, and the adaptive
+    concurrency limit of each LLM endpoint
+    """
+    from services.metrics import metrics
+    from services.llm_gateway import llm_usage, llm_clients
+    
+    return {"metrics": metrics.snapshot(), "llm": llm_usage.snapshot(), "llm_limits": llm_clients.limits_snapshot()}
+
 @router.get("/results")
 async def get_results():
     """
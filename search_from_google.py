@@ -3,24 +3,24 @@ import json
 import requests
 import warnings
 from datetime import datetime
-from openai import OpenAI
 import os
 from expand_paper import get_paper_metadata_by_id
+from services.llm_gateway import chat_completion, get_client
 from dotenv import load_dotenv
 
 load_dotenv()
 
 # 配置OpenAI客户端
 def get_openai_client(base_url, api_key):
-    return OpenAI(
-        base_url=base_url,
-        api_key=api_key
-    )
+    # 使用网关中按接口地址共享的客户端
+    return get_client(base_url, api_key)
 
 # 从OpenAI获取查询改写
 def get_query_rewrites(client, user_query):
     try:
-        response = client.chat.completions.create(
+        response = chat_completion(
+            client,
+            "search.query_rewrite",
             model="deepseek-chat",
             messages=[
                 {"role": "system", "content": "You are a query rewriting assistant. Users will provide an academic query, and you need to generate at least 5 different rewritten versions to better retrieve relevant papers. Please return in the following format: [search]rewritten query 1\n[search]rewritten query 2\n[search]rewritten query 3\n[search]rewritten query 4\n[search]rewritten query 5\n[stopsearch]"},
@@ -0,0 +1,246 @@
+import os
+import json
+import uuid
+import shutil
+import hashlib
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+from dotenv import load_dotenv
+
+from constants import ARTIFACT_CACHE_DIR, ARTIFACT_CACHE_MAX_BYTES
+
+# Load environment variables before the shared store below reads its settings
+load_dotenv()
+
+def link_or_copy(src: str, dst: str):
+    """
+    Hard-link src to dst, falling back to a copy across file systems
+
+    Staged files are only ever read, so sharing the inode with the store is safe.
+    """
+    if os.path.exists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+def link_tree(src_dir: str, dst_dir: str):
+    """Recreate a directory tree at dst_dir with hard-linked files"""
+    shutil.copytree(src_dir, dst_dir, copy_function=link_or_copy, dirs_exist_ok=True)
+
+class ArtifactStore:
+    def __init__(self, root_dir: str = ARTIFACT_CACHE_DIR, max_bytes: int = ARTIFACT_CACHE_MAX_BYTES):
+        """
+        Content-addressed cache for artifacts shared across review tasks
+
+        Entries are directories addressed by a key of the form "<namespace>/<name>":
+            arxiv/<arxiv_id>        downloaded PDF and its HTTP validators
+            sha256/<digest>         MinerU output (full.md, images/) of a PDF with that SHA-256
+            sha256-local/<digest>   output of the local PDF backend for that PDF
+            elements/<digest>       extracted key elements, keyed by content, model and question set
+
+        Least recently used entries are evicted once the store exceeds max_bytes.
+        The size of each entry is tracked as entries are written, so the store is
+        only walked on first use and when it has grown past the limit.
+
+        Args:
+            root_dir: Directory holding the store
+            max_bytes: Size limit of the store in bytes
+        """
+        self.root_dir = root_dir
+        self.max_bytes = max_bytes
+        self._locks_guard = threading.Lock()
+        self._locks: Dict[str, threading.Lock] = {}
+        self._sizes_lock = threading.Lock()
+        self._entry_sizes: Optional[Dict[str, int]] = None
+        self._total_size = 0
+
+    @staticmethod
+    def arxiv_key(arxiv_id: str) -> str:
+        # Old-style IDs such as hep-th/9901001 contain a slash
+        return f"arxiv/{arxiv_id.replace('/', '_')}"
+
+    @staticmethod
+    def sha256_key(digest: str, backend: str = "mineru") -> str:
+        # MinerU output keeps the plain namespace, other PDF backends get their own
+        if backend == "mineru":
+            return f"sha256/{digest}"
+        return f"sha256-{backend}/{digest}"
+
+    @staticmethod
+    def elements_key(digest: str) -> str:
+        return f"elements/{digest}"
+
+    @staticmethod
+    def file_sha256(path: str) -> str:
+        sha256 = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                sha256.update(chunk)
+        return sha256.hexdigest()
+
+    @staticmethod
+    def dir_size(path: str) -> int:
+        size = 0
+        for root, _, files in os.walk(path):
+            for f in files:
+                try:
+                    size += os.path.getsize(os.path.join(root, f))
+                except OSError:
+                    # Removed concurrently, e.g. by another process evicting the entry
+                    pass
+        return size
+
+    def entry_path(self, key: str) -> str:
+        return os.path.join(self.root_dir, *key.split("/"))
+
+    @contextmanager
+    def lock(self, key: str):
+        """Serialize work on one entry within this process"""
+        with self._locks_guard:
+            key_lock = self._locks.setdefault(key, threading.Lock())
+        with key_lock:
+            yield
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Get the directory of an entry and mark it as recently used
+
+        Returns:
+            Path to the entry directory, or None if it is not cached
+        """
+        path = self.entry_path(key)
+        if not os.path.isdir(path):
+            return None
+        os.utime(path)
+        return path
+
+    def put(self, key: str, files: Dict[str, str]) -> str:
+        """
+        Store files and directories as the entry for key
+
+        The entry is built next to the store and renamed into place, so readers
+        never see a partially written entry.
+
+        Args:
+            key: Entry key
+            files: Mapping of entry-relative names to source files or directories
+
+        Returns:
+            Path to the entry directory
+        """
+        path = self.entry_path(key)
+        tmp_path = os.path.join(self.root_dir, ".tmp", uuid.uuid4().hex)
+        os.makedirs(tmp_path)
+        for name, src in files.items():
+            if os.path.isdir(src):
+                link_tree(src, os.path.join(tmp_path, name))
+            else:
+                link_or_copy(src, os.path.join(tmp_path, name))
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        os.rename(tmp_path, path)
+
+        self.refresh(key)
+        self.evict()
+        return path
+
+    def get_json(self, key: str, name: str) -> Optional[Any]:
+        path = self.get(key)
+        if not path or not os.path.exists(os.path.join(path, name)):
+            return None
+        with open(os.path.join(path, name), "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def put_json(self, key: str, name: str, data: Any):
+        path = self.entry_path(key)
+        os.makedirs(path, exist_ok=True)
+        tmp_file = os.path.join(path, f".{name}.{uuid.uuid4().hex}")
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_file, os.path.join(path, name))
+        self.refresh(key)
+        self.evict()
+
+    def _scan(self) -> Dict[str, int]:
+        """Walk the store and measure every entry"""
+        sizes = {}
+        if not os.path.isdir(self.root_dir):
+            return sizes
+
+        for namespace in os.listdir(self.root_dir):
+            namespace_dir = os.path.join(self.root_dir, namespace)
+            if namespace.startswith(".") or not os.path.isdir(namespace_dir):
+                continue
+            try:
+                names = os.listdir(namespace_dir)
+            except OSError:
+                continue
+            for name in names:
+                sizes[f"{namespace}/{name}"] = self.dir_size(os.path.join(namespace_dir, name))
+        return sizes
+
+    def _load_sizes(self):
+        # Caller holds _sizes_lock
+        if self._entry_sizes is None:
+            self._entry_sizes = self._scan()
+            self._total_size = sum(self._entry_sizes.values())
+
+    def refresh(self, key: str):
+        """Update the tracked size of an entry after it has been written in place"""
+        path = self.entry_path(key)
+        size = self.dir_size(path) if os.path.isdir(path) else 0
+        with self._sizes_lock:
+            self._load_sizes()
+            self._total_size += size - self._entry_sizes.get(key, 0)
+            self._entry_sizes[key] = size
+
+    def evict(self):
+        """Remove least recently used entries until the store fits max_bytes"""
+        with self._sizes_lock:
+            self._load_sizes()
+            if self._total_size <= self.max_bytes:
+                return
+
+            # Re-measure before evicting, other processes may share the store
+            self._entry_sizes = self._scan()
+            self._total_size = sum(self._entry_sizes.values())
+            entries = []
+            for key, size in list(self._entry_sizes.items()):
+                path = self.entry_path(key)
+                try:
+                    mtime = os.path.getmtime(path)
+                except OSError:
+                    # Removed by another process since the scan
+                    self._total_size -= size
+                    del self._entry_sizes[key]
+                    continue
+                entries.append((mtime, size, key, path))
+
+            entries.sort()
+            for _, size, key, path in entries:
+                if self._total_size <= self.max_bytes:
+                    break
+
+                with self._locks_guard:
+                    key_lock = self._locks.setdefault(key, threading.Lock())
+                # Skip entries that are being written or read right now
+                if not key_lock.acquire(blocking=False):
+                    continue
+                try:
+                    shutil.rmtree(path, ignore_errors=True)
+                    self._total_size -= size
+                    del self._entry_sizes[key]
+                finally:
+                    key_lock.release()
+
+# Shared store used by the review pipeline
+artifact_store = ArtifactStore(
+    root_dir=os.getenv("ARTIFACT_CACHE_DIR", ARTIFACT_CACHE_DIR),
+    max_bytes=int(os.getenv("ARTIFACT_CACHE_MAX_BYTES", ARTIFACT_CACHE_MAX_BYTES))
+)
@@ -0,0 +1,723 @@
+import os
+import re
+import time
+import hashlib
+import threading
+import contextvars
+from collections import OrderedDict, defaultdict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import httpx
+from dotenv import load_dotenv
+from openai import OpenAI, DefaultHttpxClient, RateLimitError, InternalServerError, APITimeoutError, APIConnectionError
+
+from services.metrics import metrics
+from constants import (
+    OPENAI_BASE_URL, LLM_PRICES, LLM_TIMEOUT, LLM_CONNECT_TIMEOUT, LLM_MAX_RETRIES,
+    LLM_MAX_CONNECTIONS, LLM_DEFAULT_CONCURRENCY, LLM_MODEL_CONCURRENCY,
+    LLM_AIMD_INITIAL_LIMIT, LLM_AIMD_MAX_LIMIT, LLM_AIMD_BACKOFF, LLM_AIMD_LATENCY_TOLERANCE,
+    LLM_AIMD_MIN_LATENCY_TOKENS,
+    LLM_ENDPOINT_COOLDOWN, LLM_HEALTH_CHECK_INTERVAL, LLM_AFFINITY_PREFIX_CHARS, LLM_AFFINITY_SLACK
+)
+
+# Load environment variables before the shared pool below reads its settings
+load_dotenv()
+
+# Errors that mean the endpoint is past its capacity; streams raise httpx errors directly
+OVERLOAD_ERRORS = (RateLimitError, InternalServerError, APITimeoutError, APIConnectionError, httpx.TransportError)
+OVERLOAD_STATUS_CODES = (429, 502, 503, 504)
+
+# Task and stage the current LLM calls are accounted to, set per worker thread
+_current_task: contextvars.ContextVar = contextvars.ContextVar("llm_task", default=None)
+_current_stage: contextvars.ContextVar = contextvars.ContextVar("llm_stage", default="other")
+# Totals of the enclosing usage_meter blocks, which also receive every record
+_current_meters: contextvars.ContextVar = contextvars.ContextVar("llm_meters", default=())
+# Endpoints that already signalled overload during the logical call in progress, which
+# spans the SDK's retries and the balancer's attempts; each counts once per endpoint
+_current_call: contextvars.ContextVar = contextvars.ContextVar("llm_call", default=None)
+
+class ContextThreadPoolExecutor(ThreadPoolExecutor):
+    """
+    Thread pool that runs every job in a copy of the submitter's context
+
+    Plain thread pools start jobs in an empty context, so LLM calls made in
+    them would lose the task and stage they belong to.
+    """
+    def submit(self, fn, /, *args, **kwargs):
+        context = contextvars.copy_context()
+        return super().submit(context.run, fn, *args, **kwargs)
+
+def _empty_totals() -> Dict[str, float]:
+    return {
+        "calls": 0, "errors": 0, "prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0,
+        "latency": 0.0, "cost": 0.0
+    }
+
+def _add(totals: Dict[str, float], record: Dict[str, Any]):
+    totals["calls"] += 1
+    totals["errors"] += int(record["error"])
+    totals["prompt_tokens"] += record["prompt_tokens"]
+    totals["cached_tokens"] += record["cached_tokens"]
+    totals["completion_tokens"] += record["completion_tokens"]
+    totals["latency"] += record["latency"]
+    totals["cost"] += record["cost"]
+
+class LLMUsageTracker:
+    def __init__(self, prices: Dict[str, Dict[str, float]] = LLM_PRICES, max_tasks: int = 1000):
+        """
+        Token, latency and cost accounting for every LLM request
+
+        Requests are aggregated globally per model and call site, and per task
+        by stage and call site. Only the most recent max_tasks tasks are kept.
+
+        Args:
+            prices: USD per million prompt/completion tokens, keyed by model
+            max_tasks: Number of tasks whose usage is kept in memory
+        """
+        self.prices = prices
+        self.max_tasks = max_tasks
+        self._lock = threading.Lock()
+        self._totals = _empty_totals()
+        self._models: Dict[str, Dict[str, float]] = defaultdict(_empty_totals)
+        self._call_sites: Dict[str, Dict[str, float]] = defaultdict(_empty_totals)
+        self._tasks: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+    def cost(self, model: str, prompt_tokens: int, completion_tokens: int) -> float:
+        price = self.prices.get(model)
+        if not price:
+            return 0.0
+        return (prompt_tokens * price["prompt"] + completion_tokens * price["completion"]) / 1e6
+
+    def record(self, model: str, call_site: str, prompt_tokens: int, completion_tokens: int,
+               latency: float, error: bool = False, cached_tokens: int = 0):
+        """
+        Record one request under the current task and stage
+
+        Args:
+            model: Model the request was sent to
+            call_site: Name of the code path that made the request
+            prompt_tokens: Prompt tokens reported (or estimated) for the request
+            completion_tokens: Completion tokens reported (or estimated) for the request
+            latency: Seconds until the full response was received
+            error: Whether the request failed
+            cached_tokens: Prompt tokens served from the endpoint's prefix cache
+        """
+        record = {
+            "prompt_tokens": prompt_tokens,
+            "cached_tokens": cached_tokens,
+            "completion_tokens": completion_tokens,
+            "latency": latency,
+            "error": error,
+            "cost": self.cost(model, prompt_tokens, completion_tokens)
+        }
+        task_id = _current_task.get()
+        stage = _current_stage.get()
+
+        with self._lock:
+            _add(self._totals, record)
+            for meter in _current_meters.get():
+                _add(meter, record)
+            _add(self._models[model], record)
+            _add(self._call_sites[call_site], record)
+
+            if task_id is None:
+                return
+            task = self._tasks.get(task_id)
+            if task is None:
+                task = self._tasks[task_id] = {
+                    "totals": _empty_totals(),
+                    "stages": defaultdict(_empty_totals),
+                    "call_sites": defaultdict(_empty_totals)
+                }
+                while len(self._tasks) > self.max_tasks:
+                    self._tasks.popitem(last=False)
+            _add(task["totals"], record)
+            _add(task["stages"][stage], record)
+            _add(task["call_sites"][call_site], record)
+
+    def task_summary(self, task_id: str) -> Dict[str, Any]:
+        """Usage of one task, in total and per stage and call site"""
+        with self._lock:
+            task = self._tasks.get(task_id)
+            if task is None:
+                return {"totals": _empty_totals(), "stages": {}, "call_sites": {}}
+            return {
+                "totals": dict(task["totals"]),
+                "stages": {name: dict(totals) for name, totals in task["stages"].items()},
+                "call_sites": {name: dict(totals) for name, totals in task["call_sites"].items()}
+            }
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Process-wide usage, in total and per model and call site"""
+        with self._lock:
+            return {
+                "totals": dict(self._totals),
+                "models": {name: dict(totals) for name, totals in sorted(self._models.items())},
+                "call_sites": {name: dict(totals) for name, totals in sorted(self._call_sites.items())}
+            }
+
+    @staticmethod
+    def scoped(task_id: str, func: Callable) -> Callable:
+        """Wrap a task function so the LLM calls it makes are accounted to task_id"""
+        def run(*args, **kwargs):
+            token = _current_task.set(task_id)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                _current_task.reset(token)
+        return run
+
+class AdaptiveLimiter:
+    def __init__(self, initial_limit: float = LLM_AIMD_INITIAL_LIMIT, max_limit: float = LLM_AIMD_MAX_LIMIT,
+                 backoff: float = LLM_AIMD_BACKOFF, latency_tolerance: float = LLM_AIMD_LATENCY_TOLERANCE,
+                 min_latency_tokens: int = LLM_AIMD_MIN_LATENCY_TOKENS, smoothing: float = 0.2):
+        """
+        AIMD controller for the number of requests in flight to one endpoint
+
+        While the endpoint keeps up and the limit is in use, the limit grows by
+        one per round trip (additive increase). A 429/5xx response, a timeout or
+        latency per output token rising above latency_tolerance times its
+        baseline multiplies it by backoff (multiplicative decrease), at most once
+        per round trip so one burst of failures counts as one congestion signal.
+        A request retried after overload is one signal too: chat_completion
+        passes signalled=True once the response hook has counted it.
+
+        Call sites share an endpoint but differ widely in latency per output
+        token (a one-token relevance score is mostly prefill, a long review is
+        mostly decoding), so the latency baseline is kept per call site and
+        output length, and completions shorter than min_latency_tokens are not
+        used as a signal.
+
+        Args:
+            initial_limit: Starting limit
+            max_limit: Upper bound of the limit
+            backoff: Factor applied to the limit on overload
+            latency_tolerance: Allowed ratio of current to baseline latency
+            min_latency_tokens: Output tokens a request needs to count as a latency sample
+            smoothing: Weight of new samples in the latency averages
+        """
+        self.limit = float(initial_limit)
+        self.max_limit = max_limit
+        self.backoff = backoff
+        self.latency_tolerance = latency_tolerance
+        self.min_latency_tokens = min_latency_tokens
+        self.smoothing = smoothing
+        self.in_flight = 0
+        self._condition = threading.Condition()
+        self._token_latency: Dict[str, float] = {}  # seconds per output token per call site and length, smoothed
+        self._baseline: Dict[str, float] = {}
+        self._round_trip = 1.0
+        self._last_decrease = 0.0
+
+    def acquire(self):
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+
+    def release(self, latency: float, completion_tokens: int, overloaded: bool = False, call_site: str = "other",
+                signalled: bool = False):
+        """
+        Return a slot and adjust the limit from the outcome of the request
+
+        Args:
+            latency: Seconds the request took
+            completion_tokens: Output tokens of the request
+            overloaded: Whether the request, or an attempt of it, hit an overloaded endpoint
+            call_site: Code path of the request, whose latency baseline is compared against
+            signalled: Whether the overload was already passed to overloaded(), so it is not counted twice
+        """
+        with self._condition:
+            saturated = self.in_flight >= int(self.limit)
+            self.in_flight -= 1
+            if not overloaded:
+                self._round_trip += self.smoothing * (latency - self._round_trip)
+                if completion_tokens >= max(1, self.min_latency_tokens):
+                    # Fixed prefill and queueing time weigh more on short outputs, so
+                    # outputs of similar length (within a power of two) share a baseline
+                    key = f"{call_site}/{completion_tokens.bit_length()}"
+                    overloaded = self._latency_blowup(key, latency / completion_tokens)
+
+            if overloaded:
+                if not signalled:
+                    self._decrease()
+            elif saturated:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+    def overloaded(self):
+        """Signal an overload seen outside a request's outcome, e.g. a retried 429"""
+        with self._condition:
+            self._decrease()
+            self._condition.notify_all()
+
+    def _latency_blowup(self, key: str, token_latency: float) -> bool:
+        if key not in self._token_latency:
+            self._token_latency[key] = self._baseline[key] = token_latency
+            return False
+        current = self._token_latency[key] + self.smoothing * (token_latency - self._token_latency[key])
+        baseline = self._baseline[key]
+        if current < baseline:
+            baseline = current
+        else:
+            # Let the baseline follow an endpoint that has become permanently slower
+            baseline += 0.01 * (current - baseline)
+        self._token_latency[key], self._baseline[key] = current, baseline
+        return current > self.latency_tolerance * baseline
+
+    def _decrease(self):
+        now = time.monotonic()
+        if now - self._last_decrease < self._round_trip:
+            return
+        self._last_decrease = now
+        self.limit = max(1.0, self.limit * self.backoff)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._condition:
+            return {
+                "limit": round(self.limit, 2),
+                "in_flight": self.in_flight,
+                "token_latency": dict(self._token_latency),
+                "baseline_token_latency": dict(self._baseline)
+            }
+
+class ClientPool:
+    def __init__(self, timeout: float = LLM_TIMEOUT, connect_timeout: float = LLM_CONNECT_TIMEOUT,
+                 max_retries: int = LLM_MAX_RETRIES, max_connections: int = LLM_MAX_CONNECTIONS,
+                 default_concurrency: int = LLM_DEFAULT_CONCURRENCY,
+                 model_concurrency: Dict[str, int] = LLM_MODEL_CONCURRENCY):
+        """
+        OpenAI clients shared by every subsystem, one per base URL and API key
+
+        All clients use the same timeouts, retry policy (the SDK's exponential
+        backoff on connection errors, 429 and 5xx) and connection pool size, and
+        requests to each model are limited to a fixed number in flight, so bursts
+        from search and review tasks share the endpoint's capacity. Below that
+        cap, an AdaptiveLimiter per base URL tunes the in-flight requests to what
+        the endpoint currently sustains.
+
+        Args:
+            timeout: Seconds to wait for each read from the endpoint
+            connect_timeout: Seconds to wait for a connection
+            max_retries: Retries per request
+            max_connections: HTTP connections per client
+            default_concurrency: In-flight requests allowed per model
+            model_concurrency: Per-model overrides of default_concurrency
+        """
+        self.timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        self.max_retries = max_retries
+        self.max_connections = max_connections
+        self.default_concurrency = default_concurrency
+        self.model_concurrency = dict(model_concurrency)
+        self._lock = threading.Lock()
+        self._clients: Dict[Tuple[str, str], OpenAI] = {}
+        self._model_limits: Dict[str, threading.BoundedSemaphore] = {}
+        self._endpoint_limits: Dict[str, AdaptiveLimiter] = {}
+
+    def get(self, base_url: Optional[str] = None, api_key: Optional[str] = None) -> OpenAI:
+        """
+        Get the shared client for a base URL, creating it on first use
+
+        Args:
+            base_url: Base URL of the endpoint (defaults to OPENAI_BASE_URL)
+            api_key: API key (defaults to OPENAI_API_KEY)
+        """
+        base_url = (base_url or os.getenv("OPENAI_BASE_URL", OPENAI_BASE_URL)).rstrip("/")
+        api_key = api_key or os.getenv("OPENAI_API_KEY")
+        key = (base_url, api_key)
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                client = self._clients[key] = OpenAI(
+                    api_key=api_key,
+                    base_url=base_url,
+                    timeout=self.timeout,
+                    max_retries=self.max_retries,
+                    http_client=DefaultHttpxClient(
+                        timeout=self.timeout,
+                        limits=httpx.Limits(
+                            max_connections=self.max_connections,
+                            max_keepalive_connections=self.max_connections
+                        ),
+                        # Sees every attempt, including 429s the SDK retries transparently
+                        event_hooks={"response": [self._response_hook(base_url)]}
+                    )
+                )
+                metrics.incr("llm_clients.created")
+        return client
+
+    def _response_hook(self, base_url: str) -> Callable[[httpx.Response], None]:
+        def on_response(response: httpx.Response):
+            if response.status_code not in OVERLOAD_STATUS_CODES:
+                return
+            signalled = _current_call.get()
+            if signalled is not None:
+                # The SDK retries an overloaded request several times; the whole
+                # logical call is one congestion signal, not one per attempt
+                if base_url in signalled:
+                    return
+                signalled.add(base_url)
+            self.endpoint_limit(base_url).overloaded()
+        return on_response
+
+    def endpoint_limit(self, base_url: str) -> AdaptiveLimiter:
+        base_url = str(base_url).rstrip("/")
+        with self._lock:
+            limit = self._endpoint_limits.get(base_url)
+            if limit is None:
+                limit = self._endpoint_limits[base_url] = AdaptiveLimiter()
+        return limit
+
+    def limits_snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """Current adaptive limit and latency estimates per endpoint"""
+        with self._lock:
+            limits = dict(self._endpoint_limits)
+        return {base_url: limit.snapshot() for base_url, limit in sorted(limits.items())}
+
+    def model_limit(self, model: str) -> threading.BoundedSemaphore:
+        with self._lock:
+            limit = self._model_limits.get(model)
+            if limit is None:
+                limit = self._model_limits[model] = threading.BoundedSemaphore(
+                    self.model_concurrency.get(model, self.default_concurrency)
+                )
+        return limit
+
+    def close(self):
+        """Close the connection pools of all clients"""
+        with self._lock:
+            clients, self._clients = self._clients, {}
+        for client in clients.values():
+            client.close()
+
+@contextmanager
+def usage_stage(stage: str):
+    """Account the LLM calls made inside the block to a pipeline stage"""
+    token = _current_stage.set(stage)
+    try:
+        yield
+    finally:
+        _current_stage.reset(token)
+
+@contextmanager
+def usage_meter():
+    """
+    Measure the LLM calls made inside the block, including those made from
+    ContextThreadPoolExecutor jobs it submits
+
+    Yields the totals dict (calls, tokens, latency, cost), which is filled in
+    as the requests finish.
+    """
+    totals = _empty_totals()
+    token = _current_meters.set(_current_meters.get() + (totals,))
+    try:
+        yield totals
+    finally:
+        _current_meters.reset(token)
+
+def _cached_tokens(usage) -> int:
+    # OpenAI and SGLang (--enable-cache-report) report prompt_tokens_details, DeepSeek its own field
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = getattr(details, "cached_tokens", None) if details is not None else None
+    if cached is None:
+        cached = getattr(usage, "prompt_cache_hit_tokens", None)
+    return cached or 0
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count: one token per CJK character, one per 4 other characters"""
+    cjk = len(re.findall(r"[\u3000-\u9fff\uac00-\ud7af]", text))
+    return cjk + (len(text) - cjk) // 4 + 1
+
+def _estimate_tokens(kwargs: Dict[str, Any], content: str):
+    # Some OpenAI-compatible servers omit usage; fall back to an estimate
+    prompt = "".join(str(message.get("content", "")) for message in kwargs.get("messages", []))
+    return estimate_tokens(prompt), estimate_tokens(content)
+
+class _UsageStream:
+    """Iterate a streamed completion and record its usage once it ends (or is closed)"""
+    def __init__(self, stream, on_done: Callable[[Optional[Any], str, Optional[BaseException]], None]):
+        self._stream = stream
+        self._on_done = on_done
+        self._usage = None
+        self._parts = []
+        self._done = False
+
+    def __iter__(self):
+        error = None
+        try:
+            for chunk in self._stream:
+                if getattr(chunk, "usage", None):
+                    self._usage = chunk.usage
+                if chunk.choices and chunk.choices[0].delta.content:
+                    self._parts.append(chunk.choices[0].delta.content)
+                yield chunk
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self._finish(error)
+
+    def _finish(self, error: Optional[BaseException]):
+        if not self._done:
+            self._done = True
+            self._on_done(self._usage, "".join(self._parts), error)
+
+    def close(self):
+        close = getattr(self._stream, "close", None)
+        if callable(close):
+            close()
+        self._finish(None)
+
+def chat_completion(client, call_site: str, **kwargs):
+    """
+    Send a chat completion request through the gateway and record its usage
+
+    Accepts the arguments of client.chat.completions.create. The request waits
+    for a free slot of the model's concurrency limit and of the endpoint's
+    adaptive limit; streamed responses hold the slots and are recorded until
+    the stream is exhausted or closed.
+
+    Args:
+        client: OpenAI-compatible client
+        call_site: Name of the code path making the request, e.g. "review.describe"
+        **kwargs: Arguments for client.chat.completions.create
+
+    Returns:
+        The response, or a wrapped stream when stream=True
+    """
+    model = kwargs.get("model", "unknown")
+    limit = llm_clients.model_limit(model)
+    base_url = str(getattr(client, "base_url", "")).rstrip("/")
+    endpoint = llm_clients.endpoint_limit(base_url)
+    limit.acquire()
+    endpoint.acquire()
+    start = time.monotonic()
+    signalled = _current_call.get()
+    token = None
+    if signalled is None:
+        signalled = set()
+        token = _current_call.set(signalled)
+
+    def release_endpoint(latency: float, completion_tokens: int, error: Optional[BaseException]):
+        # An attempt the SDK retried also keeps the latency of the call out of the baseline
+        seen = base_url in signalled
+        overloaded = isinstance(error, OVERLOAD_ERRORS) or seen
+        if overloaded:
+            signalled.add(base_url)
+        endpoint.release(latency, completion_tokens, overloaded=overloaded, call_site=call_site, signalled=seen)
+
+    def record(usage, content: str, error: Optional[BaseException]):
+        latency = time.monotonic() - start
+        cached_tokens = 0
+        if usage is not None:
+            prompt_tokens, completion_tokens = usage.prompt_tokens or 0, usage.completion_tokens or 0
+            cached_tokens = _cached_tokens(usage)
+        else:
+            prompt_tokens, completion_tokens = _estimate_tokens(kwargs, content)
+        # Only a timeout or a dropped connection midway through a stream counts as overload
+        release_endpoint(latency, completion_tokens, error)
+        limit.release()
+        llm_usage.record(model, call_site, prompt_tokens, completion_tokens, latency, error is not None, cached_tokens)
+
+    if kwargs.get("stream"):
+        kwargs.setdefault("stream_options", {"include_usage": True})
+    try:
+        response = client.chat.completions.create(**kwargs)
+    except Exception as e:
+        latency = time.monotonic() - start
+        release_endpoint(latency, 0, e)
+        limit.release()
+        llm_usage.record(model, call_site, 0, 0, latency, error=True)
+        raise
+    finally:
+        if token is not None:
+            _current_call.reset(token)
+
+    if kwargs.get("stream"):
+        return _UsageStream(response, record)
+    content = "".join((choice.message.content or "") for choice in response.choices)
+    record(getattr(response, "usage", None), content, None)
+    return response
+
+def get_client(base_url: Optional[str] = None, api_key: Optional[str] = None) -> OpenAI:
+    """Get the shared, pooled client for a base URL (see ClientPool.get)"""
+    return llm_clients.get(base_url, api_key)
+
+class EndpointBalancer:
+    def __init__(self, base_urls: List[str], api_key: Optional[str] = None,
+                 cooldown: float = LLM_ENDPOINT_COOLDOWN, health_check_interval: float = LLM_HEALTH_CHECK_INTERVAL,
+                 affinity_prefix_chars: int = LLM_AFFINITY_PREFIX_CHARS, affinity_slack: int = LLM_AFFINITY_SLACK):
+        """
+        Spread requests over replicas of one model served at several base URLs
+
+        Requests go to the healthy replica with the fewest outstanding requests.
+        Requests with an affinity key (a long shared prompt prefix) prefer the
+        replica chosen for that key by rendezvous hashing, so they reuse its
+        prefix cache, unless it has affinity_slack more outstanding requests
+        than the least loaded one. A replica that fails with an overload or
+        connection error is skipped for a cooldown and the request fails over
+        to the next replica; a background thread probes failed replicas.
+
+        With several replicas the balancer owns the retry policy: the clients
+        do not retry themselves, so a dead replica costs one attempt rather
+        than the SDK's full retry budget, and a request gets the pool's
+        max_retries retries spread over the replicas, backing off only after
+        every replica has failed it.
+
+        Args:
+            base_urls: Base URLs of the replicas
+            api_key: API key for all replicas
+            cooldown: Seconds a failed replica is skipped, doubled per consecutive failure
+            health_check_interval: Seconds between probes of failed replicas
+            affinity_prefix_chars: Leading prompt characters used as the affinity key
+            affinity_slack: Extra outstanding requests tolerated on the preferred replica
+        """
+        if not base_urls:
+            raise ValueError("At least one base URL is required")
+        self.base_urls = [base_url.rstrip("/") for base_url in base_urls]
+        self.clients = {base_url: get_client(base_url, api_key) for base_url in self.base_urls}
+        # A single replica keeps the client's own retries, there is nothing to fail over to
+        self.max_retries = 0
+        if len(self.base_urls) > 1:
+            self.max_retries = llm_clients.max_retries
+            self.clients = {base_url: client.with_options(max_retries=0) for base_url, client in self.clients.items()}
+        self.cooldown = cooldown
+        self.health_check_interval = health_check_interval
+        self.affinity_prefix_chars = affinity_prefix_chars
+        self.affinity_slack = affinity_slack
+        self._lock = threading.Lock()
+        self._outstanding = {base_url: 0 for base_url in self.base_urls}
+        self._failures = {base_url: 0 for base_url in self.base_urls}
+        self._unhealthy_until = {base_url: 0.0 for base_url in self.base_urls}
+        self._closed = threading.Event()
+
+        # A single replica has nothing to fail over to, so there is nothing to probe
+        if len(self.base_urls) > 1:
+            threading.Thread(target=self._health_check_loop, name="llm-health-check", daemon=True).start()
+
+    def affinity_key(self, prompt: str) -> str:
+        return prompt[:self.affinity_prefix_chars]
+
+    def _healthy(self, base_url: str, now: float) -> bool:
+        return self._unhealthy_until[base_url] <= now
+
+    def choose(self, affinity_key: Optional[str] = None, exclude: Tuple[str, ...] = ()) -> str:
+        """Pick the replica for the next request and count it as outstanding"""
+        now = time.monotonic()
+        with self._lock:
+            candidates = [url for url in self.base_urls if url not in exclude] or list(self.base_urls)
+            healthy = [url for url in candidates if self._healthy(url, now)]
+            if not healthy:
+                # Every replica failed recently: try the one that comes back first
+                healthy = [min(candidates, key=lambda url: self._unhealthy_until[url])]
+
+            least = min(healthy, key=lambda url: self._outstanding[url])
+            chosen = least
+            if affinity_key is not None and len(healthy) > 1:
+                preferred = max(
+                    healthy,
+                    key=lambda url: hashlib.sha1(f"{url}|{affinity_key}".encode("utf-8")).digest()
+                )
+                if self._outstanding[preferred] <= self._outstanding[least] + self.affinity_slack:
+                    chosen = preferred
+            self._outstanding[chosen] += 1
+            return chosen
+
+    def _done(self, base_url: str, failed: bool):
+        with self._lock:
+            self._outstanding[base_url] -= 1
+            if failed:
+                self._mark_unhealthy(base_url)
+            else:
+                self._failures[base_url] = 0
+                self._unhealthy_until[base_url] = 0.0
+
+    def _mark_unhealthy(self, base_url: str):
+        self._failures[base_url] += 1
+        delay = min(60.0, self.cooldown * 2 ** (self._failures[base_url] - 1))
+        self._unhealthy_until[base_url] = time.monotonic() + delay
+
+    def chat_completion(self, call_site: str, affinity_key: Optional[str] = None, **kwargs):
+        """
+        Send a request through the gateway to a replica, failing over on overload
+
+        Args:
+            call_site: Name of the code path making the request
+            affinity_key: Optional key of requests that should share a replica
+            **kwargs: Arguments for client.chat.completions.create (not streamed)
+        """
+        # Attempts on one replica add up to one congestion signal for its limiter
+        token = _current_call.set(set())
+        try:
+            return self._chat_completion(call_site, affinity_key, **kwargs)
+        finally:
+            _current_call.reset(token)
+
+    def _chat_completion(self, call_site: str, affinity_key: Optional[str], **kwargs):
+        tried: Tuple[str, ...] = ()
+        retries = 0
+        while True:
+            base_url = self.choose(affinity_key, exclude=tried)
+            try:
+                response = chat_completion(self.clients[base_url], call_site, **kwargs)
+            except OVERLOAD_ERRORS:
+                self._done(base_url, failed=True)
+                if retries >= self.max_retries:
+                    raise
+                retries += 1
+                tried += (base_url,)
+                if len(tried) >= len(self.base_urls):
+                    # Every replica failed this request: back off, then start another round
+                    tried = ()
+                    time.sleep(min(8.0, 0.5 * 2 ** (retries - 1)))
+                else:
+                    metrics.incr("llm_endpoints.failovers")
+                continue
+            except Exception:
+                self._done(base_url, failed=False)
+                raise
+            self._done(base_url, failed=False)
+            return response
+
+    def _health_check_loop(self):
+        while not self._closed.wait(self.health_check_interval):
+            now = time.monotonic()
+            with self._lock:
+                failed = [url for url in self.base_urls if self._failures[url] and self._unhealthy_until[url] <= now]
+            for base_url in failed:
+                try:
+                    self.clients[base_url].with_options(timeout=5, max_retries=0).models.list()
+                    healthy = True
+                except Exception:
+                    healthy = False
+                with self._lock:
+                    if healthy:
+                        self._failures[base_url] = 0
+                        self._unhealthy_until[base_url] = 0.0
+                    else:
+                        self._mark_unhealthy(base_url)
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        now = time.monotonic()
+        with self._lock:
+            return {
+                url: {"outstanding": self._outstanding[url], "healthy": self._healthy(url, now)}
+                for url in self.base_urls
+            }
+
+    def close(self):
+        """Stop the health checks; the clients belong to the shared pool"""
+        self._closed.set()
+
+# Shared tracker exposed through /api/utils/metrics
+llm_usage = LLMUsageTracker()
+
+# Shared clients, closed by the application lifespan hook
+llm_clients = ClientPool(
+    timeout=float(os.getenv("LLM_TIMEOUT", LLM_TIMEOUT)),
+    max_retries=int(os.getenv("LLM_MAX_RETRIES", LLM_MAX_RETRIES)),
+    max_connections=int(os.getenv("LLM_MAX_CONNECTIONS", LLM_MAX_CONNECTIONS)),
+    default_concurrency=int(os.getenv("LLM_DEFAULT_CONCURRENCY", LLM_DEFAULT_CONCURRENCY))
+)
@@ -0,0 +1,20 @@
+import threading
+from collections import defaultdict
+from typing import Dict
+
+class Metrics:
+    def __init__(self):
+        """In-process counters exposed through /api/utils/metrics"""
+        self._lock = threading.Lock()
+        self._counters: Dict[str, float] = defaultdict(int)
+
+    def incr(self, name: str, value: float = 1):
+        with self._lock:
+            self._counters[name] += value
+
+    def snapshot(self) -> Dict[str, float]:
+        with self._lock:
+            return dict(sorted(self._counters.items()))
+
+# Shared metrics registry
+metrics = Metrics()
@@ -1,26 +1,76 @@
 import os
+import re
 import time
 import uuid
 import requests
 import zipfile
 import tempfile
 import shutil
+import threading
+import multiprocessing
+from abc import ABC, abstractmethod
+from collections import Counter
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from dotenv import load_dotenv
 
+from services.artifact_store import link_or_copy, link_tree
+from services.llm_gateway import ContextThreadPoolExecutor
+from constants import (
+    MINERU_UPLOAD_CONCURRENCY, MINERU_DOWNLOAD_CONCURRENCY,
+    MINERU_POLL_MIN_INTERVAL, MINERU_POLL_MAX_INTERVAL, MINERU_TIMEOUT,
+    MINERU_ZIP_SPOOL_BYTES, MINERU_EXTRACT_IMAGES,
+    LOCAL_PDF_WORKERS
+)
+
 # Load environment variables
 load_dotenv()
 
-class PDFProcessor:
-    def __init__(self, api_key=None, api_url="https://mineru.net/api/v4"):
+class PDFBackend(ABC):
+    """
+    Interface of the PDF-to-Markdown backends
+    
+    A backend writes each PDF to {output_folder}/{base_name}/{base_name}.md,
+    with figures (if any) in an images/ directory next to it.
+    """
+    # Backend name, used to keep the cached output of different backends apart
+    name = "base"
+    
+    def process_pdfs(self, pdf_folder, output_folder):
+        """
+        Process PDF files in the specified folder and save results to output folder
+        
+        Args:
+            pdf_folder: Path to folder containing PDF files
+            output_folder: Path to folder where results will be saved
+            
+        Returns:
+            List of paths to processed Markdown files
+        """
+        pdf_paths = [os.path.join(pdf_folder, f) for f in os.listdir(pdf_folder) if f.lower().endswith('.pdf')]
+        return self.process_pdf_files(pdf_paths, output_folder)
+    
+    @abstractmethod
+    def process_pdf_files(self, pdf_paths, output_folder, on_file_processed=None):
+        pass
+    
+    def close(self):
+        pass
+
+class PDFProcessor(PDFBackend):
+    name = "mineru"
+    
+    def __init__(self, api_key=None, api_url="https://mineru.net/api/v4", include_images=MINERU_EXTRACT_IMAGES):
         """
         Initialize the PDF processor with API key and URL
         
         Args:
             api_key: MinerU API key (if None, will try to read from api.txt or environment)
             api_url: MinerU API URL
+            include_images: Whether to extract the figures next to the Markdown files
         """
         self.api_key = api_key
+        self.include_images = include_images
         
         # Try to get API key from environment if not provided
         if not self.api_key:
@@ -38,13 +88,18 @@ class PDFProcessor:
             "Authorization": self.bearer_token
         }
         
-    def process_pdfs(self, pdf_folder, output_folder):
+    def process_pdf_files(self, pdf_paths, output_folder, on_file_processed=None):
         """
-        Process PDF files in the specified folder and save results to output folder
+        Process the given PDF files and save results to output folder
+        
+        Files are uploaded concurrently. Each result is downloaded and extracted
+        as soon as MinerU reports it done, while the rest of the batch is still
+        being parsed.
         
         Args:
-            pdf_folder: Path to folder containing PDF files
+            pdf_paths: Paths to the PDF files, read in place without staging
             output_folder: Path to folder where results will be saved
+            on_file_processed: Optional callback invoked with each Markdown path as soon as it is ready
             
         Returns:
             List of paths to processed Markdown files
@@ -53,16 +108,16 @@ class PDFProcessor:
         os.makedirs(output_folder, exist_ok=True)
         
         # 1. Collect all PDF files
-        pdf_files = [f for f in os.listdir(pdf_folder) if f.lower().endswith('.pdf')]
-        if not pdf_files:
+        if not pdf_paths:
             print("No PDF files found")
             return []
 
         # 2. Prepare request data
         files_data = []
-        for pdf_file in pdf_files:
+        for pdf_path in pdf_paths:
             files_data.append({
-                "name": pdf_file,
+                "name": os.path.basename(pdf_path),
+                "path": pdf_path,
                 "is_ocr": True,
                 "data_id": str(uuid.uuid4())
             })
@@ -73,11 +128,15 @@ class PDFProcessor:
             "language": "ch",
             "layout_model": "doclayout_yolo",
             "enable_table": True,
-            "files": files_data
+            "files": [
+                {key: value for key, value in file_info.items() if key != "path"}
+                for file_info in files_data
+            ]
         }
 
+        session = requests.Session()
         try:
-            response = requests.post(self.batch_url, headers=self.headers, json=payload)
+            response = session.post(self.batch_url, headers=self.headers, json=payload, timeout=30)
             if response.status_code != 200:
                 print(f"Initialization request failed: {response.status_code}")
                 return []
@@ -86,104 +145,456 @@ class PDFProcessor:
             batch_id = result["data"]["batch_id"]
             upload_urls = result["data"]["file_urls"]
 
-            # 4. Upload all PDF files
-            for idx, file_info in enumerate(files_data):
-                pdf_path = os.path.join(pdf_folder, file_info["name"])
-                with open(pdf_path, "rb") as f:
-                    upload_res = requests.put(upload_urls[idx], data=f)
-                    if upload_res.status_code != 200:
-                        print(f"Upload failed: {file_info['name']}")
-                        continue
-                    print(f"Upload successful: {file_info['name']}")
+            # 4. Upload all PDF files concurrently
+            with ContextThreadPoolExecutor(max_workers=min(MINERU_UPLOAD_CONCURRENCY, len(files_data))) as executor:
+                uploaded = list(executor.map(
+                    lambda args: self._upload_file(session, *args),
+                    zip(upload_urls, files_data)
+                ))
 
+            pending = {file_info["name"] for file_info, ok in zip(files_data, uploaded) if ok}
+            if not pending:
+                return []
             print("All files uploaded successfully, waiting for processing...")
 
-            # 5. Poll for processing results
+            # 5. Poll with backoff and hand each finished file to a download worker
             processed_files = []
-            while True:
-                time.sleep(3)
-                res = requests.get(f"{self.results_url}/{batch_id}", headers=self.headers)
-                res_data = res.json()
-                
-                batch_status = res_data["data"]
-                all_done = True
-                results = []
-
-                for item in batch_status["extract_result"]:
-                    if item["state"] == "done":
-                        results.append(item)
-                    elif item["state"] == "failed":
-                        print(f"Processing failed: {item['file_name']} - {item.get('err_msg', 'Unknown error')}")
-                    else:
-                        all_done = False
+            with ContextThreadPoolExecutor(max_workers=MINERU_DOWNLOAD_CONCURRENCY) as executor:
+                futures = []
+                interval = MINERU_POLL_MIN_INTERVAL
+                deadline = time.monotonic() + MINERU_TIMEOUT
 
-                if all_done:
-                    print("All files processed")
-                    break
-
-            # 6. Download and process results
-            for item in results:
-                if not item.get("full_zip_url"):
-                    continue
-
-                # Download ZIP file
-                zip_url = item["full_zip_url"]
-                file_name = item["file_name"]
-                print(f"Processing: {file_name}")
-
-                # Create temporary directory
-                with tempfile.TemporaryDirectory() as tmp_dir:
-                    zip_path = os.path.join(tmp_dir, "temp.zip")
-                    
-                    # Download file
-                    zip_res = requests.get(zip_url)
-                    if zip_res.status_code != 200:
-                        print(f"Download failed: {file_name}")
-                        continue
-                    
-                    with open(zip_path, "wb") as f:
-                        f.write(zip_res.content)
-
-                    # Extract files
-                    with zipfile.ZipFile(zip_path, "r") as zip_ref:
-                        zip_ref.extractall(tmp_dir)
-
-                    # Find extracted directory
-                    extracted_dir = None
-                    for root, dirs, files in os.walk(tmp_dir):
-                        if "full.md" in files and "images" in dirs:
-                            extracted_dir = root
-                            break
-
-                    if not extracted_dir:
-                        print(f"Abnormal file structure: {file_name}")
+                while pending:
+                    if time.monotonic() + interval > deadline:
+                        print(f"Processing timed out, unfinished files: {', '.join(sorted(pending))}")
+                        break
+                    time.sleep(interval)
+
+                    try:
+                        res = session.get(f"{self.results_url}/{batch_id}", headers=self.headers, timeout=30)
+                        extract_results = res.json()["data"]["extract_result"]
+                    except Exception as e:
+                        print(f"Polling failed: {e}")
+                        interval = min(interval * 2, MINERU_POLL_MAX_INTERVAL)
                         continue
 
-                    # Prepare output directory
-                    base_name = os.path.splitext(file_name)[0]
-                    output_dir = os.path.join(output_folder, base_name)
-                    os.makedirs(output_dir, exist_ok=True)
+                    progressed = False
+                    for item in extract_results:
+                        if item["file_name"] not in pending:
+                            continue
+                        if item["state"] == "done":
+                            pending.discard(item["file_name"])
+                            futures.append(executor.submit(self._download_result, session, item, output_folder, on_file_processed))
+                            progressed = True
+                        elif item["state"] == "failed":
+                            pending.discard(item["file_name"])
+                            print(f"Processing failed: {item['file_name']} - {item.get('err_msg', 'Unknown error')}")
+                            progressed = True
 
-                    # Process Markdown file
-                    md_source = os.path.join(extracted_dir, "full.md")
-                    md_target = os.path.join(output_dir, f"{base_name}.md")
-                    shutil.copy(md_source, md_target)
+                    # Poll quickly while files are finishing, back off while MinerU is busy
+                    if progressed:
+                        interval = MINERU_POLL_MIN_INTERVAL
+                    else:
+                        interval = min(interval * 1.5, MINERU_POLL_MAX_INTERVAL)
 
-                    # Process images directory
-                    images_source = os.path.join(extracted_dir, "images")
-                    images_target = os.path.join(output_dir, "images")
-                    if os.path.exists(images_target):
-                        shutil.rmtree(images_target)
-                    shutil.copytree(images_source, images_target)
+                if not pending:
+                    print("All files processed")
 
-                    processed_files.append(md_target)
-                    print(f"Processing completed: {file_name}")
+                # 6. Collect the downloaded and extracted results
+                for future in futures:
+                    md_target = future.result()
+                    if md_target:
+                        processed_files.append(md_target)
 
             return processed_files
 
         except Exception as e:
             print(f"Error occurred: {str(e)}")
             return []
+        finally:
+            session.close()
+
+    @staticmethod
+    def _upload_file(session, upload_url, file_info):
+        try:
+            with open(file_info["path"], "rb") as f:
+                upload_res = session.put(upload_url, data=f, timeout=300)
+            if upload_res.status_code != 200:
+                print(f"Upload failed: {file_info['name']}")
+                return False
+            print(f"Upload successful: {file_info['name']}")
+            return True
+        except Exception as e:
+            print(f"Upload failed: {file_info['name']} - {e}")
+            return False
+
+    def _download_result(self, session, item, output_folder, on_file_processed=None):
+        """Download and extract the result of one file, returning the Markdown path"""
+        if not item.get("full_zip_url"):
+            return None
+
+        zip_url = item["full_zip_url"]
+        file_name = item["file_name"]
+        print(f"Processing: {file_name}")
+
+        base_name = os.path.splitext(file_name)[0]
+        output_dir = os.path.join(output_folder, base_name)
+        try:
+            # Stream the ZIP into a buffer that only spills to disk for large results
+            with session.get(zip_url, stream=True, timeout=300) as zip_res:
+                if zip_res.status_code != 200:
+                    print(f"Download failed: {file_name}")
+                    return None
+
+                with tempfile.SpooledTemporaryFile(max_size=MINERU_ZIP_SPOOL_BYTES) as buffer:
+                    for chunk in zip_res.iter_content(chunk_size=64 * 1024):
+                        buffer.write(chunk)
+                    buffer.seek(0)
+
+                    with zipfile.ZipFile(buffer) as zip_ref:
+                        md_target = _extract_markdown(zip_ref, output_dir, base_name, self.include_images)
+        except Exception as e:
+            print(f"Processing failed: {file_name} - {e}")
+            return None
+
+        if not md_target:
+            print(f"Abnormal file structure: {file_name}")
+            return None
+
+        print(f"Processing completed: {file_name}")
+        if on_file_processed:
+            try:
+                on_file_processed(md_target)
+            except Exception as e:
+                print(f"Callback failed for {file_name}: {e}")
+        return md_target
+
+def _extract_markdown(zip_ref, output_dir, base_name, include_images=True):
+    """
+    Extract full.md (and optionally its images) from a MinerU result archive
+    
+    Only the needed members are read; layout and intermediate JSON files are skipped.
+    
+    Returns:
+        Path to {output_dir}/{base_name}.md, or None if the archive has no full.md
+    """
+    names = zip_ref.namelist()
+    md_members = [name for name in names if name == "full.md" or name.endswith("/full.md")]
+    if not md_members:
+        return None
+
+    # Prefer the shallowest full.md, in case the archive nests a copy
+    md_member = min(md_members, key=lambda name: name.count("/"))
+    prefix = md_member[:-len("full.md")]
+
+    os.makedirs(output_dir, exist_ok=True)
+    md_target = os.path.join(output_dir, f"{base_name}.md")
+    with zip_ref.open(md_member) as src, open(md_target, "wb") as dst:
+        shutil.copyfileobj(src, dst)
+
+    images_target = os.path.join(output_dir, "images")
+    if os.path.exists(images_target):
+        shutil.rmtree(images_target)
+    if include_images:
+        images_prefix = f"{prefix}images/"
+        for name in names:
+            if not name.startswith(images_prefix) or name.endswith("/"):
+                continue
+            relative_path = os.path.normpath(name[len(images_prefix):])
+            # Never write outside the images directory
+            if relative_path.startswith("..") or os.path.isabs(relative_path):
+                continue
+            image_target = os.path.join(images_target, relative_path)
+            os.makedirs(os.path.dirname(image_target), exist_ok=True)
+            with zip_ref.open(name) as src, open(image_target, "wb") as dst:
+                shutil.copyfileobj(src, dst)
+
+    return md_target
+
+class LocalPDFProcessor(PDFBackend):
+    name = "local"
+    
+    def __init__(self, max_workers=LOCAL_PDF_WORKERS):
+        """
+        Convert PDFs to Markdown on this machine, without the MinerU API
+        
+        Text is extracted with PyMuPDF, or pdfminer.six if PyMuPDF is not
+        installed, and section headings are recovered with font-size and
+        numbering heuristics. Formulas, tables and figures are not reconstructed,
+        so this trades fidelity for latency and works offline.
+        
+        Args:
+            max_workers: Number of worker processes
+        """
+        _text_extractor()  # fail early if neither library is installed
+        self.max_workers = max_workers
+        self._executor = None
+        self._executor_lock = threading.Lock()
+    
+    def _get_executor(self):
+        with self._executor_lock:
+            if self._executor is None:
+                # Spawned workers do not inherit the locks of the server's threads
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context("spawn")
+                )
+            return self._executor
+    
+    def process_pdf_files(self, pdf_paths, output_folder, on_file_processed=None):
+        """
+        Process the given PDF files and save results to output folder
+        
+        Args:
+            pdf_paths: Paths to the PDF files
+            output_folder: Path to folder where results will be saved
+            on_file_processed: Optional callback invoked with each Markdown path as soon as it is ready
+            
+        Returns:
+            List of paths to processed Markdown files
+        """
+        os.makedirs(output_folder, exist_ok=True)
+        if not pdf_paths:
+            print("No PDF files found")
+            return []
+        
+        executor = self._get_executor()
+        futures = {}
+        for pdf_path in pdf_paths:
+            base_name = os.path.splitext(os.path.basename(pdf_path))[0]
+            md_path = os.path.join(output_folder, base_name, f"{base_name}.md")
+            futures[executor.submit(convert_pdf_to_markdown, pdf_path, md_path)] = pdf_path
+        
+        md_files = {}
+        for future in as_completed(futures):
+            file_name = os.path.basename(futures[future])
+            try:
+                md_target = future.result()
+            except Exception as e:
+                print(f"Processing failed: {file_name} - {e}")
+                continue
+            
+            print(f"Processing completed: {file_name}")
+            md_files[futures[future]] = md_target
+            if on_file_processed:
+                try:
+                    on_file_processed(md_target)
+                except Exception as e:
+                    print(f"Callback failed for {file_name}: {e}")
+        
+        return [md_files[pdf_path] for pdf_path in pdf_paths if pdf_path in md_files]
+    
+    def close(self):
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+_SECTION_NAMES = (
+    "abstract", "introduction", "background", "related work", "preliminaries",
+    "method", "methods", "methodology", "approach", "experiments", "experimental setup",
+    "results", "evaluation", "discussion", "limitations", "conclusion", "conclusions",
+    "acknowledgments", "acknowledgements", "references", "bibliography", "appendix"
+)
+# "3 Method", "3.2 Training", "A.1 Proofs"
+_NUMBERED_HEADING = re.compile(r"^(\d{1,2}(?:\.\d{1,2})*|[A-Z](?:\.\d{1,2})+)\.?\s+([A-Z][^.!?]{1,80})$")
+
+def _heading_level(line):
+    """Guess the Markdown heading level of a line from its wording, or 0 for body text"""
+    text = line.strip()
+    if not text or len(text) > 100:
+        return 0
+    if text.lower().rstrip(":") in _SECTION_NAMES:
+        return 2
+    match = _NUMBERED_HEADING.match(text)
+    if match:
+        return 2 + match.group(1).count(".")
+    return 0
+
+def _join_lines(lines):
+    """Join the lines of a paragraph, undoing end-of-line hyphenation"""
+    text = ""
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        if text.endswith("-") and line[:1].islower():
+            text = text[:-1] + line
+        else:
+            text = f"{text} {line}" if text else line
+    return text
+
+def _import_pymupdf():
+    try:
+        import pymupdf
+    except ImportError:
+        import fitz as pymupdf  # PyMuPDF < 1.24
+    return pymupdf
+
+def _text_extractor():
+    try:
+        _import_pymupdf()
+        return _extract_with_pymupdf
+    except ImportError:
+        pass
+    try:
+        import pdfminer  # pdfminer.six
+        return _extract_with_pdfminer
+    except ImportError:
+        raise ImportError("Local PDF processing requires PyMuPDF (pip install pymupdf) or pdfminer.six (pip install pdfminer.six)")
+
+def _extract_with_pymupdf(pdf_path):
+    pymupdf = _import_pymupdf()
+    
+    with pymupdf.open(pdf_path) as doc:
+        blocks = []
+        for page in doc:
+            for block in page.get_text("dict")["blocks"]:
+                lines = []
+                for line in block.get("lines", []):
+                    spans = [span for span in line["spans"] if span["text"].strip()]
+                    if spans:
+                        size = max(span["size"] for span in spans)
+                        bold = all(span["flags"] & 16 for span in spans)
+                        lines.append(("".join(span["text"] for span in spans), size, bold))
+                if lines:
+                    blocks.append(lines)
+    
+    # The most common font size, weighted by characters, is the body text size
+    sizes = Counter()
+    for lines in blocks:
+        for text, size, _ in lines:
+            sizes[round(size)] += len(text)
+    body_size = sizes.most_common(1)[0][0] if sizes else 0
+    
+    parts = []
+    for lines in blocks:
+        text = _join_lines(line[0] for line in lines)
+        size = max(line[1] for line in lines)
+        bold = all(line[2] for line in lines)
+        level = _heading_level(text)
+        if not level and len(text) <= 100:
+            if size >= body_size * 1.6:
+                level = 1
+            elif size >= body_size * 1.15 or (bold and len(lines) == 1 and len(text.split()) <= 8):
+                level = 2
+        parts.append(f"{'#' * level} {text}" if level else text)
+    return parts
+
+def _extract_with_pdfminer(pdf_path):
+    from pdfminer.high_level import extract_text
+    
+    parts = []
+    for paragraph in re.split(r"\n\s*\n", extract_text(pdf_path)):
+        lines = [line for line in paragraph.splitlines() if line.strip()]
+        if not lines:
+            continue
+        # Headings often share a paragraph with the text that follows them
+        level = _heading_level(lines[0])
+        if level:
+            parts.append(f"{'#' * level} {lines[0].strip()}")
+            lines = lines[1:]
+        if lines:
+            parts.append(_join_lines(lines))
+    return parts
+
+def convert_pdf_to_markdown(pdf_path, md_path):
+    """
+    Convert one PDF to Markdown with the local text extractor
+    
+    Runs in a worker process of LocalPDFProcessor.
+    
+    Args:
+        pdf_path: Path to the PDF file
+        md_path: Path of the Markdown file to write
+        
+    Returns:
+        md_path
+    """
+    parts = _text_extractor()(pdf_path)
+    if not parts:
+        raise ValueError("no extractable text, the PDF may be scanned")
+    
+    os.makedirs(os.path.dirname(md_path), exist_ok=True)
+    with open(md_path, "w", encoding="utf-8") as f:
+        f.write("\n\n".join(parts) + "\n")
+    return md_path
+
+def process_pdfs_with_cache(processor, pdf_paths, work_dir, store, on_markdown=None):
+    """
+    Convert PDFs to Markdown, reusing output cached under each PDF's SHA-256
+    
+    Args:
+        processor: PDF backend used for PDFs that are not cached yet
+        pdf_paths: Paths to the PDF files
+        work_dir: Task directory; all Markdown files end up in work_dir/mdss
+        store: ArtifactStore holding the converted output
+        on_markdown: Optional callback invoked with each Markdown path as soon as it is ready
+        
+    Returns:
+        List of paths to processed Markdown files, in the order of pdf_paths
+    """
+    output_folder = os.path.join(work_dir, "mdss")
+    os.makedirs(output_folder, exist_ok=True)
+    
+    md_files = {}
+    pending = {}
+    for pdf_path in pdf_paths:
+        base_name = os.path.splitext(os.path.basename(pdf_path))[0]
+        digest = store.file_sha256(pdf_path)
+        key = store.sha256_key(digest, processor.name)
+        
+        with store.lock(key):
+            entry_dir = store.get(key)
+            if entry_dir:
+                print(f"Using cached Markdown: {os.path.basename(pdf_path)}")
+                md_files[pdf_path] = _materialize_markdown(entry_dir, output_folder, base_name)
+        
+        if pdf_path in md_files:
+            if on_markdown:
+                on_markdown(md_files[pdf_path])
+            continue
+        
+        pending[base_name] = (pdf_path, digest)
+    
+    def on_file_processed(md_file):
+        base_name = os.path.splitext(os.path.basename(md_file))[0]
+        if base_name not in pending:
+            return
+        
+        pdf_path, digest = pending[base_name]
+        md_files[pdf_path] = md_file
+        
+        files = {"full.md": md_file}
+        images_dir = os.path.join(os.path.dirname(md_file), "images")
+        if os.path.isdir(images_dir):
+            files["images"] = images_dir
+        key = store.sha256_key(digest, processor.name)
+        with store.lock(key):
+            store.put(key, files)
+        
+        if on_markdown:
+            on_markdown(md_file)
+    
+    if pending:
+        pending_paths = [pdf_path for pdf_path, _ in pending.values()]
+        processor.process_pdf_files(pending_paths, output_folder, on_file_processed=on_file_processed)
+    
+    return [md_files[pdf_path] for pdf_path in pdf_paths if pdf_path in md_files]
+
+def _materialize_markdown(entry_dir, output_folder, base_name):
+    """Lay out a cached entry like MinerU output: {base_name}/{base_name}.md and images/"""
+    output_dir = os.path.join(output_folder, base_name)
+    os.makedirs(output_dir, exist_ok=True)
+    
+    md_target = os.path.join(output_dir, f"{base_name}.md")
+    link_or_copy(os.path.join(entry_dir, "full.md"), md_target)
+    
+    images_source = os.path.join(entry_dir, "images")
+    if os.path.isdir(images_source):
+        link_tree(images_source, os.path.join(output_dir, "images"))
+    
+    return md_target
 
 # Function to maintain compatibility with original MinerU.py
 def process_pdfs_with_env():
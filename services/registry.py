@@ -0,0 +1,101 @@
+import os
+import threading
+from typing import Any, Callable, Dict
+
+from services.metrics import metrics
+
+class ServiceRegistry:
+    def __init__(self):
+        """
+        Application-scoped registry of lazily created, shared service instances
+
+        Agents and services are built once on first use and shared by every
+        request and task worker instead of being constructed per request; their
+        OpenAI clients come from the pooled clients of services.llm_gateway.
+        """
+        # Re-entrant because factories resolve their own dependencies through get()
+        self._lock = threading.RLock()
+        self._factories: Dict[str, Callable[[], Any]] = {}
+        self._instances: Dict[str, Any] = {}
+
+    def register(self, name: str, factory: Callable[[], Any]):
+        self._factories[name] = factory
+
+    def get(self, name: str) -> Any:
+        """
+        Get the shared instance, creating it on first use
+
+        Failed initializations are not cached, so a later request retries.
+        """
+        instance = self._instances.get(name)
+        if instance is None:
+            with self._lock:
+                instance = self._instances.get(name)
+                if instance is None:
+                    instance = self._factories[name]()
+                    self._instances[name] = instance
+                    metrics.incr(f"services.{name}.created")
+        metrics.incr(f"services.{name}.resolved")
+        return instance
+
+    def close(self):
+        """Close and drop all created instances"""
+        with self._lock:
+            instances, self._instances = self._instances, {}
+
+        for name, instance in instances.items():
+            close = getattr(instance, "close", None)
+            if callable(close):
+                try:
+                    close()
+                except Exception as e:
+                    print(f"Failed to close {name}: {e}")
+
+def _create_crawler():
+    from agent import Agent
+    from constants import CRAWLER_MODEL
+    return Agent(os.getenv("CRAWLER_MODEL", CRAWLER_MODEL), "crawler")
+
+def _create_selector():
+    from agent import Agent
+    from constants import SELECTOR_MODEL
+    return Agent(os.getenv("SELECTOR_MODEL", SELECTOR_MODEL), "selector")
+
+def _create_search_service():
+    from services.search_service import SearchService
+    return SearchService(crawler=registry.get("crawler"), selector=registry.get("selector"))
+
+def _create_direct_search_service():
+    from services.search_service import DirectSearchService
+    return DirectSearchService()
+
+def _create_review_service():
+    from services.review_service import ReviewService
+    from services.artifact_store import artifact_store
+    return ReviewService(
+        api_key=os.getenv("OPENAI_API_KEY"),
+        model=os.getenv("REVIEW_MODEL", "deepseek-chat"),
+        base_url=os.getenv("OPENAI_BASE_URL"),
+        store=artifact_store
+    )
+
+def _create_pdf_processor():
+    from services.pdf_service import PDFProcessor
+    from constants import MINERU_EXTRACT_IMAGES
+    include_images = os.getenv("MINERU_EXTRACT_IMAGES", str(MINERU_EXTRACT_IMAGES)).lower() in ("1", "true", "yes")
+    return PDFProcessor(api_key=os.getenv("MINERU_API_KEY"), include_images=include_images)
+
+def _create_local_pdf_processor():
+    from services.pdf_service import LocalPDFProcessor
+    from constants import LOCAL_PDF_WORKERS
+    return LocalPDFProcessor(max_workers=int(os.getenv("LOCAL_PDF_WORKERS", LOCAL_PDF_WORKERS)))
+
+# Shared registry, set up by the application lifespan hook
+registry = ServiceRegistry()
+registry.register("crawler", _create_crawler)
+registry.register("selector", _create_selector)
+registry.register("search_service", _create_search_service)
+registry.register("direct_search_service", _create_direct_search_service)
+registry.register("review_service", _create_review_service)
+registry.register("pdf_processor", _create_pdf_processor)
+registry.register("local_pdf_processor", _create_local_pdf_processor)
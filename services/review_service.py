@@ -1,21 +1,26 @@
 import os
+import re
 import json
-from typing import List, Dict, Optional, Any
+from typing import List, Dict, Optional, Any, Tuple
 from pathlib import Path
+from concurrent.futures import Future, as_completed
 import tempfile
 import shutil
-from openai import OpenAI
 from dotenv import load_dotenv
 
 # Import existing modules
 from ComparativeReviewer.KeyElementExtractor import KeyElementExtractor, PaperProcessor
 from ComparativeReviewer.ReviewSynthesizer import generate_literature_review
+from services.metrics import metrics
+from services.artifact_store import link_or_copy
+from services.llm_gateway import ContextThreadPoolExecutor, usage_stage, get_client
+from constants import DOWNLOAD_CONCURRENCY, EXTRACTION_CONCURRENCY, DESCRIPTION_SAMPLES, DESCRIPTION_VOTES
 
 # Load environment variables
 load_dotenv()
 
 class ReviewService:
-    def __init__(self, api_key=None, model="deepseek-chat", base_url=None):
+    def __init__(self, api_key=None, model="deepseek-chat", base_url=None, store=None):
         """
         Initialize the review service
         
@@ -23,7 +28,9 @@ class ReviewService:
             api_key: OpenAI API key (if None, will try to read from environment)
             model: Model to use for review generation
             base_url: Base URL for OpenAI API (if None, will use default)
+            store: Optional ArtifactStore used to cache extracted key elements
         """
+        self.store = store
         self.api_key = api_key or os.getenv("OPENAI_API_KEY")
         self.model = model
         self.base_url = base_url or os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
@@ -31,46 +38,109 @@ class ReviewService:
         if not self.api_key:
             raise ValueError("OpenAI API key not found. Please provide it or set OPENAI_API_KEY environment variable.")
         
-        # Initialize OpenAI client
-        self.client = OpenAI(
-            api_key=self.api_key,
-            base_url=self.base_url
-        )
+        # Shared, pooled client; closed by the gateway on shutdown
+        self.client = get_client(self.base_url, self.api_key)
         
         # Initialize KeyElementExtractor
         self.extractor = KeyElementExtractor(self.api_key, self.model)
     
-    def extract_key_elements(self, md_files: List[str]) -> List[Dict[str, Any]]:
+    def extract_paper(self, md_file: str) -> Tuple[Dict[str, Any], bool]:
         """
-        Extract key elements from markdown files
+        Extract key elements from a single markdown file
+        
+        Results are cached under a hash of the cleaned content, the model and the
+        question set, so papers shared between reviews are extracted only once.
         
         Args:
-            md_files: List of paths to markdown files
+            md_file: Path to the markdown file
             
         Returns:
-            List of dictionaries containing key elements for each paper
+            Tuple of the key elements of the paper and whether they came from the cache
         """
-        papers_data = []
+        # Strips image links and anchors; chunking and budgeting happen in the extractor
+        paper_content = PaperProcessor().read_paper_content(Path(md_file))
+        if not paper_content:
+            raise ValueError(f"Empty or unreadable markdown file: {md_file}")
         
-        for md_file in md_files:
-            # Read paper content
-            with open(md_file, "r", encoding="utf-8") as f:
-                paper_content = f.read()
-            
-            # Extract key elements
+        paper_id = os.path.basename(os.path.dirname(md_file))
+        key = self.store.elements_key(self.extractor.cache_key(paper_content)) if self.store else None
+        
+        cached = self.store.get_json(key, "key_elements.json") if key else None
+        if cached is not None:
+            metrics.incr("extraction_cache.hits")
+            return dict(cached, paper_id=paper_id), True
+        
+        with usage_stage("extraction"):
             paper_data = self.extractor.process_paper(paper_content)
-            paper_data["paper_id"] = os.path.basename(os.path.dirname(md_file))
-            papers_data.append(paper_data)
+        if key:
+            metrics.incr("extraction_cache.misses")
+            if self.extractor.is_complete(paper_data):
+                self.store.put_json(key, "key_elements.json", paper_data)
         
-        return papers_data
+        return dict(paper_data, paper_id=paper_id), False
     
-    def generate_review(self, papers_data: List[Dict[str, Any]], options: Dict[str, bool] = None) -> str:
+    def extract_key_elements(self, md_files: List[str], prefetched: Optional[Dict[str, Future]] = None,
+                             max_workers: int = EXTRACTION_CONCURRENCY, on_progress=None,
+                             cache_stats: Optional[Dict[str, int]] = None) -> List[Dict[str, Any]]:
+        """
+        Extract key elements from markdown files concurrently
+        
+        A paper whose extraction fails still gets an entry, with every field
+        marked as failed, so one bad paper does not fail the whole review.
+        
+        Args:
+            md_files: List of paths to markdown files
+            prefetched: Optional mapping of markdown paths to extractions already
+                started by a KeyElementPrefetcher
+            max_workers: Maximum number of concurrent extractions for papers not prefetched
+            on_progress: Optional callback invoked as on_progress(done, total) after each paper
+            cache_stats: Optional dictionary that receives the cache "hits" and "misses"
+            
+        Returns:
+            List of dictionaries containing key elements for each paper, in the order of md_files
+        """
+        if cache_stats is not None:
+            cache_stats.update({"hits": 0, "misses": 0})
+        prefetched = prefetched or {}
+        remaining = [md_file for md_file in md_files if md_file not in prefetched]
+        executor = ContextThreadPoolExecutor(max_workers=max(1, min(max_workers, len(remaining))))
+        try:
+            futures = {prefetched[md_file]: md_file for md_file in md_files if md_file in prefetched}
+            for md_file in remaining:
+                futures[executor.submit(self.extract_paper, md_file)] = md_file
+            
+            results = {}
+            for done, future in enumerate(as_completed(futures), 1):
+                md_file = futures[future]
+                try:
+                    results[md_file], cache_hit = future.result()
+                    if cache_stats is not None:
+                        cache_stats["hits" if cache_hit else "misses"] += 1
+                except Exception as e:
+                    print(f"Key element extraction failed for {md_file}: {e}")
+                    results[md_file] = {q["key"]: "提取失败" for q in self.extractor.questions}
+                    results[md_file]["paper_id"] = os.path.basename(os.path.dirname(md_file))
+                if on_progress:
+                    on_progress(done, len(futures))
+        finally:
+            # Do not wait for outstanding LLM calls if progress reporting raised (e.g. on cancellation)
+            executor.shutdown(wait=False, cancel_futures=True)
+        
+        return [results[md_file] for md_file in md_files]
+    
+    def generate_review(self, papers_data: List[Dict[str, Any]], options: Dict[str, bool] = None,
+                        on_progress=None, on_token=None, description_samples: int = DESCRIPTION_SAMPLES,
+                        description_votes: int = DESCRIPTION_VOTES) -> str:
         """
         Generate a review from paper data
         
         Args:
             papers_data: List of dictionaries containing key elements for each paper
             options: Dictionary of options for review generation
+            on_progress: Optional callback invoked as on_progress(stage, done, total)
+            on_token: Optional callback receiving the review text as it is streamed
+            description_samples: Candidate descriptions sampled per paper (1 = single description)
+            description_votes: Votes per candidate description when sampling several
             
         Returns:
             Generated review text
@@ -88,101 +158,263 @@ class ReviewService:
                     paper.pop("results", None)
         
         # Generate review
-        review = generate_literature_review(
-            refs_list=papers_data,
-            client=self.client,
-            model=self.model,
-            n_samples=2,
-            n_votes=2
-        )
+        with usage_stage("synthesis"):
+            review = generate_literature_review(
+                refs_list=papers_data,
+                client=self.client,
+                model=self.model,
+                n_samples=description_samples,
+                n_votes=description_votes,
+                on_progress=on_progress,
+                on_token=on_token
+            )
         
         return review
     
-    def process_papers_and_generate_review(self, md_files: List[str], options: Dict[str, bool] = None) -> Dict[str, Any]:
+    def process_papers_and_generate_review(self, md_files: List[str], options: Dict[str, bool] = None,
+                                           prefetched: Optional[Dict[str, Future]] = None, on_progress=None,
+                                           on_token=None, description_samples: int = DESCRIPTION_SAMPLES,
+                                           description_votes: int = DESCRIPTION_VOTES) -> Dict[str, Any]:
         """
         Process papers and generate a review
         
         Args:
             md_files: List of paths to markdown files
             options: Dictionary of options for review generation
+            prefetched: Optional extractions already started by a KeyElementPrefetcher
+            on_progress: Optional callback invoked as on_progress(stage, done, total), with stage
+                "extraction", "description" or "synthesis"
+            on_token: Optional callback receiving the review text as it is streamed
+            description_samples: Candidate descriptions sampled per paper (1 = single description)
+            description_votes: Votes per candidate description when sampling several
             
         Returns:
             Dictionary containing the review and related information
         """
         # Extract key elements
-        papers_data = self.extract_key_elements(md_files)
+        cache_stats = {}
+        on_extracted = (lambda done, total: on_progress("extraction", done, total)) if on_progress else None
+        papers_data = self.extract_key_elements(md_files, prefetched, on_progress=on_extracted, cache_stats=cache_stats)
+        lookups = cache_stats["hits"] + cache_stats["misses"]
+        cache_stats["hit_rate"] = cache_stats["hits"] / lookups if lookups else 0.0
         
         # Generate review
-        review = self.generate_review(papers_data, options)
+        review = self.generate_review(papers_data, options, on_progress, on_token,
+                                      description_samples, description_votes)
         
         # Return result
         return {
             "review": review,
             "papers_processed": len(papers_data),
-            "papers_data": papers_data
+            "papers_data": papers_data,
+            "extraction_cache": cache_stats
         }
 
+class KeyElementPrefetcher:
+    def __init__(self, review_service: ReviewService, max_workers: int = EXTRACTION_CONCURRENCY):
+        """
+        Start key-element extraction as soon as each paper's markdown is ready
+        
+        Pass submit as the on_markdown callback of process_pdfs_with_cache so the
+        LLM calls overlap with the remaining MinerU work, then hand futures to
+        ReviewService.process_papers_and_generate_review.
+        
+        Args:
+            review_service: Service used for the extraction
+            max_workers: Maximum number of concurrent extractions
+        """
+        self.review_service = review_service
+        self.executor = ContextThreadPoolExecutor(max_workers=max_workers)
+        self.futures: Dict[str, Future] = {}
+    
+    def submit(self, md_file: str):
+        if md_file not in self.futures:
+            self.futures[md_file] = self.executor.submit(self.review_service.extract_paper, md_file)
+    
+    def close(self):
+        # Drop extractions nobody is going to wait for, e.g. after a failure
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
 class PaperDownloader:
+    CHUNK_SIZE = 64 * 1024
+    
     @staticmethod
-    def download_arxiv_paper(arxiv_id: str, output_dir: str) -> Optional[str]:
+    def download_arxiv_paper(arxiv_id: str, output_dir: str, session=None) -> Optional[str]:
         """
         Download a paper from arXiv
         
+        The PDF is streamed to disk in chunks. An interrupted download leaves a
+        .part file that the next attempt resumes with a Range request guarded by
+        If-Range, so a file that changed upstream is fetched again instead of
+        being spliced onto stale bytes. A previously completed download is
+        revalidated with a conditional request instead of being fetched again.
+        
         Args:
             arxiv_id: arXiv ID of the paper
             output_dir: Directory to save the paper
+            session: Optional requests.Session to reuse connections
             
         Returns:
             Path to the downloaded PDF file, or None if download failed
         """
         import requests
-        from expand_paper import get_paper_metadata_by_id
-        
-        # Get paper metadata
-        metadata = get_paper_metadata_by_id(arxiv_id)
-        if not metadata:
-            print(f"Failed to get metadata for {arxiv_id}")
-            return None
         
-        # Download PDF
+        session = session or requests.Session()
         pdf_url = f"https://arxiv.org/pdf/{arxiv_id}.pdf"
         pdf_path = os.path.join(output_dir, f"{arxiv_id}.pdf")
+        part_path = pdf_path + ".part"
+        validators_path = pdf_path + ".validators.json"
+        part_validators_path = part_path + ".validators.json"
+        
+        headers = {}
+        if os.path.exists(pdf_path) and os.path.exists(validators_path):
+            with open(validators_path, "r", encoding="utf-8") as f:
+                validators = json.load(f)
+            if validators.get("etag"):
+                headers["If-None-Match"] = validators["etag"]
+            if validators.get("last_modified"):
+                headers["If-Modified-Since"] = validators["last_modified"]
+        
+        resume_from = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        if resume_from:
+            part_validators = {}
+            if os.path.exists(part_validators_path):
+                with open(part_validators_path, "r", encoding="utf-8") as f:
+                    part_validators = json.load(f)
+            # Only resume when the server can confirm the file is unchanged
+            if_range = part_validators.get("etag") or part_validators.get("last_modified")
+            if if_range:
+                headers["Range"] = f"bytes={resume_from}-"
+                headers["If-Range"] = if_range
         
         try:
-            response = requests.get(pdf_url)
-            if response.status_code == 200:
-                with open(pdf_path, "wb") as f:
-                    f.write(response.content)
-                return pdf_path
-            else:
-                print(f"Failed to download {arxiv_id}: HTTP {response.status_code}")
-                return None
+            with session.get(pdf_url, headers=headers, stream=True, timeout=(10, 60)) as response:
+                if response.status_code == 304:
+                    return pdf_path
+                
+                if response.status_code == 416:
+                    # The partial file is stale or already complete, start over
+                    for path in (part_path, part_validators_path):
+                        if os.path.exists(path):
+                            os.remove(path)
+                    return PaperDownloader.download_arxiv_paper(arxiv_id, output_dir, session)
+                
+                if response.status_code == 206 and "Range" in headers:
+                    mode = "ab"
+                elif response.status_code == 200:
+                    # New download, or the file changed upstream: truncate and start over
+                    mode = "wb"
+                    with open(part_validators_path, "w", encoding="utf-8") as f:
+                        json.dump({
+                            "etag": response.headers.get("ETag"),
+                            "last_modified": response.headers.get("Last-Modified")
+                        }, f)
+                else:
+                    print(f"Failed to download {arxiv_id}: HTTP {response.status_code}")
+                    return None
+                
+                with open(part_path, mode) as f:
+                    for chunk in response.iter_content(chunk_size=PaperDownloader.CHUNK_SIZE):
+                        f.write(chunk)
+            
+            os.replace(part_path, pdf_path)
+            os.replace(part_validators_path, validators_path)
+            return pdf_path
         except Exception as e:
             print(f"Failed to download {arxiv_id}: {e}")
             return None
     
     @staticmethod
-    def download_multiple_arxiv_papers(arxiv_ids: List[str], output_dir: str) -> List[Dict[str, Any]]:
+    def download_cached_arxiv_paper(arxiv_id: str, store, output_dir: str, session=None) -> Optional[str]:
+        """
+        Download a paper into its artifact store entry and link it into output_dir
+        
+        Versioned IDs (e.g. 2101.12345v2) never change on arXiv and are served
+        from the store without a request; unversioned IDs are revalidated with
+        a conditional request, falling back to the cached copy if that fails.
+        The returned file is a hard link outside the entry, so it stays readable
+        if the entry is evicted while the task is still parsing it.
+        
+        Args:
+            arxiv_id: arXiv ID of the paper
+            store: ArtifactStore holding the downloaded PDFs
+            output_dir: Directory the PDF is linked into
+            session: Optional requests.Session to reuse connections
+            
+        Returns:
+            Path to the PDF file in output_dir, or None if download failed
+        """
+        key = store.arxiv_key(arxiv_id)
+        with store.lock(key):
+            entry_dir = store.entry_path(key)
+            cached_path = os.path.join(entry_dir, f"{arxiv_id}.pdf")
+            cached = store.get(key) is not None and os.path.exists(cached_path)
+            if re.search(r"v\d+$", arxiv_id) and cached:
+                pdf_path = cached_path
+            else:
+                os.makedirs(entry_dir, exist_ok=True)
+                pdf_path = PaperDownloader.download_arxiv_paper(arxiv_id, entry_dir, session)
+                if pdf_path is None and cached:
+                    print(f"Revalidation of {arxiv_id} failed, using the cached PDF")
+                    pdf_path = cached_path
+                store.get(key)  # mark as recently used
+                store.refresh(key)
+            if pdf_path is None:
+                return None
+            
+            target_path = os.path.join(output_dir, os.path.basename(pdf_path))
+            link_or_copy(pdf_path, target_path)
+            return target_path
+    
+    @staticmethod
+    def download_multiple_arxiv_papers(arxiv_ids: List[str], output_dir: str, max_workers: int = DOWNLOAD_CONCURRENCY, store=None) -> List[Dict[str, Any]]:
         """
-        Download multiple papers from arXiv
+        Download multiple papers from arXiv concurrently
         
         Args:
             arxiv_ids: List of arXiv IDs
-            output_dir: Directory to save the papers
+            output_dir: Directory to save the papers (PDFs from the store are hard-linked here)
+            max_workers: Maximum number of concurrent downloads
+            store: Optional ArtifactStore; PDFs are then kept in and reused from the store
             
         Returns:
             List of dictionaries containing information about downloaded papers
         """
+        import requests
+        from requests.adapters import HTTPAdapter
+        from expand_paper import get_papers_metadata_by_ids
+        
         os.makedirs(output_dir, exist_ok=True)
+        if not arxiv_ids:
+            return []
+        
+        workers = max(1, min(max_workers, len(arxiv_ids)))
+        session = requests.Session()
+        session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=workers))
+        
+        with session, ContextThreadPoolExecutor(max_workers=workers + 1) as executor:
+            # One batched metadata request runs alongside the downloads
+            metadata_future = executor.submit(get_papers_metadata_by_ids, arxiv_ids)
+            if store:
+                pdf_futures = [
+                    executor.submit(PaperDownloader.download_cached_arxiv_paper, arxiv_id, store, output_dir, session)
+                    for arxiv_id in arxiv_ids
+                ]
+            else:
+                pdf_futures = [
+                    executor.submit(PaperDownloader.download_arxiv_paper, arxiv_id, output_dir, session)
+                    for arxiv_id in arxiv_ids
+                ]
+            pdf_paths = [future.result() for future in pdf_futures]
+            metadata_by_id = metadata_future.result()
+        
+        if store:
+            store.evict()
         
         downloaded_papers = []
-        for arxiv_id in arxiv_ids:
-            pdf_path = PaperDownloader.download_arxiv_paper(arxiv_id, output_dir)
+        for arxiv_id, pdf_path in zip(arxiv_ids, pdf_paths):
             if pdf_path:
-                # Get paper metadata
-                from expand_paper import get_paper_metadata_by_id
-                metadata = get_paper_metadata_by_id(arxiv_id)
-                
+                metadata = metadata_by_id.get(arxiv_id)
                 downloaded_papers.append({
                     "arxiv_id": arxiv_id,
                     "title": metadata["title"] if metadata else arxiv_id,
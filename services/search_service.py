@@ -1,6 +1,6 @@
 import os
 import json
-from typing import List, Dict, Optional, Any
+from typing import List, Dict, Optional, Any, Callable
 from pathlib import Path
 import tempfile
 import shutil
@@ -9,7 +9,7 @@ from dotenv import load_dotenv
 # Import existing modules
 from agent import Agent
 from paper_agent import PaperAgent
-from expand_paper import get_paper_metadata_by_id
+from expand_paper import get_paper_metadata_by_id, get_papers_metadata_by_ids
 from search_from_google import google_search_arxiv_id, parse_rewrites
 from constants import CRAWLER_MODEL, SELECTOR_MODEL, MAX_SEARCH_QUERIES, MAX_SEARCH_PAPERS, MAX_EXPAND_PAPERS
 
@@ -51,7 +51,8 @@ class SearchService:
             print("Warning: Google Search API key not found. Paper search functionality will be limited.")
     
     def search_papers(self, query: str, search_queries: int = MAX_SEARCH_QUERIES, 
-                     search_papers: int = MAX_SEARCH_PAPERS, expand_papers: int = MAX_EXPAND_PAPERS) -> Dict[str, Any]:
+                     search_papers: int = MAX_SEARCH_PAPERS, expand_papers: int = MAX_EXPAND_PAPERS,
+                     on_paper: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
         """
         Search for papers related to the query without citation expansion
         
@@ -60,6 +61,7 @@ class SearchService:
             search_queries: Number of search queries to generate
             search_papers: Number of papers to search per query
             expand_papers: Number of papers to expand per layer
+            on_paper: Optional callback invoked with each paper as soon as it has been scored
             
         Returns:
             Dictionary containing search results
@@ -80,21 +82,13 @@ class SearchService:
             google_key=self.google_key
         )
         
-        # Run the search only (no expansion)
-        paper_agent.search()
-        
-        # Extract relevant papers for the response
+        # Run the search only (no expansion), reporting papers as they are scored
         papers = []
-        for query, papers_list in paper_agent.root.child.items():
-            for paper in papers_list:
-                papers.append({
-                    "title": paper.title,
-                    "arxiv_id": paper.arxiv_id,
-                    "abstract": paper.abstract,
-                    "score": paper.select_score,
-                    "source": paper.source,
-                    "depth": paper.depth
-                })
+        for _, paper in paper_agent.iter_search():
+            paper_dict = self._paper_to_dict(paper)
+            papers.append(paper_dict)
+            if on_paper:
+                on_paper(paper_dict)
         
         # Sort papers by relevance score
         papers.sort(key=lambda x: x["score"], reverse=True)
@@ -108,6 +102,17 @@ class SearchService:
             "root": paper_agent.root.todic()
         }
     
+    @staticmethod
+    def _paper_to_dict(paper) -> Dict[str, Any]:
+        return {
+            "title": paper.title,
+            "arxiv_id": paper.arxiv_id,
+            "abstract": paper.abstract,
+            "score": paper.select_score,
+            "source": paper.source,
+            "depth": paper.depth
+        }
+    
     def expand_citations(self, arxiv_id: str, depth: int = 1) -> Dict[str, Any]:
         """
         Expand citations for a specific paper
@@ -190,7 +195,8 @@ class SearchService:
             "sections": list(paper.child.keys())
         }
     
-    def get_paper_info(self, arxiv_id: str) -> Dict[str, Any]:
+    @staticmethod
+    def get_paper_info(arxiv_id: str) -> Dict[str, Any]:
         """
         Get information about a specific paper
         
@@ -237,10 +243,11 @@ class DirectSearchService:
         # Search for arXiv IDs
         arxiv_ids = google_search_arxiv_id(query, num=num_results, google_key=self.google_key)
         
-        # Get paper metadata
+        # Get paper metadata with a single batched arXiv request
+        metadata_by_id = get_papers_metadata_by_ids(arxiv_ids)
         papers = []
         for arxiv_id in arxiv_ids:
-            metadata = get_paper_metadata_by_id(arxiv_id)
+            metadata = metadata_by_id.get(arxiv_id)
             if metadata:
                 papers.append({
                     "title": metadata["title"],
@@ -0,0 +1,142 @@
+import os
+import json
+import asyncio
+import threading
+from typing import Any, AsyncGenerator, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+from constants import TASK_EVENT_HISTORY_TTL
+
+load_dotenv()
+
+TERMINAL_STATUSES = ("completed", "failed", "cancelled")
+
+class TaskEventBroker:
+    def __init__(self, keepalive_interval: float = 15.0, history_ttl: float = TASK_EVENT_HISTORY_TTL):
+        """
+        Initialize the event broker
+
+        Task functions run in worker threads and publish events here; the SSE
+        endpoints subscribe from the event loop. Every event is kept in a
+        per-task history so late or reconnecting subscribers can catch up.
+        Once a task reaches a terminal status its history is dropped after
+        history_ttl seconds, keeping only the terminal status event so that
+        later subscribers still receive the outcome.
+
+        Args:
+            keepalive_interval: Seconds between keep-alive comments on idle streams
+            history_ttl: Seconds the full history is kept after a terminal status
+        """
+        self.keepalive_interval = keepalive_interval
+        self.history_ttl = history_ttl
+        self._lock = threading.Lock()
+        self._history: Dict[str, List[Dict[str, Any]]] = {}
+        self._subscribers: Dict[str, List[tuple]] = {}
+        self._expiry_timers: Dict[str, threading.Timer] = {}
+
+    def publish(self, task_id: str, event: str, data: Dict[str, Any]):
+        """
+        Publish an event for a task (thread-safe)
+
+        Args:
+            task_id: ID of the task
+            event: Event type, e.g. "status" or "paper"
+            data: JSON-serializable event payload
+        """
+        with self._lock:
+            history = self._history.setdefault(task_id, [])
+            message = {"id": len(history), "event": event, "data": data}
+            history.append(message)
+            subscribers = list(self._subscribers.get(task_id, []))
+            if self.is_terminal(message) and task_id not in self._expiry_timers:
+                timer = threading.Timer(self.history_ttl, self._expire, args=(task_id,))
+                timer.daemon = True
+                self._expiry_timers[task_id] = timer
+                timer.start()
+
+        for loop, queue in subscribers:
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, message)
+            except RuntimeError:
+                # The subscriber's event loop has been closed
+                pass
+
+    def discard(self, task_id: str):
+        """Drop the event history of a task"""
+        with self._lock:
+            self._history.pop(task_id, None)
+            timer = self._expiry_timers.pop(task_id, None)
+        if timer:
+            timer.cancel()
+
+    def _expire(self, task_id: str):
+        """Drop the history of a finished task except its terminal status event"""
+        with self._lock:
+            self._expiry_timers.pop(task_id, None)
+            history = self._history.get(task_id)
+            if history:
+                self._history[task_id] = [message for message in history if self.is_terminal(message)][-1:]
+
+    @staticmethod
+    def is_terminal(message: Dict[str, Any]) -> bool:
+        return message["event"] == "status" and message["data"].get("status") in TERMINAL_STATUSES
+
+    @staticmethod
+    def format_sse(message: Dict[str, Any]) -> str:
+        data = json.dumps(message["data"], ensure_ascii=False)
+        return f"id: {message['id']}\nevent: {message['event']}\ndata: {data}\n\n"
+
+    async def subscribe(self, task_id: str, last_event_id: Optional[int] = None) -> AsyncGenerator[str, None]:
+        """
+        Stream the events of a task as server-sent events
+
+        Replays the history after last_event_id, then yields live events until
+        the task reaches a terminal status.
+
+        Args:
+            task_id: ID of the task
+            last_event_id: ID of the last event the client has already received
+        """
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        subscriber = (loop, queue)
+
+        with self._lock:
+            backlog = list(self._history.get(task_id, []))
+            self._subscribers.setdefault(task_id, []).append(subscriber)
+
+        try:
+            next_id = 0 if last_event_id is None else last_event_id + 1
+            for message in backlog:
+                if message["id"] < next_id:
+                    continue
+                next_id = message["id"] + 1
+                yield self.format_sse(message)
+                if self.is_terminal(message):
+                    return
+
+            while True:
+                try:
+                    message = await asyncio.wait_for(queue.get(), timeout=self.keepalive_interval)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+
+                # Skip events already replayed from the history
+                if message["id"] < next_id:
+                    continue
+                next_id = message["id"] + 1
+                yield self.format_sse(message)
+                if self.is_terminal(message):
+                    return
+        finally:
+            with self._lock:
+                subscribers = self._subscribers.get(task_id, [])
+                if subscriber in subscribers:
+                    subscribers.remove(subscriber)
+                if not subscribers:
+                    self._subscribers.pop(task_id, None)
+
+# Shared broker used by the search and review routers
+task_events = TaskEventBroker(history_ttl=float(os.getenv("TASK_EVENT_HISTORY_TTL", TASK_EVENT_HISTORY_TTL)))
@@ -0,0 +1,192 @@
+import os
+import heapq
+import itertools
+import threading
+from typing import Any, Callable, Dict, Optional
+
+from constants import SEARCH_WORKERS, REVIEW_WORKERS, MAX_QUEUED_SEARCH_TASKS, MAX_QUEUED_REVIEW_TASKS
+
+class QueueFullError(Exception):
+    """Raised when a task type has reached its queue-depth limit"""
+    pass
+
+class TaskCancelled(Exception):
+    """Raised inside a running task once it has been cancelled"""
+    pass
+
+class TaskQueue:
+    def __init__(self, workers: Dict[str, int], max_queued: Dict[str, int]):
+        """
+        Initialize the task queue
+
+        Each task type gets its own priority queue and worker threads, so slow
+        review jobs never occupy the workers that serve cheap search jobs.
+
+        Args:
+            workers: Number of worker threads per task type
+            max_queued: Maximum number of waiting tasks per task type
+        """
+        self.workers = dict(workers)
+        self.max_queued = dict(max_queued)
+
+        self._lock = threading.Lock()
+        self._conditions = {task_type: threading.Condition(self._lock) for task_type in self.workers}
+        self._queues = {task_type: [] for task_type in self.workers}
+        self._jobs = {}
+        self._counter = itertools.count()
+        self._threads = []
+        self._running = False
+
+    def start(self):
+        """Start the worker threads (idempotent)"""
+        with self._lock:
+            if self._running:
+                return
+            self._running = True
+
+        for task_type, count in self.workers.items():
+            for i in range(count):
+                thread = threading.Thread(
+                    target=self._worker,
+                    args=(task_type,),
+                    name=f"{task_type}-worker-{i}",
+                    daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+
+    def shutdown(self):
+        """Stop the worker threads once their current task finishes"""
+        with self._lock:
+            self._running = False
+            for condition in self._conditions.values():
+                condition.notify_all()
+        self._threads = []
+
+    def submit(self, task_type: str, task_id: str, func: Callable, *args, priority: int = 0, **kwargs):
+        """
+        Add a task to the queue
+
+        Args:
+            task_type: Task type, selects the worker pool ("search" or "review")
+            task_id: ID of the task, used for cancellation
+            func: Function to run
+            priority: Tasks with a higher priority run first
+            *args, **kwargs: Arguments passed to func
+
+        Raises:
+            QueueFullError: If the queue for task_type is full
+        """
+        if task_type not in self._queues:
+            raise ValueError(f"Unknown task type: {task_type}")
+
+        self.start()
+
+        with self._lock:
+            queue = self._queues[task_type]
+            if len(queue) >= self.max_queued[task_type]:
+                raise QueueFullError(f"Too many queued {task_type} tasks")
+
+            self._jobs[task_id] = {
+                "type": task_type,
+                "state": "queued",
+                "func": func,
+                "args": args,
+                "kwargs": kwargs,
+                "cancel_event": threading.Event()
+            }
+            heapq.heappush(queue, (-priority, next(self._counter), task_id))
+            self._conditions[task_type].notify()
+
+    def cancel(self, task_id: str) -> bool:
+        """
+        Cancel a queued or running task
+
+        Queued tasks are removed immediately. Running tasks are flagged and stop
+        at their next stage boundary (see check_cancelled).
+
+        Returns:
+            True if the task was found and cancelled, False otherwise
+        """
+        with self._lock:
+            job = self._jobs.get(task_id)
+            if not job:
+                return False
+
+            job["cancel_event"].set()
+            if job["state"] == "queued":
+                queue = self._queues[job["type"]]
+                queue[:] = [entry for entry in queue if entry[2] != task_id]
+                heapq.heapify(queue)
+                del self._jobs[task_id]
+            return True
+
+    def is_cancelled(self, task_id: str) -> bool:
+        job = self._jobs.get(task_id)
+        return bool(job and job["cancel_event"].is_set())
+
+    def check_cancelled(self, task_id: str):
+        """Raise TaskCancelled if the task has been cancelled"""
+        if self.is_cancelled(task_id):
+            raise TaskCancelled(task_id)
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """Get worker and queue-depth information per task type"""
+        with self._lock:
+            running = {task_type: 0 for task_type in self.workers}
+            for job in self._jobs.values():
+                if job["state"] == "running":
+                    running[job["type"]] += 1
+
+            return {
+                task_type: {
+                    "workers": self.workers[task_type],
+                    "queued": len(self._queues[task_type]),
+                    "running": running[task_type],
+                    "max_queued": self.max_queued[task_type]
+                }
+                for task_type in self.workers
+            }
+
+    def _next_job(self, task_type: str) -> Optional[Dict[str, Any]]:
+        condition = self._conditions[task_type]
+        queue = self._queues[task_type]
+        with condition:
+            while self._running and not queue:
+                condition.wait()
+            if not self._running:
+                return None
+
+            _, _, task_id = heapq.heappop(queue)
+            job = self._jobs[task_id]
+            job["state"] = "running"
+            job["task_id"] = task_id
+            return job
+
+    def _worker(self, task_type: str):
+        while True:
+            job = self._next_job(task_type)
+            if job is None:
+                return
+
+            try:
+                job["func"](*job["args"], **job["kwargs"])
+            except TaskCancelled:
+                print(f"Task cancelled: {job['task_id']}")
+            except Exception as e:
+                print(f"Task {job['task_id']} raised an unhandled error: {e}")
+            finally:
+                with self._lock:
+                    self._jobs.pop(job["task_id"], None)
+
+# Shared queue used by the search and review routers
+task_queue = TaskQueue(
+    workers={
+        "search": int(os.getenv("SEARCH_WORKERS", SEARCH_WORKERS)),
+        "review": int(os.getenv("REVIEW_WORKERS", REVIEW_WORKERS))
+    },
+    max_queued={
+        "search": int(os.getenv("MAX_QUEUED_SEARCH_TASKS", MAX_QUEUED_SEARCH_TASKS)),
+        "review": int(os.getenv("MAX_QUEUED_REVIEW_TASKS", MAX_QUEUED_REVIEW_TASKS))
+    }
+)
@@ -119,6 +119,8 @@ class ApiClient {
                 return taskStatus;
             } else if (taskStatus.status === 'failed') {
                 throw new Error(`Task failed: ${taskStatus.message}`);
+            } else if (taskStatus.status === 'cancelled') {
+                throw new Error('Task cancelled');
             }
             
             // Wait for the next poll
@@ -128,6 +130,54 @@ class ApiClient {
         throw new Error('Task polling timed out');
     }
 
+    /**
+     * Follow a task through its server-sent event stream until it's completed or failed
+     * @param {string} taskId - Task ID
+     * @param {string} endpoint - API endpoint for the task
+     * @param {Object} handlers - Callbacks keyed by event type (e.g. status, paper)
+     * @returns {Promise<Object>} - Task result
+     */
+    streamTask(taskId, endpoint, handlers = {}) {
+        return new Promise((resolve, reject) => {
+            const source = new EventSource(`${this.baseUrl}${endpoint}/${taskId}/events`);
+            let opened = false;
+
+            Object.keys(handlers).filter(type => type !== 'status').forEach(type => {
+                source.addEventListener(type, event => handlers[type](JSON.parse(event.data)));
+            });
+
+            source.addEventListener('status', event => {
+                opened = true;
+                const taskStatus = JSON.parse(event.data);
+                if (handlers.status) {
+                    handlers.status(taskStatus);
+                }
+
+                if (taskStatus.status === 'completed') {
+                    source.close();
+                    resolve({ task_id: taskId, ...taskStatus });
+                } else if (taskStatus.status === 'failed') {
+                    source.close();
+                    reject(new Error(`Task failed: ${taskStatus.message}`));
+                } else if (taskStatus.status === 'cancelled') {
+                    source.close();
+                    reject(new Error('Task cancelled'));
+                }
+            });
+
+            source.onerror = () => {
+                // EventSource reconnects on its own and resumes from Last-Event-ID;
+                // only give up when the stream could never be opened
+                if (!opened) {
+                    source.close();
+                    const error = new Error('Event stream unavailable');
+                    error.streamUnavailable = true;
+                    reject(error);
+                }
+            };
+        });
+    }
+
     // API-specific methods
 
     /**
@@ -235,14 +285,37 @@ class ApiClient {
     }
 
     /**
-     * Wait for task completion
+     * Cancel a queued or running task
      * @param {string} taskId - Task ID
      * @param {string} type - Task type ('search' or 'review')
+     * @returns {Promise<Object>} - Cancellation status
+     */
+    async cancelTask(taskId, type = 'search') {
+        const endpoint = type === 'review' ? '/api/review/task' : '/api/search/task';
+        return this.delete(`${endpoint}/${taskId}`);
+    }
+
+    /**
+     * Wait for task completion, streaming progress events when the browser supports it
+     * @param {string} taskId - Task ID
+     * @param {string} type - Task type ('search' or 'review')
+     * @param {Object} handlers - Callbacks keyed by event type (e.g. status, paper)
      * @returns {Promise<Object>} - Task result
      */
-    async waitForTask(taskId, type = 'search') {
+    async waitForTask(taskId, type = 'search', handlers = {}) {
         const endpoint = type === 'review' ? '/api/review/task' : '/api/search/task';
-        return this.pollTask(taskId, endpoint);
+        if (!window.EventSource) {
+            return this.pollTask(taskId, endpoint);
+        }
+
+        try {
+            return await this.streamTask(taskId, endpoint, handlers);
+        } catch (error) {
+            if (error.streamUnavailable) {
+                return this.pollTask(taskId, endpoint);
+            }
+            throw error;
+        }
     }
 
     /**
@@ -16,6 +16,9 @@ const synthesisResult = document.getElementById('synthesisResult');
 const fileDropzone = document.getElementById('fileDropzone');
 const fileInput = document.getElementById('fileInput');
 
+// Maximum number of papers in one review (MAX_REVIEW_PAPERS on the server)
+const MAX_REVIEW_PAPERS = 200;
+
 // Global variables
 let selectedPapers = [];
 let searchResultPapers = [];
@@ -156,9 +159,9 @@ function setupEventListeners() {
             const paperIndex = parseInt(paperId.replace('paper', '')) - 1;
             
             if (e.target.checked) {
-                if (selectedPapers.length >= 5) {
+                if (selectedPapers.length >= MAX_REVIEW_PAPERS) {
                     e.target.checked = false;
-                    showAlert('最多只能选择5篇论文进行对比', 'warning');
+                    showAlert(`最多只能选择${MAX_REVIEW_PAPERS}篇论文进行对比`, 'warning');
                 } else if (searchResultPapers[paperIndex]) {
                     selectedPapers.push(searchResultPapers[paperIndex]);
                 }
@@ -254,8 +257,14 @@ function performSearch(query) {
             type: 'search'
         };
         
-        // Poll for task completion
-        return pollTaskStatus(response.task_id, 'search');
+        // Wait for task completion, showing papers as soon as they are scored
+        return watchTaskStatus(response.task_id, 'search', {
+            paper: paper => {
+                searchResultPapers.push(paper);
+                searchResultPapers.sort((a, b) => b.score - a.score);
+                displaySearchResults(searchResultPapers, searchResultPapers.length);
+            }
+        });
     })
     .then(result => {
         console.log('Search completed:', result);
@@ -442,8 +451,8 @@ function handleFileUpload(files) {
         return;
     }
     
-    if (uploadedFiles.length + validFiles.length > 5) {
-        showAlert('最多只能上传5个PDF文件', 'warning');
+    if (uploadedFiles.length + validFiles.length > MAX_REVIEW_PAPERS) {
+        showAlert(`最多只能上传${MAX_REVIEW_PAPERS}个PDF文件`, 'warning');
         return;
     }
     
@@ -498,8 +507,8 @@ function generateSynthesis(papers) {
         return;
     }
     
-    if (papers.length > 5) {
-        showAlert('最多只能选择5篇论文进行对比', 'warning');
+    if (papers.length > MAX_REVIEW_PAPERS) {
+        showAlert(`最多只能选择${MAX_REVIEW_PAPERS}篇论文进行对比`, 'warning');
         return;
     }
     
@@ -526,8 +535,8 @@ function generateSynthesis(papers) {
                 type: 'review'
             };
             
-            // Poll for task completion
-            return pollTaskStatus(response.task_id, 'review');
+            // Wait for task completion, showing the review as it is written
+            return watchTaskStatus(response.task_id, 'review', reviewStreamHandlers(papers));
         })
         .then(result => {
             console.log('Review completed:', result);
@@ -556,8 +565,8 @@ function generateSynthesisFromUploads(files) {
         return;
     }
     
-    if (files.length > 5) {
-        showAlert('最多只能上传5个PDF文件', 'warning');
+    if (files.length > MAX_REVIEW_PAPERS) {
+        showAlert(`最多只能上传${MAX_REVIEW_PAPERS}个PDF文件`, 'warning');
         return;
     }
     
@@ -587,8 +596,8 @@ function generateSynthesisFromUploads(files) {
                 type: 'review'
             };
             
-            // Poll for task completion
-            return pollTaskStatus(response.task_id, 'review');
+            // Wait for task completion, showing the review as it is written
+            return watchTaskStatus(response.task_id, 'review', reviewStreamHandlers(files.map(f => ({ title: f.name }))));
         })
         .then(result => {
             console.log('Review completed:', result);
@@ -616,6 +625,37 @@ function displayReview(review, papers) {
     // Hide processing indicator
     processingIndicator.style.display = 'none';
     
+    renderReview(review, papers);
+    
+    // Show the review
+    synthesisResult.style.display = 'block';
+    
+    // Scroll to the review
+    synthesisResult.scrollIntoView({behavior: 'smooth'});
+}
+
+/**
+ * Handlers that show the review while its synthesis is being streamed
+ * @param {Array} papers - Papers used for the review
+ * @returns {Object} - Event handlers for watchTaskStatus
+ */
+function reviewStreamHandlers(papers) {
+    let review = '';
+    return {
+        token: chunk => {
+            review += chunk.text;
+            renderReview(review, papers);
+            synthesisResult.style.display = 'block';
+        }
+    };
+}
+
+/**
+ * Render a (possibly partial) review into the review container
+ * @param {string} review - Review text
+ * @param {Array} papers - Papers used for the review
+ */
+function renderReview(review, papers) {
     // Format the review (convert markdown to HTML)
     const formattedReview = formatReview(review);
     
@@ -636,12 +676,6 @@ function displayReview(review, papers) {
             ${formattedReview}
         </div>
     `;
-    
-    // Show the review
-    synthesisResult.style.display = 'block';
-    
-    // Scroll to the review
-    synthesisResult.scrollIntoView({behavior: 'smooth'});
 }
 
 /**
@@ -688,6 +722,43 @@ function formatReview(review) {
     return html;
 }
 
+/**
+ * Follow task progress over the server-sent event stream,
+ * falling back to polling when streaming is unavailable
+ * @param {string} taskId - Task ID
+ * @param {string} type - Task type ('search' or 'review')
+ * @param {Object} handlers - Extra callbacks keyed by event type (e.g. paper)
+ * @returns {Promise<Object>} - Task result
+ */
+function watchTaskStatus(taskId, type, handlers = {}) {
+    if (!window.EventSource) {
+        return pollTaskStatus(taskId, type);
+    }
+    
+    const endpoint = type === 'review' ? '/api/review/task' : '/api/search/task';
+    
+    // Update progress bar
+    const progressBar = processingIndicator.querySelector('.progress-bar');
+    if (progressBar) {
+        progressBar.style.width = '0%';
+    }
+    
+    return api.streamTask(taskId, endpoint, {
+        ...handlers,
+        status: taskStatus => {
+            if (progressBar && taskStatus.progress) {
+                progressBar.style.width = `${taskStatus.progress * 100}%`;
+            }
+        }
+    })
+    .catch(error => {
+        if (error.streamUnavailable) {
+            return pollTaskStatus(taskId, type);
+        }
+        throw error;
+    });
+}
+
 /**
  * Poll for task status
  * @param {string} taskId - Task ID
@@ -720,7 +791,7 @@ function pollTaskStatus(taskId, type) {
                     
                     if (response.status === 'completed') {
                         resolve(response);
-                    } else if (response.status === 'failed') {
+                    } else if (response.status === 'failed' || response.status === 'cancelled') {
                         reject(new Error(response.message || '任务失败'));
                     } else if (pollCount >= maxPolls) {
                         reject(new Error('任务超时'));
@@ -759,8 +830,8 @@ function expandCitations(arxivId, button) {
     .then(response => {
         console.log('Expand citations task started:', response);
         
-        // Poll for task completion
-        return pollTaskStatus(response.task_id, 'search');
+        // Wait for task completion
+        return watchTaskStatus(response.task_id, 'search');
     })
     .then(result => {
         console.log('Expand citations completed:', result);
@@ -0,0 +1,63 @@
+import os
+import shutil
+
+import pytest
+
+from services.artifact_store import ArtifactStore
+
+def _write(path, size):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(b"x" * size)
+    return path
+
+def _age(store, key, mtime):
+    os.utime(store.entry_path(key), (mtime, mtime))
+
+@pytest.fixture
+def store(tmp_path):
+    return ArtifactStore(root_dir=str(tmp_path / "store"), max_bytes=250)
+
+def test_put_and_get(store, tmp_path):
+    src = _write(str(tmp_path / "paper.pdf"), 10)
+    path = store.put(ArtifactStore.arxiv_key("hep-th/9901001"), {"paper.pdf": src})
+    assert path.endswith(os.path.join("arxiv", "hep-th_9901001"))
+    assert store.get(ArtifactStore.arxiv_key("hep-th/9901001")) == path
+    assert os.path.getsize(os.path.join(path, "paper.pdf")) == 10
+    assert store.get("arxiv/missing") is None
+
+def test_evicts_least_recently_used(store, tmp_path):
+    for i, key in enumerate(("arxiv/a", "arxiv/b")):
+        store.put(key, {"paper.pdf": _write(str(tmp_path / f"{i}.pdf"), 100)})
+        _age(store, key, 1000 + i)
+    # Reading a refreshes it, so b is now the least recently used entry
+    store.get("arxiv/a")
+    store.put("arxiv/c", {"paper.pdf": _write(str(tmp_path / "c.pdf"), 100)})
+    assert store.get("arxiv/b") is None
+    assert store.get("arxiv/a") and store.get("arxiv/c")
+    assert store._total_size == 200
+
+def test_skips_locked_entries(store, tmp_path):
+    store.put("arxiv/a", {"paper.pdf": _write(str(tmp_path / "a.pdf"), 100)})
+    _age(store, "arxiv/a", 1000)
+    store.put("arxiv/b", {"paper.pdf": _write(str(tmp_path / "b.pdf"), 100)})
+    _age(store, "arxiv/b", 2000)
+    with store.lock("arxiv/a"):
+        store.put("arxiv/c", {"paper.pdf": _write(str(tmp_path / "c.pdf"), 100)})
+    assert store.get("arxiv/a") and store.get("arxiv/c")
+    assert store.get("arxiv/b") is None
+
+def test_tracks_json_entries_written_in_place(store):
+    store.put_json("elements/x", "elements.json", {"answer": "y" * 300})
+    # A lone entry larger than the limit is evicted by its own write
+    assert store.get_json("elements/x", "elements.json") is None
+    store.put_json("elements/y", "elements.json", {"answer": "z"})
+    assert store.get_json("elements/y", "elements.json") == {"answer": "z"}
+
+def test_evict_tolerates_entries_removed_concurrently(store, tmp_path):
+    store.put("arxiv/a", {"paper.pdf": _write(str(tmp_path / "a.pdf"), 100)})
+    store.put("arxiv/b", {"paper.pdf": _write(str(tmp_path / "b.pdf"), 100)})
+    shutil.rmtree(store.entry_path("arxiv/a"))
+    store.max_bytes = 50
+    store.evict()
+    assert store._entry_sizes == {} and store._total_size == 0
@@ -0,0 +1,61 @@
+from ComparativeReviewer.KeyElementExtractor import PaperProcessor
+from services.llm_gateway import estimate_tokens
+
+PAPER = """# A Study of Things
+
+Abstract text.
+
+## 1 Introduction
+
+Intro text.
+
+## 2. Method
+
+Method text.
+
+## 7 References
+
+[1] Someone. A paper.
+
+## A.1 Appendix details
+
+Appendix text.
+"""
+
+def test_split_sections_by_heading():
+    sections = PaperProcessor.split_sections(PAPER)
+    assert [section["title"] for section in sections] == ["A Study of Things", "1 Introduction", "2. Method"]
+    assert "Method text." in sections[2]["text"]
+    assert all(section["tokens"] == estimate_tokens(section["text"]) for section in sections)
+
+def test_split_sections_drops_numbered_back_matter():
+    sections = PaperProcessor.split_sections("# 参考文献\n[1] 某论文\n\n# 附录\n附录内容")
+    assert sections == []
+    sections = PaperProcessor.split_sections("# Results\nText\n\n# IV. Acknowledgements\nThanks")
+    assert [section["title"] for section in sections] == ["Results"]
+
+def _section(title, text):
+    return {"title": title, "text": text, "tokens": estimate_tokens(text)}
+
+def test_chunk_sections_packs_small_sections():
+    sections = [_section(f"S{i}", "word " * 20) for i in range(4)]
+    chunks = PaperProcessor.chunk_sections(sections, chunk_tokens=100)
+    assert sum(len(chunk["titles"]) for chunk in chunks) == 4
+    assert len(chunks) < 4
+    assert all(chunk["tokens"] <= 100 for chunk in chunks)
+
+def test_chunk_sections_splits_long_sections():
+    text = "\n\n".join(f"Paragraph {i}. " + "token " * 40 for i in range(20))
+    chunks = PaperProcessor.chunk_sections([_section("Method", text)], chunk_tokens=200)
+    assert len(chunks) > 1
+    assert all(chunk["tokens"] <= 200 for chunk in chunks)
+    assert all(chunk["titles"][0] == "Method" for chunk in chunks)
+    # Paragraphs are kept whole and in order
+    joined = "\n\n".join(chunk["text"] for chunk in chunks)
+    assert joined == text
+
+def test_chunk_sections_cuts_oversized_paragraph():
+    text = "x" * 5000
+    chunks = PaperProcessor.chunk_sections([_section("Data", text)], chunk_tokens=300)
+    assert "".join(chunk["text"].replace("\n\n", "") for chunk in chunks) == text
+    assert all(chunk["tokens"] <= 300 for chunk in chunks)
@@ -0,0 +1,31 @@
+from ComparativeReviewer.ReviewSynthesizer import cluster_by_topic
+
+TOPICS = {
+    "vision": "image classification convolutional network imagenet pixels",
+    "language": "language model translation tokens transformer text",
+    "speech": "speech recognition audio acoustic spectrogram waveform",
+}
+
+def _texts(per_topic):
+    texts, topics = [], []
+    for i in range(per_topic):
+        for topic, words in TOPICS.items():
+            texts.append(f"Paper {i}: {words} variant{i}")
+            topics.append(topic)
+    return texts, topics
+
+def test_small_sets_form_one_cluster():
+    assert cluster_by_topic(["a", "b", "c"], cluster_size=5) == [[0, 1, 2]]
+    assert cluster_by_topic([], cluster_size=5) == [[]]
+
+def test_clusters_respect_size_and_cover_every_text():
+    texts, _ = _texts(4)
+    clusters = cluster_by_topic(texts, cluster_size=5)
+    assert sorted(i for members in clusters for i in members) == list(range(len(texts)))
+    assert all(0 < len(members) <= 5 for members in clusters)
+
+def test_groups_texts_by_topic():
+    texts, topics = _texts(4)
+    clusters = cluster_by_topic(texts, cluster_size=4)
+    assert len(clusters) == 3
+    assert all(len({topics[i] for i in members}) == 1 for members in clusters)
@@ -0,0 +1,173 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+import httpx
+import pytest
+from openai import APIConnectionError, InternalServerError
+
+from services.llm_gateway import AdaptiveLimiter, EndpointBalancer, chat_completion, llm_clients
+
+def _release(limiter, latency, completion_tokens, **kwargs):
+    limiter.acquire()
+    limiter.release(latency, completion_tokens, **kwargs)
+
+def test_limiter_grows_while_saturated():
+    limiter = AdaptiveLimiter(initial_limit=1, max_limit=4)
+    # One request at a time saturates a limit of one, but not the grown limit of two
+    for _ in range(10):
+        _release(limiter, 1.0, 100)
+    assert limiter.limit == 2
+
+def test_limiter_does_not_grow_below_limit():
+    limiter = AdaptiveLimiter(initial_limit=4)
+    for _ in range(10):
+        _release(limiter, 1.0, 100)
+    assert limiter.limit == 4
+
+def test_limiter_backs_off_on_overload():
+    limiter = AdaptiveLimiter(initial_limit=8, backoff=0.5)
+    _release(limiter, 1.0, 0, overloaded=True)
+    assert limiter.limit == 4
+
+def test_limiter_counts_overload_burst_once_per_round_trip():
+    limiter = AdaptiveLimiter(initial_limit=8, backoff=0.5)
+    for _ in range(5):
+        _release(limiter, 0.1, 0, overloaded=True)
+    assert limiter.limit == 4
+
+def test_limiter_skips_overload_already_signalled():
+    limiter = AdaptiveLimiter(initial_limit=8, backoff=0.5)
+    _release(limiter, 1.0, 0, overloaded=True, signalled=True)
+    assert limiter.limit == 8
+
+def test_limiter_ignores_mixed_call_sites_without_load():
+    limiter = AdaptiveLimiter(initial_limit=8, max_limit=8, latency_tolerance=2.0, min_latency_tokens=32)
+    # One-token scores are mostly prefill and never count as latency samples,
+    # and long reviews only compare against their own baseline
+    for _ in range(50):
+        _release(limiter, 0.5, 1, call_site="review.score")
+        _release(limiter, 20.0, 1000, call_site="review.synthesize")
+        _release(limiter, 2.0, 50, call_site="review.describe")
+    assert limiter.limit == 8
+
+def test_limiter_backs_off_on_latency_blowup():
+    limiter = AdaptiveLimiter(initial_limit=8, backoff=0.5, latency_tolerance=1.5, min_latency_tokens=32)
+    for _ in range(10):
+        _release(limiter, 2.0, 100, call_site="review.describe")
+    for _ in range(10):
+        _release(limiter, 10.0, 100, call_site="review.describe")
+    assert limiter.limit < 8
+
+class _OverloadedHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        self.server.requests += 1
+        self.rfile.read(int(self.headers.get("content-length", 0)))
+        body = json.dumps({"error": {"message": "overloaded"}}).encode()
+        self.send_response(503)
+        self.send_header("content-type", "application/json")
+        self.send_header("content-length", str(len(body)))
+        self.send_header("retry-after-ms", "10")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def overloaded_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _OverloadedHandler)
+    server.requests = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+    server.shutdown()
+    server.server_close()
+
+def test_retried_call_is_one_congestion_signal(overloaded_server):
+    server, base_url = overloaded_server
+    client = llm_clients.get(base_url, "test").with_options(max_retries=3)
+    limiter = llm_clients.endpoint_limit(base_url)
+    limiter.limit = 4.0
+    # SDK backoff usually outlasts a round trip, so each retry would pass the once-per-round-trip guard
+    limiter._round_trip = 0.001
+    with pytest.raises(InternalServerError):
+        chat_completion(client, "test", model="test-model", messages=[{"role": "user", "content": "hi"}])
+    assert server.requests == 4
+    assert limiter.limit == pytest.approx(4 * limiter.backoff)
+    assert limiter.in_flight == 0
+
+def _response(content):
+    message = SimpleNamespace(content=content)
+    return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=None)
+
+def _fake_client(base_url, outcomes):
+    """Client whose requests return or raise the next of outcomes"""
+    calls = []
+
+    def create(**kwargs):
+        calls.append(kwargs)
+        outcome = outcomes[min(len(calls), len(outcomes)) - 1]
+        if isinstance(outcome, Exception):
+            raise outcome
+        return _response(outcome)
+    client = SimpleNamespace(base_url=base_url, chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    return client, calls
+
+def _connection_error():
+    return APIConnectionError(request=httpx.Request("POST", "http://replica/v1/chat/completions"))
+
+@pytest.fixture
+def balancer():
+    base_urls = ["http://replica-a.test/v1", "http://replica-b.test/v1"]
+    balancer = EndpointBalancer(base_urls, api_key="test", cooldown=60, health_check_interval=3600)
+    yield balancer
+    balancer.close()
+
+def test_balancer_fails_over_to_healthy_replica(balancer):
+    dead, healthy = balancer.base_urls
+    balancer.clients[dead], dead_calls = _fake_client(dead, [_connection_error()])
+    balancer.clients[healthy], healthy_calls = _fake_client(healthy, ["ok"])
+    # Pin the first attempt to the failing replica
+    balancer._outstanding[healthy] = 1
+    response = balancer.chat_completion("test", model="test-model", messages=[])
+    balancer._outstanding[healthy] -= 1
+    assert response.choices[0].message.content == "ok"
+    assert len(dead_calls) == 1 and len(healthy_calls) == 1
+    assert balancer._failures[dead] == 1
+    assert balancer._outstanding == {dead: 0, healthy: 0}
+
+def test_balancer_skips_unhealthy_replica(balancer):
+    dead, healthy = balancer.base_urls
+    balancer.clients[dead], dead_calls = _fake_client(dead, [_connection_error()])
+    balancer.clients[healthy], healthy_calls = _fake_client(healthy, ["ok"])
+    balancer._outstanding[healthy] = 1
+    balancer.chat_completion("test", model="test-model", messages=[])
+    balancer._outstanding[healthy] -= 1
+    for _ in range(3):
+        balancer.chat_completion("test", model="test-model", messages=[])
+    assert len(dead_calls) == 1 and len(healthy_calls) == 4
+
+def test_balancer_raises_after_retries_exhausted(balancer, monkeypatch):
+    monkeypatch.setattr("services.llm_gateway.time.sleep", lambda seconds: None)
+    calls = []
+    for base_url in balancer.base_urls:
+        balancer.clients[base_url], replica_calls = _fake_client(base_url, [_connection_error()])
+        calls.append(replica_calls)
+    balancer.max_retries = 3
+    with pytest.raises(APIConnectionError):
+        balancer.chat_completion("test", model="test-model", messages=[])
+    assert sum(len(replica_calls) for replica_calls in calls) == 4
+    assert all(balancer._failures[base_url] == 2 for base_url in balancer.base_urls)
+
+def test_balancer_does_not_fail_over_on_request_error(balancer):
+    bad_request = ValueError("invalid request")
+    for base_url in balancer.base_urls:
+        balancer.clients[base_url], _ = _fake_client(base_url, [bad_request])
+    with pytest.raises(ValueError):
+        balancer.chat_completion("test", model="test-model", messages=[])
+    assert all(balancer._failures[base_url] == 0 for base_url in balancer.base_urls)
+
+def test_balancer_clients_leave_retries_to_balancer(balancer):
+    assert balancer.max_retries == llm_clients.max_retries
+    assert all(client.max_retries == 0 for client in balancer.clients.values())
@@ -0,0 +1,41 @@
+from ComparativeReviewer.KeyElementExtractor import BM25Index, KeyElementExtractor, tokenize
+from services.llm_gateway import estimate_tokens
+
+def test_tokenize_drops_stopwords_and_pairs_cjk():
+    assert tokenize("What method does the paper use?") == ["method", "use"]
+    assert tokenize("实验结果") == ["实验", "验结", "结果"]
+
+def test_bm25_ranks_matching_document_first():
+    index = BM25Index([
+        "We propose a transformer architecture for translation.",
+        "Experiments on ImageNet show improved accuracy over baselines.",
+        "We thank the reviewers."
+    ])
+    scores = index.scores("experimental results accuracy")
+    assert scores.index(max(scores)) == 1
+    assert index.scores("unrelated query words") == [0.0, 0.0, 0.0]
+
+def test_bm25_empty_index():
+    assert BM25Index([]).scores("anything") == []
+
+def _chunk(title, text):
+    return {"titles": [title], "text": text, "tokens": estimate_tokens(text)}
+
+def test_retrieve_prefers_matching_sections_within_budget():
+    extractor = KeyElementExtractor(api_key="test", top_k=2)
+    chunks = [
+        _chunk("Introduction", "We study the problem of noisy labels."),
+        _chunk("Related Work", "Prior work on label noise."),
+        _chunk("Experiments", "Our results improve accuracy by five points."),
+        _chunk("Conclusion", "We conclude that the method works."),
+    ]
+    index = BM25Index([" ".join(chunk["titles"]) + "\n" + chunk["text"] for chunk in chunks])
+    results_question = next(q for q in extractor.questions if q["key"] == "results")
+    selected = extractor._retrieve(index, chunks, results_question, budget=1000)
+    assert chunks[2] in selected and len(selected) <= 2
+    # Selected chunks come back in document order
+    assert selected == sorted(selected, key=chunks.index)
+
+    # The budget always admits the best chunk, then stops before exceeding it
+    selected = extractor._retrieve(index, chunks, results_question, budget=1)
+    assert selected == [chunks[2]]
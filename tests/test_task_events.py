@@ -0,0 +1,48 @@
+import asyncio
+import time
+
+from services.task_events import TaskEventBroker
+
+async def _collect(broker, task_id, last_event_id=None):
+    return [message async for message in broker.subscribe(task_id, last_event_id)]
+
+def test_replays_history_until_terminal_status():
+    broker = TaskEventBroker()
+    broker.publish("task", "status", {"status": "running"})
+    broker.publish("task", "paper", {"title": "A"})
+    broker.publish("task", "status", {"status": "completed"})
+    messages = asyncio.run(_collect(broker, "task"))
+    assert [message.split("\n")[0] for message in messages] == ["id: 0", "id: 1", "id: 2"]
+    assert "event: paper" in messages[1]
+
+def test_resumes_after_last_event_id():
+    broker = TaskEventBroker()
+    for status in ("running", "completed"):
+        broker.publish("task", "status", {"status": status})
+    messages = asyncio.run(_collect(broker, "task", last_event_id=0))
+    assert len(messages) == 1 and messages[0].startswith("id: 1")
+
+def test_streams_live_events_from_worker_threads():
+    broker = TaskEventBroker(keepalive_interval=0.05)
+
+    async def run():
+        subscription = asyncio.ensure_future(_collect(broker, "task"))
+        await asyncio.sleep(0.1)
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, broker.publish, "task", "paper", {"title": "A"})
+        await loop.run_in_executor(None, broker.publish, "task", "status", {"status": "failed"})
+        return await asyncio.wait_for(subscription, 5)
+
+    messages = asyncio.run(run())
+    events = [message for message in messages if not message.startswith(":")]
+    assert len(events) == 2 and "failed" in events[1]
+    assert ": keepalive\n\n" in messages
+    assert "task" not in broker._subscribers
+
+def test_expires_history_but_keeps_terminal_status():
+    broker = TaskEventBroker(history_ttl=0.05)
+    broker.publish("task", "paper", {"title": "A"})
+    broker.publish("task", "status", {"status": "completed"})
+    time.sleep(0.3)
+    messages = asyncio.run(_collect(broker, "task"))
+    assert len(messages) == 1 and "completed" in messages[0]
@@ -0,0 +1,84 @@
+import threading
+
+import pytest
+
+from services.task_queue import QueueFullError, TaskCancelled, TaskQueue
+
+@pytest.fixture
+def queue():
+    queue = TaskQueue(workers={"search": 1, "review": 1}, max_queued={"search": 2, "review": 2})
+    yield queue
+    queue.shutdown()
+
+def _block(queue, task_type):
+    """Occupy the only worker of task_type until the returned event is set"""
+    started, release = threading.Event(), threading.Event()
+
+    def run():
+        started.set()
+        release.wait(5)
+    queue.submit(task_type, f"{task_type}-blocker", run)
+    assert started.wait(5)
+    return release
+
+def test_runs_higher_priority_first(queue):
+    release = _block(queue, "review")
+    order, done = [], threading.Event()
+
+    def run(name):
+        order.append(name)
+        if len(order) == 2:
+            done.set()
+    queue.submit("review", "low", run, "low")
+    queue.submit("review", "high", run, "high", priority=1)
+    release.set()
+    assert done.wait(5)
+    assert order == ["high", "low"]
+
+def test_rejects_tasks_past_queue_depth(queue):
+    release = _block(queue, "review")
+    queue.submit("review", "a", lambda: None)
+    queue.submit("review", "b", lambda: None)
+    with pytest.raises(QueueFullError):
+        queue.submit("review", "c", lambda: None)
+    assert queue.stats()["review"] == {"workers": 1, "queued": 2, "running": 1, "max_queued": 2}
+    release.set()
+
+def test_task_types_do_not_share_workers(queue):
+    release = _block(queue, "review")
+    done = threading.Event()
+    queue.submit("search", "search", done.set)
+    assert done.wait(5)
+    release.set()
+
+def test_cancel_removes_queued_task(queue):
+    release = _block(queue, "review")
+    ran = threading.Event()
+    queue.submit("review", "queued", ran.set)
+    assert queue.cancel("queued")
+    assert queue.stats()["review"]["queued"] == 0
+    release.set()
+    assert not ran.wait(0.2)
+    assert not queue.cancel("unknown")
+
+def test_cancel_stops_running_task_at_checkpoint(queue):
+    started, cancelled, finished = threading.Event(), threading.Event(), threading.Event()
+
+    def run():
+        started.set()
+        cancelled.wait(5)
+        try:
+            queue.check_cancelled("running")
+        except TaskCancelled:
+            finished.set()
+            raise
+    queue.submit("review", "running", run)
+    assert started.wait(5)
+    assert queue.cancel("running")
+    assert queue.is_cancelled("running")
+    cancelled.set()
+    assert finished.wait(5)
+
+def test_unknown_task_type(queue):
+    with pytest.raises(ValueError):
+        queue.submit("crawl", "task", lambda: None)